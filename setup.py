@@ -91,14 +91,14 @@ setup(
                       'simplejson >= 1.9.2',
                       'pyOpenSSL >= 0.10', 
                       'httplib2 >= 0.6.0', 
-                      'psutil >= 0.1.3', 
                       'MySQL-python >= 1.2.3c', 
                       'pyinotify >= 0.8.9', 
                       'pip >= 1.0', 
                       'Distutils2',
                       'pyserial >= 2.5',
                       'netifaces>=0.8',
-                      'Twisted>=12.1.0'],
+                      'Twisted>=12.1.0',
+                      'pyzmq >= 13.0.0'],
     zip_safe = False,
     license = 'GPL v3',
     # namespace_packages = ['domogik', 'mpris', 'tools'],
@@ -122,6 +122,7 @@ setup(
             dmg_hub = domogik.xpl.bin.hub:main
             dmg_broker = domogik.mq.reqrep.broker:main
             dmg_forwarder = domogik.mq.pubsub.forwarder:main
+            dmg_xplzmq_proxy = domogik.xpl.bin.xplzmq_proxy:main
             """
         ],
     },
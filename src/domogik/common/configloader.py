@@ -24,9 +24,16 @@ Plugin purpose
 
 Load config from file
 
+The config file is parsed once by process and kept in a cache shared by
+all the Loader objects. The cache is checked against the inode, mtime and
+size of the file, or, when pyinotify is available, refreshed only when the
+file is modified. Loader.set() writes the file and clears the cache.
+
 Implements
 ==========
 
+- ConfigSection
+- ConfigCache
 - Loader
 
 @author: Maxence Dunnewind <maxence@dunnewind.net>
@@ -40,15 +47,203 @@ Implements
 ####################################################
 import os
 import pwd 
+import collections
 import ConfigParser
 import threading
 import time
 import fcntl
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
 
 
 CONFIG_FILE = "/etc/domogik/domogik.cfg"
 LOCK_FILE = "/var/lock/domogik/config.lock"
 
+TRUE_VALUES = ("true", "yes", "on", "1")
+
+
+def _lock():
+    '''
+    Take the lock on the config file
+    @return the lock file, to give to _unlock()
+    '''
+    if not os.path.exists(os.path.dirname(LOCK_FILE)):
+        try:
+            # note : default creation mode : 0777
+            os.mkdir(os.path.dirname(LOCK_FILE)) 
+        except:
+            raise Exception, "ConfigLoader : unable to create the directory '%s'" % os.path.dirname(LOCK_FILE)
+    if not os.path.exists(LOCK_FILE):
+        try:
+            file = open(LOCK_FILE, "w")
+            file.write("")
+            file.close()
+        except:
+            raise Exception, "ConfigLoader : unable to create the lock file '%s'" % LOCK_FILE
+    file = open(LOCK_FILE, "r+")
+    fcntl.lockf(file, fcntl.LOCK_EX)
+    return file
+
+def _unlock(file):
+    '''
+    Release the lock on the config file
+    @param file : the lock file returned by _lock()
+    '''
+    fcntl.lockf(file, fcntl.LOCK_UN)
+    file.close()
+
+
+class ConfigSection(collections.Mapping):
+    '''
+    Read only view of a section of the config file, with typed accessors
+    '''
+
+    def __init__(self, name, items):
+        '''
+        @param name : name of the section
+        @param items : list of (key, value)
+        '''
+        self.name = name
+        self._items = dict(items)
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return "ConfigSection(%s, %s)" % (self.name, self._items)
+
+    def get_int(self, key, default=None):
+        '''
+        Return a value as an int, default if the key is missing
+        '''
+        if key not in self._items:
+            return default
+        return int(self._items[key])
+
+    def get_float(self, key, default=None):
+        '''
+        Return a value as a float, default if the key is missing
+        '''
+        if key not in self._items:
+            return default
+        return float(self._items[key])
+
+    def get_bool(self, key, default=None):
+        '''
+        Return a value as a boolean (True, yes, on, 1), default if the key is missing
+        '''
+        if key not in self._items:
+            return default
+        return self._items[key].lower() in TRUE_VALUES
+
+
+class ConfigCache():
+    '''
+    Sections of the config file, parsed once for all the Loader objects
+    '''
+
+    def __init__(self, filename):
+        '''
+        @param filename : the config file
+        '''
+        self._filename = filename
+        self._lock = threading.Lock()
+        # (inode, mtime, size) of the parsed file
+        self._stamp = None
+        self._sections = None
+        self._notifier = None
+        # process of the notifier thread : a forked process has no notifier
+        self._pid = None
+        # True when the notifier says the file did not change
+        self._valid = False
+        self.loads = 0
+
+    def _get_stamp(self):
+        stat = os.stat(self._filename)
+        return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+    def _watch(self):
+        '''
+        Watch the directory of the config file : the file can be replaced
+        '''
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._notifier = None
+        if pyinotify == None or self._notifier != None:
+            return
+        cache = self
+        class ConfigEventHandler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                if event.pathname == cache._filename:
+                    cache.invalidate()
+        try:
+            wmgr = pyinotify.WatchManager()
+            mask = pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+                   pyinotify.IN_MOVED_FROM | pyinotify.IN_CREATE | pyinotify.IN_DELETE
+            self._notifier = pyinotify.ThreadedNotifier(wmgr, ConfigEventHandler())
+            self._notifier.setName("thread_config_notifier")
+            self._notifier.setDaemon(True)
+            self._notifier.start()
+            wmgr.add_watch(os.path.dirname(self._filename), mask)
+        except:
+            # no inotify (too many watches...) : the file is checked at each load
+            self._notifier = False
+
+    def _parse(self):
+        '''
+        Read the config file under the lock
+        '''
+        lock = _lock()
+        try:
+            config = ConfigParser.ConfigParser()
+            cfg_file = open(self._filename)
+            stamp = self._get_stamp()
+            config.readfp(cfg_file)
+            cfg_file.close()
+        finally:
+            _unlock(lock)
+        sections = {}
+        for name in config.sections():
+            sections[name] = ConfigSection(name, config.items(name))
+        self.loads += 1
+        return stamp, sections
+
+    def get_sections(self):
+        '''
+        Return the sections of the config file : { name : ConfigSection }
+        '''
+        # hot path : the notifier did not see any change
+        if self._valid and self._pid == os.getpid():
+            return self._sections
+        with self._lock:
+            self._watch()
+            # the notifier may invalidate the cache while the file is parsed
+            self._valid = bool(self._notifier)
+            stamp = self._get_stamp()
+            if stamp != self._stamp:
+                self._stamp, self._sections = self._parse()
+            return self._sections
+
+    def invalidate(self):
+        '''
+        The file changed : it will be read again on next access
+        '''
+        self._valid = False
+        self._stamp = None
+
+
+# shared by all the Loader objects of the process
+_cache = ConfigCache(CONFIG_FILE)
+
+
 class Loader():
     '''
     Parse Domogik config files
@@ -71,38 +266,12 @@ class Loader():
         Parse the config
         @return pair (main_config, plugin_config)
         '''
-        # lock the file
-        if not os.path.exists(os.path.dirname(LOCK_FILE)):
-            try:
-                # note : default creation mode : 0777
-                os.mkdir(os.path.dirname(LOCK_FILE)) 
-            except:
-                raise Exception, "ConfigLoader : unable to create the directory '%s'" % os.path.dirname(LOCK_FILE)
-        if not os.path.exists(LOCK_FILE):
-            try:
-                file = open(LOCK_FILE, "w")
-                file.write("")
-                file.close()
-            except:
-                raise Exception, "ConfigLoader : unable to create the lock file '%s'" % LOCK_FILE
-        file = open(LOCK_FILE, "r+")
-        fcntl.lockf(file, fcntl.LOCK_EX)
-
-        # read config file
-        self.config = ConfigParser.ConfigParser()
-        cfg_file = open(CONFIG_FILE)
-        self.config.readfp(cfg_file)
-        cfg_file.close()
-
-        # release the file lock
-        fcntl.lockf(file, fcntl.LOCK_UN)
-        file.close()
+        sections = _cache.get_sections()
+        if 'domogik' not in sections:
+            raise ConfigParser.NoSectionError('domogik')
 
         # get 'domogik' config part
-        result = self.config.items('domogik')
-        domogik_part = {}
-        for k, v in result:
-            domogik_part[k] = v
+        domogik_part = dict(sections['domogik'])
 
         # no other config part requested
         if self.part_name == None:
@@ -110,10 +279,26 @@ class Loader():
 
         # Get requested (if so) config part
         if self.part_name:
-            result =  (domogik_part, self.config.items(self.part_name))
+            if self.part_name not in sections:
+                raise ConfigParser.NoSectionError(self.part_name)
+            result =  (domogik_part, sections[self.part_name].items())
 
+        self.config = sections
         return result
 
+    def section(self, name=None):
+        '''
+        Return a read only view of a section
+        @param name : name of the section, default : the part of the loader
+        @return ConfigSection
+        '''
+        if name == None:
+            name = self.part_name or 'domogik'
+        sections = _cache.get_sections()
+        if name not in sections:
+            raise ConfigParser.NoSectionError(name)
+        return sections[name]
+
     def set(self, section, key, value):
         """ Set a key value for a section in config file and write it
             WARNING : using this function make config fil change : 
@@ -126,6 +311,15 @@ class Loader():
         # Check load is called before this function
         if self.config == None:
             raise Exception, "ConfigLoader : you must use load() before set() function"
-        self.config.set(section, key, value)
-        with open(CONFIG_FILE, "wb") as configfile:
-            self.config.write(configfile)
+        lock = _lock()
+        try:
+            config = ConfigParser.ConfigParser()
+            cfg_file = open(CONFIG_FILE)
+            config.readfp(cfg_file)
+            cfg_file.close()
+            config.set(section, key, value)
+            with open(CONFIG_FILE, "wb") as configfile:
+                config.write(configfile)
+        finally:
+            _unlock(lock)
+        _cache.invalidate()
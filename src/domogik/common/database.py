@@ -31,6 +31,7 @@ Implements
 
 - class DbHelperException(Exception) : exceptions linked to the DbHelper class
 - class DbHelper : API to use Domogik database
+- class DbHelperPool : pool of DbHelper objects reused by the threads of a server
 
 @author: Maxence DUNNEWIND / Marc SCHNEIDER
 @copyright: (C) 2007-2012 Domogik project
@@ -38,7 +39,7 @@ Implements
 @organization: Domogik
 """
 
-import datetime, hashlib, time
+import datetime, hashlib, threading, time
 
 import json
 import sqlalchemy
@@ -156,6 +157,14 @@ class DbHelper():
     def __del__(self):
         self.__session.close()
 
+    def reset_session(self):
+        """Close the session : the current transaction is rolled back, the
+        objects are detached and the connection goes back to the engine pool.
+        The session can be used again for new requests.
+
+        """
+        self.__session.close()
+
     def __rollback(self):
         """Issue a rollback to a SQL transaction (for dev purposes only)
 
@@ -1580,3 +1589,50 @@ class DbHelper():
             self.__session.rollback()
         raise DbHelperException(error_msg)
 
+
+class DbHelperPool():
+    """Pool of DbHelper objects for the servers which use the database from
+    a thread by request (REST) : the configuration is read and the session is
+    created only when no DbHelper is free
+
+    """
+
+    def __init__(self, size=10, **kwargs):
+        """Class constructor
+
+        @param size : max number of free DbHelper objects kept in the pool
+        @param kwargs : parameters given to DbHelper()
+
+        """
+        self.__size = size
+        self.__kwargs = kwargs
+        self.__free = []
+        self.__lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self):
+        """Return a free DbHelper, or a new one
+
+        """
+        with self.__lock:
+            if len(self.__free) > 0:
+                return self.__free.pop()
+            self.created += 1
+        return DbHelper(**self.__kwargs)
+
+    def release(self, db):
+        """Give back a DbHelper to the pool. Its session is closed first, so
+        the next user starts with a new transaction and no cached objects
+
+        @param db : the DbHelper returned by acquire()
+
+        """
+        try:
+            db.reset_session()
+        except:
+            # broken session : drop it
+            db.log.error("Can't reset the session of a pooled DbHelper : it is dropped")
+            return
+        with self.__lock:
+            if len(self.__free) < self.__size:
+                self.__free.append(db)
@@ -23,9 +23,16 @@ Plugin purpose
 
 Manage logs
 
+The records are written by a background thread of the process (LogWriter) :
+logging a message only puts the record in a bounded queue. The message is
+formatted by the writer thread. When the queue is full, records are dropped
+and the number of dropped records is logged later.
+
 Implements
 ==========
 
+- AsyncHandler
+- LogWriter
 - Logger.__init__(self, component_name = None)
 - Logger.__getattr__(self, attr)
 - Logger.__setattr__(self, attr, value)
@@ -38,10 +45,164 @@ Implements
 @organization: Domogik
 """
 
+import atexit
 import logging
+import os
 import sys
+import threading
+import weakref
+from collections import deque
 from domogik.common.configloader import Loader
 
+# Max number of records waiting to be written (0 : synchronous logging)
+LOG_QUEUE_SIZE = 10000
+# Max time to write the waiting records when the process ends (seconds)
+LOG_EXIT_TIMEOUT = 5
+
+
+class LogWriter():
+    '''
+    Thread writing the log records of all the loggers of a process
+    '''
+
+    def __init__(self, size):
+        '''
+        @param size : max number of waiting records
+        '''
+        self._size = size
+        # deque.append and popleft are thread safe
+        self._records = deque()
+        self._wakeup = threading.Event()
+        self._idle = False
+        self._stop = False
+        self.pid = os.getpid()
+        self._thread = threading.Thread(None, self._run, "log-writer", (), {})
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def put(self, handlers, record):
+        '''
+        Queue a record for some handlers
+        @return False if the queue is full
+        '''
+        if len(self._records) >= self._size:
+            return False
+        self._records.append((handlers, record))
+        if self._idle:
+            self._wakeup.set()
+        return True
+
+    def pending(self):
+        '''
+        Return the number of waiting records
+        '''
+        return len(self._records)
+
+    def _run(self):
+        '''
+        Write the records
+        '''
+        while True:
+            try:
+                handlers, record = self._records.popleft()
+            except IndexError:
+                if self._stop:
+                    return
+                self._idle = True
+                # a record may have been queued before _idle was set
+                if len(self._records) == 0:
+                    self._wakeup.wait(1)
+                self._wakeup.clear()
+                self._idle = False
+                continue
+            for hdlr in handlers:
+                try:
+                    if record.levelno >= hdlr.level:
+                        hdlr.handle(record)
+                except:
+                    hdlr.handleError(record)
+
+    def stop(self):
+        '''
+        Write the waiting records and stop the thread
+        '''
+        if self.pid != os.getpid():
+            return
+        self._stop = True
+        self._wakeup.set()
+        self._thread.join(LOG_EXIT_TIMEOUT)
+
+
+class AsyncHandler(logging.Handler):
+    '''
+    Handler which gives the records of a logger to the LogWriter of the
+    process. The records are written by the handlers given to __init__
+    '''
+
+    _writer = None
+    _lock = threading.Lock()
+    # all the handlers of the process : their locks are renewed after a fork
+    _instances = weakref.WeakSet()
+
+    def __init__(self, handlers, size = LOG_QUEUE_SIZE):
+        '''
+        @param handlers : the handlers which write the records (file, stdout)
+        @param size : max number of waiting records for the process
+        '''
+        logging.Handler.__init__(self)
+        self._handlers = tuple(handlers)
+        self._size = size
+        self.dropped = 0
+        self._reported = 0
+        AsyncHandler._instances.add(self)
+
+    def _get_writer(self):
+        '''
+        Return the writer of the process : a forked process needs a new one
+        '''
+        writer = AsyncHandler._writer
+        if writer is None or writer.pid != os.getpid():
+            with AsyncHandler._lock:
+                writer = AsyncHandler._writer
+                if writer is None or writer.pid != os.getpid():
+                    if writer is not None:
+                        # the writer thread of the parent may have held the
+                        # locks of the handlers at fork time
+                        for instance in list(AsyncHandler._instances):
+                            for hdlr in instance._handlers:
+                                hdlr.createLock()
+                    writer = LogWriter(self._size)
+                    AsyncHandler._writer = writer
+                    atexit.register(writer.stop)
+        return writer
+
+    def emit(self, record):
+        '''
+        Queue a record. The message is formatted by the writer thread
+        '''
+        if record.exc_info:
+            # format the traceback now : do not keep the frames alive
+            record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+            record.exc_info = None
+        writer = self._get_writer()
+        if self.dropped > self._reported:
+            dropped = self.dropped - self._reported
+            notice = logging.LogRecord(record.name, logging.WARNING, __file__, 0, \
+                "%s log messages dropped : the log queue was full", (dropped,), None)
+            if writer.put(self._handlers, notice):
+                self._reported += dropped
+        if not writer.put(self._handlers, record):
+            self.dropped += 1
+
+    def flush(self):
+        for hdlr in self._handlers:
+            hdlr.flush()
+
+    def close(self):
+        for hdlr in self._handlers:
+            hdlr.close()
+        logging.Handler.close(self)
+
 
 class Logger():
     '''
@@ -87,13 +248,21 @@ class Logger():
             hdlr = logging.FileHandler(filename)
             formatter = logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s')
             hdlr.setFormatter(formatter)
-            my_logger.addHandler(hdlr)
+            handlers = [hdlr]
 
 	    # if loglevvel is set to debug (all log entries also go to stdout)
             if level == 'debug' and component_name.find('sqlalchemy') == -1:
                dhdlr = logging.StreamHandler(sys.stdout)
                dhdlr.setFormatter(formatter)
-               my_logger.addHandler(dhdlr)
+               handlers.append(dhdlr)
+
+            # write the records from the writer thread
+            queue_size = int(config.get('log_queue_size', LOG_QUEUE_SIZE))
+            if queue_size > 0:
+                my_logger.addHandler(AsyncHandler(handlers, queue_size))
+            else:
+                for hdlr in handlers:
+                    my_logger.addHandler(hdlr)
 
             my_logger.setLevel(LEVELS[level])
             self.logger[component_name] = my_logger
@@ -27,7 +27,9 @@ A package could be a plugin, a web ui widget, etc
 Implements
 ==========
 
-TODO
+PackageCatalog : index of the packages in the repositories cache and of the
+                 installed packages, rebuilt when the json files change
+PackageManager
 
 @author: Fritz <fritz.smh@gmail.com>
 @copyright: (C) 2007-2012 Domogik project
@@ -37,6 +39,7 @@ TODO
 
 from domogik.common.packagejson import PackageJson, PackageException
 from domogik.common.packagedata import PackageData
+from domogik.common.resolver import version_key, priority_key
 from domogik.common.configloader import Loader
 import traceback
 import tarfile
@@ -44,6 +47,8 @@ import tempfile
 import os
 import pwd
 import urllib
+import urllib2
+import Queue
 import shutil
 import sys
 from domogik.common import logger
@@ -51,6 +56,8 @@ from distutils2.version import NormalizedVersion
 import json
 import re
 import zipfile
+import threading
+import time
 
 from domogik import __path__ as domopath
 SRC_PATH = "%s/" % os.path.dirname(os.path.dirname(domopath[0]))
@@ -67,6 +74,17 @@ REPO_CACHE_DIR = "%s/cache" % CACHE_FOLDER
 ICON_CACHE_DIR = "%s/images" % REPO_CACHE_DIR
 PKG_CACHE_DIR = "%s/pkg-cache" % CACHE_FOLDER
 REPO_LST_FILE_HEADER = "Domogik Repository"
+# validators of the repositories data in the cache (not a .json file : it is
+# not a repository)
+REPO_STATE_FILE = "repo.state"
+# number of repositories fetched at the same time
+REPO_FETCH_THREADS = 4
+# timeout of the repositories requests (seconds)
+REPO_TIMEOUT = 60
+BUFFER_SIZE = 65536
+# min time between two checks of the json files of the catalog (seconds) :
+# a change made by another process is seen after this delay at most
+CATALOG_CHECK_INTERVAL = 5
 
 cfg = Loader('domogik')
 config = cfg.load()
@@ -92,6 +110,181 @@ PKG_PART_RINOR = "rinor"
 # plugin json version should at least be ...
 MIN_JSON_VERSION = 2
 
+class _CountingReader():
+    """ File object which counts the bytes read from another one
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.count = 0
+
+    def read(self, size = -1):
+        data = self._fileobj.read(size)
+        self.count += len(data)
+        return data
+
+class PackageCatalog():
+    """ Index of the packages of the repositories cache and of the installed
+        packages. The json files are read again only when they change (files
+        added, removed or modified) : the directories are checked at most
+        every check_interval seconds, or on next use after invalidate().
+        The returned packages are shared : they must not be modified
+    """
+
+    def __init__(self, repo_cache_dir, install_dirs, check_interval = CATALOG_CHECK_INTERVAL):
+        """ Init the catalog : files are read on first use
+            @param repo_cache_dir : directory of the repositories cache
+            @param install_dirs : directories of the installed packages json
+            @param check_interval : min time between two checks of the files
+        """
+        self._repo_cache_dir = repo_cache_dir
+        self._install_dirs = install_dirs
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._repo_stamp = None
+        self._repo_checked = 0
+        self._installed_stamp = None
+        self._installed_checked = 0
+        # repositories cache indexes
+        self._packages = []
+        self._by_type = {}
+        self._by_fullname = {}
+        self._by_fullname_version = {}
+        self._by_type_id = {}
+        self._latest = {}
+        # installed packages
+        self._installed = []
+
+    def _get_stamp(self, directories):
+        """ Return the list of the json files of some directories with
+            their mtime and size
+            @param directories : list of directories
+        """
+        stamp = []
+        for rep in directories:
+            for root, dirs, files in os.walk(rep):
+                for fic in files:
+                    if fic[-5:] == ".json":
+                        path = "%s/%s" % (root, fic)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                        stamp.append((path, stat.st_mtime, stat.st_size))
+        return stamp
+
+    def invalidate(self):
+        """ Read the files again on next use
+        """
+        with self._lock:
+            self._repo_stamp = None
+            self._installed_stamp = None
+
+    def _refresh_repo(self):
+        """ Build the indexes of the repositories cache if the files changed
+        """
+        now = time.time()
+        if self._repo_stamp is not None and 0 <= now - self._repo_checked < self._check_interval:
+            return
+        self._repo_checked = now
+        stamp = self._get_stamp([self._repo_cache_dir])
+        if stamp == self._repo_stamp:
+            return
+        packages = []
+        for path, mtime, size in stamp:
+            my_json = json.load(open(path))
+            packages.extend(my_json["packages"])
+        by_type = {}
+        by_fullname = {}
+        by_fullname_version = {}
+        by_type_id = {}
+        for my_pkg in packages:
+            by_type.setdefault(my_pkg["type"], []).append(my_pkg)
+            by_fullname.setdefault(my_pkg["fullname"], []).append(my_pkg)
+            by_fullname_version.setdefault((my_pkg["fullname"], my_pkg["version"]), []).append(my_pkg)
+            by_type_id.setdefault((my_pkg["type"], my_pkg["id"]), []).append(my_pkg)
+        latest = {}
+        for key, pkgs in by_type_id.iteritems():
+            latest[key] = max(pkgs, key = lambda k: (version_key(k["version"]),
+                                                     priority_key(k["priority"])))
+        self._packages = sorted(packages, key = lambda k: (k['id']))
+        self._by_type = dict([(pkg_type, sorted(pkgs, key = lambda k: (k['id']))) \
+                              for pkg_type, pkgs in by_type.iteritems()])
+        self._by_fullname = by_fullname
+        self._by_fullname_version = by_fullname_version
+        self._by_type_id = by_type_id
+        self._latest = latest
+        self._repo_stamp = stamp
+
+    def _refresh_installed(self):
+        """ Build the list of the installed packages if the files changed
+        """
+        now = time.time()
+        if self._installed_stamp is not None and 0 <= now - self._installed_checked < self._check_interval:
+            return
+        self._installed_checked = now
+        stamp = self._get_stamp(self._install_dirs)
+        if stamp == self._installed_stamp:
+            return
+        pkg_list = []
+        for path, mtime, size in stamp:
+            pkg_json = PackageJson(path = path).json
+            pkg_list.append(pkg_json["identity"])
+        self._installed = sorted(pkg_list, key = lambda k: (k['fullname'], 
+                                                            k['version']))
+        self._installed_stamp = stamp
+
+    def packages(self, pkg_type = None):
+        """ Return the packages of the cache, sorted by id
+            @param pkg_type (optionnal) : package type
+        """
+        with self._lock:
+            self._refresh_repo()
+            if pkg_type == None:
+                return list(self._packages)
+            return list(self._by_type.get(pkg_type, []))
+
+    def find(self, fullname, version = None):
+        """ Return the packages of the cache with a fullname
+            @param fullname : fullname of package (type-name)
+            @param version (optionnal) : version of the package
+        """
+        with self._lock:
+            self._refresh_repo()
+            if version == None:
+                return list(self._by_fullname.get(fullname, []))
+            return list(self._by_fullname_version.get((fullname, version), []))
+
+    def versions(self, pkg_type, pkg_id):
+        """ Return all the versions of a package in the cache
+            @param pkg_type : package type
+            @param pkg_id : package id
+        """
+        with self._lock:
+            self._refresh_repo()
+            return list(self._by_type_id.get((pkg_type, pkg_id), []))
+
+    def latest(self, pkg_type, pkg_id):
+        """ Return the last version of a package in the cache (for a same
+            version, the one of the repository with the higher priority),
+            None if there is no such package
+            @param pkg_type : package type
+            @param pkg_id : package id
+        """
+        with self._lock:
+            self._refresh_repo()
+            return self._latest.get((pkg_type, pkg_id))
+
+    def installed(self):
+        """ Return the identity of the installed packages
+        """
+        with self._lock:
+            self._refresh_installed()
+            return list(self._installed)
+
+# shared by all the PackageManager objects of the process
+_catalog = PackageCatalog(REPO_CACHE_DIR, [PLUGIN_JSON_PATH, EXTERNAL_JSON_PATH])
+
 class PackageManager():
     """ Tool to create packages
     """
@@ -598,22 +791,71 @@ class PackageManager():
             self.log(str(traceback.format_exc()))
             return False
              
-        # Clean cache folder
+        # Build the new cache next to the current one : the current cache
+        # is kept until all the repositories are fetched
+        new_cache_dir = "%s.new" % REPO_CACHE_DIR
         try:
-            self._clean_cache(REPO_CACHE_DIR)
+            self._clean_cache(new_cache_dir)
+            self._create_folder("%s/images" % new_cache_dir)
         except:
             self.log(str(traceback.format_exc()))
             return False
-             
+        old_state = self._read_cache_state(REPO_CACHE_DIR)
+
         # for each repository, get files and associated Json
         # the higher priority is processed first. If a package is duplicate, for
         # the lower priorities, it will be skipped
+        # The repositories are fetched in parallel : a slow mirror does not
+        # delay the other ones
+        new_state = {}
+        errors = []
+        repo_queue = Queue.Queue()
+        for my_repo in repo_list:
+            repo_queue.put(my_repo)
+
+        def fetch():
+            while True:
+                try:
+                    my_repo = repo_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    new_state[my_repo["url"]] = self._cache_repository( \
+                            my_repo["url"], my_repo["priority"], new_cache_dir, \
+                            REPO_CACHE_DIR, old_state.get(my_repo["url"]))
+                except:
+                    errors.append(my_repo["url"])
+                    self.log("Error while caching repository '%s' : %s" % \
+                             (my_repo["url"], traceback.format_exc()))
+
+        threads = [threading.Thread(target = fetch, name = "repo-fetch-%s" % idx) \
+                   for idx in range(min(REPO_FETCH_THREADS, len(repo_list)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            self.log("Cache not updated : error for the repositories %s" % ", ".join(errors))
+            shutil.rmtree(new_cache_dir, ignore_errors = True)
+            return False
+
+        # Replace the current cache by the new one
         try:
-            for my_repo in repo_list:
-                self._cache_repository(my_repo["url"], my_repo["priority"], REPO_CACHE_DIR)
+            my_file = open("%s/%s" % (new_cache_dir, REPO_STATE_FILE), "w")
+            my_file.write(json.dumps(new_state))
+            my_file.close()
+            old_cache_dir = "%s.old" % REPO_CACHE_DIR
+            shutil.rmtree(old_cache_dir, ignore_errors = True)
+            if os.path.isdir(REPO_CACHE_DIR):
+                os.rename(REPO_CACHE_DIR, old_cache_dir)
+            os.rename(new_cache_dir, REPO_CACHE_DIR)
+            shutil.rmtree(old_cache_dir, ignore_errors = True)
         except:
             self.log(str(traceback.format_exc()))
             return False
+        finally:
+            _catalog.invalidate()
 
         return True
 
@@ -640,62 +882,131 @@ class PackageManager():
         # return sorted list
         return sorted(repo_list, key = lambda k: k['priority'], reverse = True)
 
-    def _cache_repository(self, base_url, priority, cache_dir):
+    def _read_cache_state(self, cache_dir):
+        """ Return the state of the repositories in a cache (validators of
+            the data of each repository, json file and icons), {} if unknown
+            @param cache_dir : dir of the cache
+        """
+        try:
+            return json.load(open("%s/%s" % (cache_dir, REPO_STATE_FILE)))
+        except:
+            return {}
+
+    def _cache_repository(self, base_url, priority, cache_dir, old_cache_dir = None, old_state = None):
         """ Download the json describing the repository
+            The data are requested only if they changed since the last update
+            (ETag/Last-Modified of the previous download) : if they did not,
+            the files of the previous cache are copied
             @param base_url : repo url in sources.list
             @param priority : repo priority
             @param cache_dir : dir for the cache
+            @param old_cache_dir : dir of the previous cache
+            @param old_state : state of the repository in the previous cache
+            @return the state of the repository in the cache
         """
         ### read status json
         repo_status_url = "%s" % base_url
         self.log("Processing '%s'..." % repo_status_url)
-        resp = urllib.urlopen(repo_status_url)
-        repo_json = json.load(resp)
-        self.log("Counter = %s" % repo_json["count"])
+        resp = urllib2.urlopen(repo_status_url, timeout = REPO_TIMEOUT)
+        repo_status = json.load(resp)
+        resp.close()
+        self.log("Counter = %s" % repo_status["count"])
 
         ### download tgz data
         repo_data_url = "%s/data" % base_url
-        tmp_repo_dir = "%s/%s" % (cache_dir, \
-                                   re.sub('\W+', '_', repo_data_url))
-        tmp_repo_file = "%s.tgz" % tmp_repo_dir
-        repo_json = "%s.json" % tmp_repo_dir
-        urllib.urlretrieve(repo_data_url, \
-                           tmp_repo_file)
-
-        ### extract tgz data
-        self._create_folder(tmp_repo_dir)
-
-        # dirty trick for ferllings bug
-        #my_zip = zipfile.ZipFile(tmp_repo_file) 
-        #my_zip.extractall(path = tmp_repo_dir)
-
-        my_tar = tarfile.open(tmp_repo_file)
-        my_tar.extractall(path = tmp_repo_dir)
-        my_tar.close()
-
-        ### Remove tgz file
-        os.unlink(tmp_repo_file)
-
-        ### Move json from tgz extracted and complete it
-        my_json = json.load(open("%s/repo.info" % tmp_repo_dir))
+        repo_json = "%s.json" % re.sub('\W+', '_', repo_data_url)
+        request = urllib2.Request(repo_data_url)
+        if old_state != None:
+            if old_state.get("etag"):
+                request.add_header("If-None-Match", old_state["etag"])
+            if old_state.get("last_modified"):
+                request.add_header("If-Modified-Since", old_state["last_modified"])
+        try:
+            resp = urllib2.urlopen(request, timeout = REPO_TIMEOUT)
+        except urllib2.HTTPError as err:
+            if err.code != 304:
+                raise
+            self.log("Data of '%s' not modified" % repo_status_url)
+            my_json = json.load(open("%s/%s" % (old_cache_dir, old_state["json"])))
+            icons = old_state["icons"]
+            for icon in icons:
+                shutil.copy2("%s/images/%s" % (old_cache_dir, icon), \
+                             "%s/images/%s" % (cache_dir, icon))
+            state = old_state
+        else:
+            try:
+                my_json, icons = self._extract_repository(resp, cache_dir)
+            finally:
+                resp.close()
+            state = {"etag" : resp.info().getheader("ETag"),
+                     "last_modified" : resp.info().getheader("Last-Modified"),
+                     "icons" : icons}
+
+        ### check and complete the json
+        self._check_repository(repo_data_url, my_json)
         for my_pkg in my_json["packages"]:
             my_pkg["priority"] = priority
-        my_file = open(repo_json, "w")
-        my_file.write(json.dumps(my_json, sort_keys=True, indent=4))
+        my_file = open("%s/%s" % (cache_dir, repo_json), "w")
+        my_file.write(json.dumps(my_json))
         my_file.close()
+        state["json"] = repo_json
+        return state
 
-        ### Move icons from tgz extracted
-        icon_dir = "%s/images/" % cache_dir
-        self._create_folder(icon_dir)
-        for root, dirs, files in os.walk("%s/images/" % tmp_repo_dir):
-            for fic in files:
-                if fic[-4:] == ".png":
-                    shutil.move("%s/%s" % (root, fic), \
-                                icon_dir)
+    def _extract_repository(self, resp, cache_dir):
+        """ Read the tgz data of a repository as it is downloaded : only the
+            json and the icons are kept
+            @param resp : http response of the data
+            @param cache_dir : dir for the cache
+            @return the json of the repository, the list of the icons
+        """
+        reader = _CountingReader(resp)
+        my_json = None
+        icons = []
+        my_tar = tarfile.open(fileobj = reader, mode = "r|gz")
+        for member in my_tar:
+            if not member.isfile():
+                continue
+            path = member.name.split("/")
+            while len(path) > 0 and path[0] in ("", "."):
+                path.pop(0)
+            if path == ["repo.info"]:
+                my_json = json.load(my_tar.extractfile(member))
+            elif len(path) > 1 and path[0] == "images" and path[-1][-4:] == ".png":
+                # no sub folder in the icons dir
+                icon = path[-1]
+                # renamed when complete : another repository may have the same
+                icon_file = "%s/images/%s" % (cache_dir, icon)
+                tmp_file = "%s.%s" % (icon_file, threading.current_thread().name)
+                my_file = open(tmp_file, "wb")
+                shutil.copyfileobj(my_tar.extractfile(member), my_file)
+                my_file.close()
+                os.rename(tmp_file, icon_file)
+                icons.append(icon)
+        my_tar.close()
 
-        ### Delete the directory
-        self._clean_folder(tmp_repo_dir) 
-        os.rmdir(tmp_repo_dir)
+        ### integrity checks
+        while reader.read(BUFFER_SIZE):
+            pass
+        length = resp.info().getheader("Content-Length")
+        if length != None and int(length) != reader.count:
+            raise PackageException("Data truncated : %s bytes received, %s expected" % \
+                                   (reader.count, length))
+        if my_json == None:
+            raise PackageException("No repo.info file in the data")
+        return my_json, icons
+
+    def _check_repository(self, repo_data_url, my_json):
+        """ Check the json of a repository before using it
+            @param repo_data_url : url of the data
+            @param my_json : json of the repository
+        """
+        if not isinstance(my_json, dict) or not isinstance(my_json.get("packages"), list):
+            raise PackageException("Bad repo.info for '%s' : no packages list" % repo_data_url)
+        for my_pkg in my_json["packages"]:
+            for key in ["type", "id", "fullname", "version"]:
+                if key not in my_pkg:
+                    raise PackageException("Bad repo.info for '%s' : a package has no %s" % \
+                                           (repo_data_url, key))
 
     def _clean_cache(self, folder):
         """ If not exists, create <folder>
@@ -735,20 +1046,13 @@ class PackageManager():
             raise PackageException("Package mode not activated")
         
         pkg_list = []
-        for root, dirs, files in os.walk(REPO_CACHE_DIR):
-            for fic in files:
-                if fic[-5:] != ".json":
-                    continue
-                my_json = json.load(open("%s/%s" % (root, fic)))
-                for my_pkg in my_json["packages"]:
-                    if pkg_type == my_pkg["type"] and \
-                       pkg_id == my_pkg["id"] and \
-                       version < my_pkg["version"]:
-                        pkg_list.append({"type" : pkg_type,
-                                         "id" : pkg_id,
-                                         "version" : my_pkg["version"],
-                                         "priority" : my_pkg["priority"], 
-                                         "changelog" : my_pkg["changelog"]})
+        for my_pkg in _catalog.versions(pkg_type, pkg_id):
+            if version < my_pkg["version"]:
+                pkg_list.append({"type" : pkg_type,
+                                 "id" : pkg_id,
+                                 "version" : my_pkg["version"],
+                                 "priority" : my_pkg["priority"], 
+                                 "changelog" : my_pkg["changelog"]})
         return pkg_list
                        
     def list_packages(self):
@@ -788,16 +1092,13 @@ class PackageManager():
         if PACKAGE_MODE != True:
             raise PackageException("Package mode not activated")
 
+        if fullname == None:
+            return _catalog.packages(pkg_type)
         pkg_list = []
-        for root, dirs, files in os.walk(REPO_CACHE_DIR):
-            for fic in files:
-                if fic[-5:] != ".json":
-                    continue
-                my_json = json.load(open("%s/%s" % (root, fic)))
-                for my_pkg in my_json["packages"]:
-                    if fullname == None or (fullname == my_pkg["fullname"] and version == my_pkg["version"]):
-                        if pkg_type == None or pkg_type == my_pkg["type"]:
-                            pkg_list.append(my_pkg)
+        if version != None:
+            for my_pkg in _catalog.find(fullname, version):
+                if pkg_type == None or pkg_type == my_pkg["type"]:
+                    pkg_list.append(my_pkg)
         return sorted(pkg_list, key = lambda k: (k['id']))
 
         # FOR HISTORY (temp) : 
@@ -818,23 +1119,23 @@ class PackageManager():
         #                                 "dependencies" : pkg_json["dependencies"],
         #                                 "archive_url" : pkg_json["identity"]["archive_url"]})
 
+    def get_catalog(self):
+        """ Return the catalog of the packages of the cache (for the
+            dependency resolver)
+        """
+        if PACKAGE_MODE != True:
+            raise PackageException("Package mode not activated")
+        return _catalog
+
     def get_installed_packages_list(self):
         """ List all packages in install folder 
             and return a detailed list
         """
         if PACKAGE_MODE != True:
             raise PackageException("Package mode not activated")
-        pkg_list = []
-        for rep in [PLUGIN_JSON_PATH, EXTERNAL_JSON_PATH]:
-            for root, dirs, files in os.walk(rep):
-                for fic in files:
-                    if fic[-5:] == ".json":
-                        pkg_json = PackageJson(path = "%s/%s" % (root, fic)).json
-                        # TODO : replace by identity and repo informations
-                        #   from the json ???
-                        pkg_list.append(pkg_json["identity"])
-        return sorted(pkg_list, key = lambda k: (k['fullname'], 
-                                                 k['version']))
+        # TODO : replace by identity and repo informations
+        #   from the json ???
+        return _catalog.installed()
 
     def show_packages(self, fullname, version = None):
         """ Show a package description
@@ -853,19 +1154,7 @@ class PackageManager():
             @param fullname : fullname of package (type-name)
             @param version : optionnal : version to display (if several)
         """
-        pkg_list = []
-        for root, dirs, files in os.walk(REPO_CACHE_DIR):
-            for fic in files:
-                if fic[-5:] != ".json":
-                    continue
-                print fic
-                my_json = json.load(open("%s/%s" % (root, fic)))
-                for my_pkg in my_json["packages"]:
-                    if (version == None and \
-                        fullname == my_pkg["fullname"]) or \
-                       (version == my_pkg["version"] and \
-                        fullname == my_pkg["fullname"]):
-                        pkg_list.append(my_pkg)
+        pkg_list = _catalog.find(fullname, version)
                        
         if len(pkg_list) == 0:
             if version == None:
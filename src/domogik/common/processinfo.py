@@ -21,12 +21,24 @@ along with Domogik. If not, see U{http://www.gnu.org/licenses}.
 Module purpose
 ==============
 
-CLass which get informations about a process : cpu, memory
+CLass which get informations about a process : cpu, memory, threads, files
+
+The values are read in /proc/<pid>/stat, /proc/<pid>/statm and /proc/<pid>/fd
+(Linux), without any external library :
+- ProcessInfo watches one process
+- ProcessSampler watches all the Domogik processes of the host (the ones
+  which have a pid file) in one pass, and keeps the last samples of each
+  process in a ring buffer
+
+The samples are kept raw (cpu ticks, bytes) : they are converted only when
+the usage is computed.
 
 Implements
 ==========
 
+- read_process
 - class ProcessInfo
+- class ProcessSampler
 
 @author: Fritz <fritz.smh@gmail.com>
 @copyright: (C) 2007-2012 Domogik project
@@ -34,10 +46,84 @@ Implements
 @organization: Domogik
 """
 
-import psutil
+import collections
+import os
 import time
 from domogik.xpl.common.xplconnector import XplTimer
-import threading
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# number of samples kept for each process
+SAMPLES_SIZE = 60
+
+# fields of a sample
+Sample = collections.namedtuple("Sample", ["time", "pid", "cpu_ticks", "memory_rss",
+                                           "memory_vsz", "threads", "fds"])
+
+
+def read_process(pid):
+    """ Read the counters of a process
+        @param pid : process identifier
+        @return a Sample, None if the process does not exist
+    """
+    try:
+        with open("/proc/%s/stat" % pid) as stat_file:
+            stat = stat_file.read()
+        with open("/proc/%s/statm" % pid) as statm_file:
+            statm = statm_file.read().split()
+    except (IOError, OSError):
+        return None
+    # the process name may contain spaces : the fields are after the last ')'
+    # and begin with the 3rd field (state)
+    fields = stat[stat.rindex(")") + 2:].split()
+    try:
+        fds = len(os.listdir("/proc/%s/fd" % pid))
+    except OSError:
+        # process of another user
+        fds = None
+    return Sample(time.time(), pid,
+                  int(fields[11]) + int(fields[12]),
+                  int(statm[1]) * PAGE_SIZE,
+                  int(statm[0]) * PAGE_SIZE,
+                  int(fields[17]),
+                  fds)
+
+def get_total_memory():
+    """ Return the physical memory of the host in bytes
+    """
+    with open("/proc/meminfo") as meminfo:
+        for line in meminfo:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def get_usage(samples, total_memory, raw = False):
+    """ Compute the usage of a process from its last samples
+        @param samples : samples of the process, the last one at the end
+        @param total_memory : physical memory of the host in bytes
+        @param raw : True : return raw values. False : return values in Mo
+    """
+    last = samples[-1]
+    cpu_percent = 0
+    if len(samples) > 1:
+        previous = samples[-2]
+        if last.time > previous.time:
+            cpu_percent = round(100.0 * (last.cpu_ticks - previous.cpu_ticks) / CLOCK_TICKS / \
+                                (last.time - previous.time), 1)
+    if raw == False:
+        divisor = 1024 * 1024
+    else:
+        divisor = 1
+    return {"pid" : last.pid,
+            "cpu_percent" : cpu_percent,
+            "memory_total_phymem" : round(total_memory / divisor, 0),
+            "memory_rss" : round(float(last.memory_rss) / divisor, 1),
+            "memory_vsz" : round(float(last.memory_vsz) / divisor, 1),
+            "memory_percent" : round(100.0 * last.memory_rss / total_memory, 1),
+            "threads" : last.threads,
+            "threads_max" : max([sample.threads for sample in samples]),
+            "fds" : last.fds}
+
 
 class ProcessInfo():
     """ This class get informations about a process :
@@ -59,60 +145,142 @@ class ProcessInfo():
         self._interval = interval
         self.log = log
         self.myxpl = myxpl
+        self._samples = collections.deque(maxlen = 2)
         # check pid exists
-        if not psutil.pid_exists(pid):
+        if not os.path.exists("/proc/%s" % pid):
             self.log.warning("No process '%s' exists" % pid)
             return
-        # create psutil object
-        self.p = psutil.Process(pid)
-        self.pid = self.p.pid
+        self.pid = pid
+        self._total_memory = get_total_memory()
 
     def start(self):
         """ Get values each <interval> seconds while process is up
         """
         if self.pid == None:
             return
-        stop = threading.Event()
-        timer = XplTimer(self._interval, self._get_values, stop, self.myxpl)
+        timer = XplTimer(self._interval, self._get_values, self.myxpl)
         timer.start()
 
     def _get_values(self, raw = False):
         """ Get usefull values and put them in a dictionnary
             @param raw : True : return raw values. False : return values in Mo
         """
+        if self.pid == None:
+            return
+        sample = read_process(self.pid)
         # check process status
-        if not psutil.pid_exists(self.pid):
+        if sample == None:
             self.log.warning("Process '%s' doesn't exists anymore : stop watching for it" % self.pid)
-            self.stop.set()
+            # the timer can't be stopped from its own thread
+            self.pid = None
             return
-        # cpu info
-        cpu_percent = round(self.p.get_cpu_percent(), 1)
-        # get memory info and set them in Mbyte
-        memory_total_phymem = round(psutil.TOTAL_PHYMEM / (1024 * 1024), 0)
-        memory_info = self.p.get_memory_info()
-        if raw == False:
-            divisor = 1024 * 1024
-        else:
-            divisor = 1
-        memory_rss = round(memory_info[0] / divisor, 1)
-        memory_vsz = round(memory_info[1] / divisor, 1)
-        memory_percent = round(self.p.get_memory_percent(),1)
-        values = {"pid" : self.pid,
-                  "cpu_percent" : cpu_percent,
-                  "memory_total_phymem" : memory_total_phymem,
-                  "memory_rss" : memory_rss,
-                  "memory_vsz" : memory_vsz,
-                  "memory_percent" : memory_percent,
-	 }
-        # TODO : add threads number
+        self._samples.append(sample)
+        values = get_usage(self._samples, self._total_memory, raw)
         if self._callback != None:
             self._callback(self.pid, values)
         else:
             print("%s > %s" % (self.pid, values))
 
+
+class ProcessSampler():
+    """ Get informations about all the Domogik processes of the host :
+        the processes are the ones which have a pid file
+    """
+
+    def __init__(self, pid_dir, interval = 0, callback = None, log = None, myxpl = None,
+                 size = SAMPLES_SIZE):
+        """ Init object
+            @param pid_dir : directory of the pid files (<name>.pid)
+            @param interval : time between looking for values
+            @param callback : function to call with the usage of all the
+               processes : {name : {"cpu_percent" : 3.2, ...}, ...}
+            @param log : logger
+            @param myxpl : xpl plugin instance
+            @param size : number of samples kept for each process
+        """
+        self._pid_dir = pid_dir
+        self._interval = interval
+        self._callback = callback
+        self.log = log
+        self.myxpl = myxpl
+        self._size = size
+        self._samples = {}
+        self._total_memory = get_total_memory()
+
+    def start(self):
+        """ Get values each <interval> seconds
+        """
+        timer = XplTimer(self._interval, self._get_values, self.myxpl)
+        timer.start()
+
+    def get_pids(self):
+        """ Return the processes which have a pid file : {name : pid}
+        """
+        pids = {}
+        try:
+            files = os.listdir(self._pid_dir)
+        except OSError:
+            return pids
+        for fic in files:
+            if fic[-4:] != ".pid":
+                continue
+            try:
+                with open(os.path.join(self._pid_dir, fic)) as pid_file:
+                    pids[fic[:-4]] = int(pid_file.read().strip())
+            except (IOError, ValueError):
+                continue
+        return pids
+
+    def sample(self):
+        """ Read the counters of all the processes
+        """
+        pids = self.get_pids()
+        for name in self._samples.keys():
+            if name not in pids:
+                del self._samples[name]
+        for name, pid in pids.iteritems():
+            sample = read_process(pid)
+            if sample == None:
+                # stale pid file
+                self._samples.pop(name, None)
+                continue
+            samples = self._samples.get(name)
+            # new process, or the process restarted
+            if samples == None or samples[-1].pid != pid:
+                samples = collections.deque(maxlen = self._size)
+                self._samples[name] = samples
+            samples.append(sample)
+
+    def history(self, name):
+        """ Return the last samples of a process, the last one at the end
+            @param name : process name (name of the pid file)
+        """
+        return list(self._samples.get(name, []))
+
+    def get_usage(self, raw = False):
+        """ Return the usage of all the processes : {name : values}
+            @param raw : True : return raw values. False : return values in Mo
+        """
+        return dict([(name, get_usage(samples, self._total_memory, raw)) \
+                     for name, samples in self._samples.iteritems()])
+
+    def _get_values(self):
+        """ Sample all the processes and give their usage
+        """
+        self.sample()
+        values = self.get_usage()
+        if self._callback != None:
+            self._callback(values)
+        else:
+            print("%s" % values)
+
 def display(pid, data):
     print("DATA (%s) = %s" % (pid, str(data)))
 
 if __name__ == "__main__":
-    my_process = ProcessInfo(3529)
-    #my_process.start()
+    sampler = ProcessSampler("/var/run/domogik")
+    sampler.sample()
+    time.sleep(1)
+    sampler.sample()
+    for name, data in sampler.get_usage().iteritems():
+        display(name, data)
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Resolve the dependencies of the packages
+
+The dependencies of a package are a list of {"type" : ..., "id" : ...} where
+id is a requirement like 'pyserial (>= 2.4)' :
+- the python dependencies are checked against the installed python
+  distributions, read with a single 'pip freeze' for all of them
+- the package dependencies (plugin...) are looked for in the installed
+  packages then in the repositories cache, with their own dependencies :
+  the result is the list of the packages to install, in install order
+
+The parsing of the requirements and the version checks are memoized for all
+the resolutions of the process.
+
+Implements
+==========
+
+- ResolverException
+- version_key
+- priority_key
+- parse_requirement
+- version_match
+- PythonPackages
+- DependencyResolver
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+from distutils2.version import NormalizedVersion, VersionPredicate
+from subprocess import Popen, PIPE
+import threading
+import time
+
+# max number of memoized requirements and version checks
+MEMO_SIZE = 1000
+# time before the installed python distributions are read again (seconds)
+PYTHON_PACKAGES_TTL = 60
+
+_requirements = {}
+_matches = {}
+_memo_lock = threading.Lock()
+
+
+class ResolverException(Exception):
+    """
+    Resolver exception
+    """
+
+    def __init__(self, value):
+        Exception.__init__(self)
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def version_key(version):
+    """ Key to sort versions : normalized versions, or text for the others
+        @param version : version of a package
+    """
+    try:
+        return (1, NormalizedVersion(version))
+    except:
+        return (0, version)
+
+def priority_key(priority):
+    """ Key to sort repository priorities (numbers in sources.list)
+        @param priority : priority of a repository
+    """
+    try:
+        return int(priority)
+    except (TypeError, ValueError):
+        return priority
+
+def _memoize(memo, key, value):
+    """ Store a value in a memo, which is emptied when it is full
+    """
+    with _memo_lock:
+        if len(memo) >= MEMO_SIZE:
+            memo.clear()
+        memo[key] = value
+
+def parse_requirement(requirement):
+    """ Return the VersionPredicate of a requirement ('foo (>= 1.0)')
+        @param requirement : requirement
+    """
+    try:
+        return _requirements[requirement]
+    except KeyError:
+        pass
+    try:
+        predicate = VersionPredicate(requirement)
+    except:
+        raise ResolverException("Bad requirement '%s'" % requirement)
+    _memoize(_requirements, requirement, predicate)
+    return predicate
+
+def version_match(requirement, version):
+    """ Return True if a version satisfies a requirement
+        @param requirement : requirement ('foo (>= 1.0)')
+        @param version : version ('1.2')
+    """
+    key = (requirement, version)
+    try:
+        return _matches[key]
+    except KeyError:
+        pass
+    predicate = parse_requirement(requirement)
+    try:
+        result = predicate.match(version)
+    except:
+        # irrational version
+        result = False
+    _memoize(_matches, key, result)
+    return result
+
+
+class PythonPackages():
+    """ Installed python distributions
+    """
+
+    def __init__(self, ttl = PYTHON_PACKAGES_TTL):
+        """ Init the list : it is read on first use
+            @param ttl : time before the list is read again (seconds)
+        """
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._versions = None
+        self._time = 0
+
+    def invalidate(self):
+        """ Read the list again on next use
+        """
+        with self._lock:
+            self._versions = None
+
+    def _read(self):
+        """ Return the installed distributions : { lower name : version }
+        """
+        subp = Popen("pip freeze", stdout=PIPE, shell=True)
+        res = subp.communicate()[0]
+        versions = {}
+        for line in res.splitlines():
+            if "==" in line:
+                name, version = line.strip().split("==", 1)
+                versions[name.lower()] = version
+        return versions
+
+    def version(self, name):
+        """ Return the installed version of a distribution, None if it is not
+            installed
+            @param name : distribution name
+        """
+        with self._lock:
+            if self._versions == None or time.time() - self._time > self._ttl:
+                self._versions = self._read()
+                self._time = time.time()
+            return self._versions.get(name.lower())
+
+    def check(self, requirement):
+        """ Check if a requirement is installed
+            @param requirement : requirement ('pyserial (>= 2.4)')
+            @return installed (True/False), installed version (or None)
+        """
+        installed_version = self.version(parse_requirement(requirement).name)
+        if installed_version == None:
+            return False, None
+        return version_match(requirement, installed_version), installed_version
+
+
+class DependencyResolver():
+    """ Resolve the dependencies of packages against the installed packages
+        and the packages of the repositories cache
+    """
+
+    def __init__(self, catalog, installed):
+        """ Index the installed packages
+            @param catalog : packages of the repositories cache, with
+            versions(type, id) and latest(type, id) (PackageCatalog)
+            @param installed : installed packages (type, id, version)
+        """
+        self._catalog = catalog
+        self._installed = {}
+        for pkg in installed:
+            self._installed.setdefault((pkg["type"], pkg["id"]), []).append(pkg)
+
+    def _find_installed(self, pkg_type, requirement):
+        """ Return the installed package which satisfies a requirement, None
+            if there is none
+        """
+        name = parse_requirement(requirement).name
+        for pkg in self._installed.get((pkg_type, name), []):
+            if version_match(requirement, pkg["version"]):
+                return pkg
+        return None
+
+    def _find_candidate(self, pkg_type, requirement):
+        """ Return the last version of the cache which satisfies a requirement
+            (for a same version, the one of the higher repository priority),
+            None if there is none
+        """
+        predicate = parse_requirement(requirement)
+        if len(predicate.predicates) == 0:
+            return self._catalog.latest(pkg_type, predicate.name)
+        candidates = [pkg for pkg in self._catalog.versions(pkg_type, predicate.name) \
+                      if version_match(requirement, pkg["version"])]
+        if len(candidates) == 0:
+            return None
+        return max(candidates, key = lambda k: (version_key(k["version"]),
+                                                priority_key(k.get("priority"))))
+
+    def resolve(self, dep_list):
+        """ Resolve a list of dependencies and the dependencies of the
+            packages to install
+            @param dep_list : list of dependencies [{"type": , "id": }, {}...]
+            @return {"packages" : [{"type", "id" (the requirement), "name",
+                                    "installed", "version", "candidate",
+                                    "error"}, ...] in install order,
+                     "python" : [requirement, ...]}
+        """
+        plan = {"packages" : [], "python" : []}
+        # (type, name) : version chosen when resolved (None if there is no
+        # candidate), absent while resolving
+        resolved = {}
+        resolving = set()
+
+        def visit(dep):
+            if dep["type"] == "python":
+                if dep["id"] not in plan["python"]:
+                    plan["python"].append(dep["id"])
+                return
+            item = {"type" : dep["type"],
+                    "id" : dep["id"],
+                    "name" : dep["id"],
+                    "installed" : False,
+                    "version" : "",
+                    "candidate" : "",
+                    "error" : ""}
+            try:
+                name = parse_requirement(dep["id"]).name
+            except ResolverException as err:
+                item["error"] = err.value
+                plan["packages"].append(item)
+                return
+            item["name"] = name
+            key = (dep["type"], name)
+            if key in resolved:
+                # the version is already chosen : it must satisfy this requirement too
+                version = resolved[key]
+                if version != None and not version_match(dep["id"], version):
+                    item["error"] = "Conflict on %s '%s' : version %s doesn't satisfy '%s'" % \
+                                    (dep["type"], name, version, dep["id"])
+                    plan["packages"].append(item)
+                return
+            if key in resolving:
+                item["error"] = "Circular dependency on %s '%s'" % key
+                plan["packages"].append(item)
+                return
+            resolving.add(key)
+            version = None
+            pkg = self._find_installed(dep["type"], dep["id"])
+            if pkg != None:
+                item["installed"] = True
+                item["version"] = pkg["version"]
+                version = pkg["version"]
+            else:
+                pkg = self._find_candidate(dep["type"], dep["id"])
+                if pkg == None:
+                    item["error"] = "No candidate to dependency '%s' installation found" % dep["id"]
+                else:
+                    item["candidate"] = pkg["version"]
+                    version = pkg["version"]
+                    # the dependencies are installed first
+                    for sub_dep in pkg.get("dependencies", []):
+                        visit(sub_dep)
+            resolving.discard(key)
+            resolved[key] = version
+            plan["packages"].append(item)
+
+        for dep in dep_list:
+            visit(dep)
+        return plan
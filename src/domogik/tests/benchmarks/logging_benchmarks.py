@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Benchmarks for the logging : time spent by the caller for each message, like
+the xPL send path which logs each message, with the synchronous file handler
+and with the queue of the Domogik logger.
+
+Each logger is set at the info level, then at the debug level, and logs one
+debug and one info message per loop. The logs are written in a temporary
+directory (or the one given), no Domogik config is needed. A disk latency
+can be simulated (a sleep after each write, like a busy disk or a sd card).
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+
+import getopt, sys
+import logging
+import os
+import shutil
+import tempfile
+import time
+from domogik.common.logger import AsyncHandler, LOG_QUEUE_SIZE
+
+
+class SlowFileHandler(logging.FileHandler):
+    """ File handler with a simulated disk latency
+    """
+    def __init__(self, filename, latency):
+        logging.FileHandler.__init__(self, filename)
+        self.latency = latency
+
+    def emit(self, record):
+        logging.FileHandler.emit(self, record)
+        time.sleep(self.latency)
+
+
+def build_logger(name, filename, asynchronous, queue_size, latency):
+    """ Build a logger like domogik.common.logger.Logger does
+    """
+    my_logger = logging.getLogger("bench-%s" % name)
+    my_logger.propagate = False
+    if latency > 0:
+        hdlr = SlowFileHandler(filename, latency)
+    else:
+        hdlr = logging.FileHandler(filename)
+    hdlr.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    if asynchronous:
+        hdlr = AsyncHandler([hdlr], queue_size)
+    my_logger.addHandler(hdlr)
+    return my_logger, hdlr
+
+
+def run_logging(directory, count, queue_size, latency):
+    """ Log count debug and info messages with each logger and each level
+    @param directory : directory of the log files
+    @param count : number of loops
+    @param queue_size : size of the log queue
+    @param latency : simulated latency of each write (seconds)
+    """
+    for asynchronous in [False, True]:
+        for level in [logging.INFO, logging.DEBUG]:
+            name = "%s-%s" % (asynchronous and "queue" or "file", logging.getLevelName(level).lower())
+            my_logger, hdlr = build_logger(name, os.path.join(directory, "%s.log" % name), \
+                                           asynchronous, queue_size, latency)
+            my_logger.setLevel(level)
+            start_t = time.time()
+            for i in xrange(count):
+                my_logger.debug("Send message : device=%s current=%s" % (i % 50, i % 400))
+                my_logger.info("Message %s sent" % i)
+            duration = time.time() - start_t
+            print("%s logger at %s level : %s messages" % \
+                  (asynchronous and "Queue" or "File", logging.getLevelName(level), count * 2))
+            print("\tExecution time = %s" % duration)
+            print("\tMean time per message = %.1f us" % (duration * 1000000 / (count * 2)))
+            if asynchronous:
+                print("\tDropped messages = %s" % hdlr.dropped)
+            # wait for the writer
+            start_t = time.time()
+            while asynchronous and AsyncHandler._writer.pending() > 0:
+                time.sleep(0.01)
+            if asynchronous:
+                print("\tWriting of the queue ended %.2f s later" % (time.time() - start_t))
+
+
+def usage(prog_name):
+    """Print program usage"""
+    print("Usage : %s [-n COUNT] [-q SIZE] [-w LATENCY] [-l DIRECTORY]" % prog_name)
+    print("-n, --count=COUNT\t\tNumber of loops (default 50000)")
+    print("-q, --queue=SIZE\t\tSize of the log queue (default %s)" % LOG_QUEUE_SIZE)
+    print("-w, --latency=LATENCY\t\tSimulated latency of each write in ms (default 0)")
+    print("-l, --logdir=DIRECTORY\t\tDirectory of the log files (default : a temporary one)")
+
+if __name__ == "__main__":
+    count = 50000
+    queue_size = LOG_QUEUE_SIZE
+    latency = 0
+    directory = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:q:w:l:", ["help", "count=", "queue=", "latency=", "logdir="])
+    except getopt.GetoptError:
+        usage(sys.argv[0])
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(sys.argv[0])
+            sys.exit()
+        elif opt in ("-n", "--count"):
+            count = int(arg)
+        elif opt in ("-q", "--queue"):
+            queue_size = int(arg)
+        elif opt in ("-w", "--latency"):
+            latency = float(arg) / 1000
+        elif opt in ("-l", "--logdir"):
+            directory = arg
+    if directory is None:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            run_logging(tmp_dir, count, queue_size, latency)
+        finally:
+            shutil.rmtree(tmp_dir)
+    else:
+        run_logging(directory, count, queue_size, latency)
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Load test of a running REST server : the same urls are requested by many
+clients at once, and the time of each request is measured.
+
+Cheap urls (/, /base/device_type/list...) show the overhead of the request
+processing itself (request object, database session) : run the same test
+before and after a change of the REST server to compare it.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+
+import getopt, sys
+import httplib
+import threading
+import time
+
+DEFAULT_URLS = ["/", "/base/device_type/list", "/base/device/list"]
+
+
+def percentile(values, percent):
+    """ Return a percentile of sorted values
+    """
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def run_load(host, port, urls, count, nb_threads):
+    """ Request count times the urls from nb_threads threads
+    @param host : REST server ip
+    @param port : REST server port
+    @param urls : list of urls
+    @param count : number of requests sent by each thread
+    @param nb_threads : number of client threads
+    """
+    durations = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        my_durations = []
+        my_errors = 0
+        for i in range(count):
+            url = urls[i % len(urls)]
+            start_t = time.time()
+            try:
+                conn = httplib.HTTPConnection(host, port, timeout = 30)
+                conn.request("GET", url)
+                resp = conn.getresponse()
+                resp.read()
+                conn.close()
+                if resp.status != 200:
+                    my_errors += 1
+            except Exception:
+                my_errors += 1
+            my_durations.append(time.time() - start_t)
+        with lock:
+            durations.extend(my_durations)
+            errors.append(my_errors)
+
+    threads = [threading.Thread(target=client) for i in range(nb_threads)]
+    start_t = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start_t
+    total = count * nb_threads
+    durations.sort()
+    print("%s requests sent by %s client(s) on %s url(s)" % (total, nb_threads, len(urls)))
+    print("\tErrors = %s" % sum(errors))
+    print("\tExecution time = %s" % duration)
+    print("\tThroughput = %d requests/s" % (total / duration))
+    print("\tMean time per request = %.2f ms" % (sum(durations) * 1000 / total))
+    for percent in [50, 90, 99]:
+        print("\t%s%% of the requests in %.2f ms" % (percent, percentile(durations, percent) * 1000))
+    print("\tMax time = %.2f ms" % (durations[-1] * 1000))
+
+
+def usage(prog_name):
+    """Print program usage"""
+    print("Usage : %s [-s IP] [-p PORT] [-n COUNT] [-t THREADS] [-u URL]..." % prog_name)
+    print("-s, --server=IP\t\t\tREST server ip (default 127.0.0.1)")
+    print("-p, --port=PORT\t\t\tREST server port (default 40405)")
+    print("-n, --count=COUNT\t\tNumber of requests sent by each client (default 1000)")
+    print("-t, --threads=THREADS\t\tNumber of clients (default 4)")
+    print("-u, --url=URL\t\t\tUrl to request, may be repeated (default %s)" % " ".join(DEFAULT_URLS))
+
+if __name__ == "__main__":
+    host = "127.0.0.1"
+    port = 40405
+    count = 1000
+    nb_threads = 4
+    urls = []
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hs:p:n:t:u:", \
+            ["help", "server=", "port=", "count=", "threads=", "url="])
+    except getopt.GetoptError:
+        usage(sys.argv[0])
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(sys.argv[0])
+            sys.exit()
+        elif opt in ("-s", "--server"):
+            host = arg
+        elif opt in ("-p", "--port"):
+            port = int(arg)
+        elif opt in ("-n", "--count"):
+            count = int(arg)
+        elif opt in ("-t", "--threads"):
+            nb_threads = int(arg)
+        elif opt in ("-u", "--url"):
+            urls.append(arg)
+    if len(urls) == 0:
+        urls = DEFAULT_URLS
+    run_load(host, port, urls, count, nb_threads)
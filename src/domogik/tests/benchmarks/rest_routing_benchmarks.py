@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Benchmarks for the routing of the REST urls : one url is built for each
+pattern of the url table of ProcessRequest, then all these urls are routed
+with the compiled router and with the former per-request regex scan and
+eval dispatch.
+
+The handlers are replaced by functions which do nothing, so only the
+routing is measured. No REST server or database is needed.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+
+import getopt, sys
+import re
+import time
+from domogik.xpl.lib.rest.request import ProcessRequest
+from domogik.xpl.lib.rest.router import UrlRouter
+
+# Values tried for the named groups of the patterns
+GROUP_SAMPLES = ["12", "abc", "enable", "start", "plugin", "0.1", "1-2"]
+GROUP = re.compile(r"\(\?P<(?P<name>[a-z_]+)>(?P<regexp>[^)]*)\)")
+
+
+def sample_url(pattern):
+    """ Build an url which matches a pattern of the url table
+    """
+    def sample(group):
+        regexp = re.compile("^(%s)$" % group.group("regexp"))
+        for value in GROUP_SAMPLES:
+            if regexp.match(value):
+                return value
+        raise ValueError("No sample value for %s" % group.group(0))
+    url = GROUP.sub(sample, pattern)
+    return url.lstrip("^").rstrip("$").replace(".*", "x").replace("\\", "")
+
+
+class BenchHandler:
+    """ Stand-in for ProcessRequest : each handler counts its calls
+    """
+    calls = 0
+
+
+def make_handler(name):
+    def handler(self, **params):
+        BenchHandler.calls += 1
+    handler.__name__ = name
+    return handler
+
+for names in ProcessRequest.urls.itervalues():
+    for handler_name in names.itervalues():
+        setattr(BenchHandler, handler_name, make_handler(handler_name))
+
+
+def eval_dispatch(self, urls, rest_type, path):
+    """ The former dispatch of ProcessRequest.do_for_all_methods
+    """
+    found = 0
+    if rest_type in urls:
+        for k in urls[rest_type]:
+            m = re.match(k, path)
+            if m:
+                found = 1
+                if len( m.groupdict() ) == 0:
+                    eval('self.' + urls[rest_type][k] + '()')
+                else:
+                    eval('self.'  + urls[rest_type][k] + '(' + ', '.join([v+"='"+k2+"'" for (v,k2) in m.groupdict().iteritems()]) + ')')
+                break
+    return found
+
+
+def run_routing(count):
+    """ Route count times all the urls of the url table
+    @param count : number of loops over the url table
+    """
+    start_t = time.time()
+    router = UrlRouter(BenchHandler, ProcessRequest.urls)
+    print("%s urls compiled in %.1f ms" % (router.count(), (time.time() - start_t) * 1000))
+
+    requests = []
+    for rest_type, patterns in ProcessRequest.urls.iteritems():
+        for pattern, name in patterns.iteritems():
+            url = sample_url(pattern)
+            route = router.match(rest_type, url)
+            if route is None or route[0] != name:
+                print("Warning : %s is routed to %s instead of %s" % (url, route, name))
+            requests.append((rest_type, url))
+    total = count * len(requests)
+    handler = BenchHandler()
+
+    for title, dispatch in [("Compiled router", \
+                               lambda rest_type, url: router.dispatch(handler, rest_type, url)),
+                            ("Regex scan and eval", \
+                               lambda rest_type, url: eval_dispatch(handler, ProcessRequest.urls, rest_type, url))]:
+        BenchHandler.calls = 0
+        start_t = time.time()
+        for i in range(count):
+            for rest_type, url in requests:
+                dispatch(rest_type, url)
+        duration = time.time() - start_t
+        print("%s : %s urls routed (%s handler calls)" % (title, total, BenchHandler.calls))
+        print("\tExecution time = %s" % duration)
+        print("\tThroughput = %d urls/s" % (total / duration))
+        print("\tMean time per url = %.1f us" % (duration * 1000000 / total))
+
+
+def usage(prog_name):
+    """Print program usage"""
+    print("Usage : %s [-n COUNT]" % prog_name)
+    print("-n, --count=COUNT\t\tNumber of loops over the url table (default 200)")
+
+if __name__ == "__main__":
+    count = 200
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:", ["help", "count="])
+    except getopt.GetoptError:
+        usage(sys.argv[0])
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(sys.argv[0])
+            sys.exit()
+        elif opt in ("-n", "--count"):
+            count = int(arg)
+    run_routing(count)
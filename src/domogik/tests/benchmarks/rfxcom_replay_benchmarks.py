@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Benchmarks for the RFXCOM receive path : replay a capture of RFXCOM frames
+through the frame reader and the packet handlers of the rfxcom library.
+
+A capture is a text file with one frame per line, in hexadecimal, length
+byte included (for example : 0A520211700200A72D0089). Empty lines and lines
+starting with '#' are ignored. Without capture file, a sample capture of
+weather sensors, security and lighting frames is replayed.
+
+No RFXCOM device is needed : the frames are read from a fake serial device
+which returns at most CHUNK bytes per read.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+
+import binascii
+import getopt, sys
+import logging
+import threading
+import time
+from domogik_packages.xpl.lib.rfxcom import RfxcomUsb
+
+SAMPLE_CAPTURE = [
+    "0A520211700200A72D0089",         # temperature and humidity
+    "08500110000180BC69",             # temperature
+    "0D540100E90000C8270203E70439",   # temperature, humidity and barometric
+    "0B550217B6000000004D3C69",       # rain
+    "0C5601122F000087001E003C59",     # wind
+    "115A0100191E010000017000000000297B79",   # energy
+    "082000051234560489",             # security
+    "0B11000101254BAE0A010F70",       # lighting2
+]
+
+
+class ReplaySerial:
+    """ Fake serial device which returns the bytes of a capture
+    """
+    def __init__(self, data, chunk):
+        """
+        @param data : bytes to return
+        @param chunk : max number of bytes waiting in the device
+        """
+        self._data = data
+        self._pos = 0
+        self._chunk = chunk
+
+    def remaining(self):
+        return len(self._data) - self._pos
+
+    def inWaiting(self):
+        return min(self._chunk, self.remaining())
+
+    def read(self, size = 1):
+        data = self._data[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        pass
+
+
+def load_capture(file_name):
+    """ Load the frames of a capture file
+    @param file_name : capture file (one frame in hexadecimal per line)
+    """
+    frames = []
+    for line in open(file_name):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        frames.append(line)
+    return frames
+
+
+def run_replay(frames, count, chunk, log):
+    """ Replay count times the frames
+    @param frames : list of frames in hexadecimal
+    @param count : number of replays of the capture
+    @param chunk : max number of bytes returned by each read
+    @param log : logger
+    """
+    data = binascii.unhexlify("".join(frames)) * count
+    nb_messages = [0]
+
+    def send_xpl(schema, data = {}):
+        nb_messages[0] += 1
+
+    def send_trig(message):
+        pass
+
+    stop = threading.Event()
+    rfxcom = RfxcomUsb(log, send_xpl, send_trig, stop)
+    device = ReplaySerial(data, chunk)
+    rfxcom._rfxcom = device
+    start_t = time.time()
+    while device.remaining() > 0:
+        rfxcom.read()
+    duration = time.time() - start_t
+    stop.set()
+    rfxcom.close()
+    nb_frames = len(frames) * count
+    print("%s frames (%s bytes) replayed, %s bytes per read" % (nb_frames, len(data), chunk))
+    print("\tExecution time = %s" % duration)
+    print("\tThroughput = %d frames/s" % (nb_frames / duration))
+    print("\txPL messages built = %s" % nb_messages[0])
+
+
+def usage(prog_name):
+    """Print program usage"""
+    print("Usage : %s [-f CAPTURE] [-n COUNT] [-c CHUNK] [-d]" % prog_name)
+    print("-f, --file=CAPTURE\t\tCapture file to replay (default : sample capture)")
+    print("-n, --count=COUNT\t\tNumber of replays of the capture (default 10000)")
+    print("-c, --chunk=CHUNK\t\tMax number of bytes returned by a read (default 64)")
+    print("-d, --debug\t\t\tSet the log level to debug (default info)")
+
+if __name__ == "__main__":
+    frames = SAMPLE_CAPTURE
+    count = 10000
+    chunk = 64
+    log_level = logging.INFO
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hf:n:c:d", ["help", "file=", "count=", "chunk=", "debug"])
+    except getopt.GetoptError:
+        usage(sys.argv[0])
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(sys.argv[0])
+            sys.exit()
+        elif opt in ("-f", "--file"):
+            frames = load_capture(arg)
+        elif opt in ("-n", "--count"):
+            count = int(arg)
+        elif opt in ("-c", "--chunk"):
+            chunk = int(arg)
+        elif opt in ("-d", "--debug"):
+            log_level = logging.DEBUG
+    logging.basicConfig()
+    log = logging.getLogger("rfxcom_replay_benchmarks")
+    log.setLevel(log_level)
+    run_replay(frames, count, chunk, log)
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Benchmarks for the xPL send path : sustained sends of sensor.basic messages
+(like rfxcom, telldus, onewire or teleinfo do) from one or many threads.
+
+The messages are sent on the loopback interface, no hub is needed.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+
+import getopt, sys
+import logging
+import threading
+import time
+from domogik.xpl.common.xplconnector import Manager
+from domogik.xpl.common.xplmessage import XplMessage
+
+
+class BenchPlugin:
+    """ Minimal stand-in for XplPlugin, with what the Manager uses
+    """
+    def __init__(self, log_level):
+        logging.basicConfig()
+        self.log = logging.getLogger("xpl_send_benchmarks")
+        self.log.setLevel(log_level)
+        self._stop = threading.Event()
+        self._stop_cb = []
+
+    def get_plugin_name(self):
+        return "bench"
+
+    def get_sanitized_hostname(self):
+        return "benchhost"
+
+    def should_stop(self):
+        return self._stop.isSet()
+
+    def get_stop(self):
+        return self._stop
+
+    def register_thread(self, thread):
+        pass
+
+    def register_timer(self, timer):
+        pass
+
+    def unregister_timer(self, timer):
+        pass
+
+    def add_stop_cb(self, cb):
+        self._stop_cb.append(cb)
+
+    def stop(self):
+        self._stop.set()
+        for cb in self._stop_cb:
+            cb()
+
+
+def build_message(i):
+    """ Build a sensor.basic message, as sent by the sensors plugins
+    """
+    mess = XplMessage()
+    mess.set_type("xpl-trig")
+    mess.set_schema("sensor.basic")
+    mess.add_data({"device" : "th%s" % (i % 50),
+                   "type" : "temp",
+                   "current" : "%.1f" % (i % 400 / 10.0)})
+    return mess
+
+
+def run_send(manager, count, nb_threads):
+    """ Send count messages from nb_threads threads
+    @param manager : Manager instance
+    @param count : number of messages sent by each thread
+    @param nb_threads : number of sending threads
+    """
+    messages = [build_message(i) for i in range(count)]
+
+    def sender():
+        for mess in messages:
+            manager.send(mess)
+
+    threads = [threading.Thread(target=sender) for i in range(nb_threads)]
+    start_t = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start_t
+    total = count * nb_threads
+    print("%s messages sent by %s thread(s)" % (total, nb_threads))
+    print("\tExecution time = %s" % duration)
+    print("\tThroughput = %d messages/s" % (total / duration))
+    print("\tMean time per message = %.1f us" % (duration * 1000000 / total))
+
+
+def usage(prog_name):
+    """Print program usage"""
+    print("Usage : %s [-n COUNT] [-t THREADS] [-d]" % prog_name)
+    print("-n, --count=COUNT\t\tNumber of messages sent by each thread (default 20000)")
+    print("-t, --threads=THREADS\t\tNumber of sending threads (default 1)")
+    print("-d, --debug\t\t\tSet the log level to debug (default info)")
+
+if __name__ == "__main__":
+    count = 20000
+    nb_threads = 1
+    log_level = logging.INFO
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hn:t:d", ["help", "count=", "threads=", "debug"])
+    except getopt.GetoptError:
+        usage(sys.argv[0])
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            usage(sys.argv[0])
+            sys.exit()
+        elif opt in ("-n", "--count"):
+            count = int(arg)
+        elif opt in ("-t", "--threads"):
+            nb_threads = int(arg)
+        elif opt in ("-d", "--debug"):
+            log_level = logging.DEBUG
+    plugin = BenchPlugin(log_level)
+    manager = Manager("127.0.0.1", broadcast="127.0.0.1", plugin=plugin, nohub=True)
+    try:
+        run_send(manager, count, nb_threads)
+    finally:
+        plugin.stop()
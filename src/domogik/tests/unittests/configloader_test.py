@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- ConfigCacheTest
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from domogik.common import configloader
+from domogik.common.configloader import Loader, ConfigCache
+
+CONFIG = """[domogik]
+log_level = debug
+log_dir_path = /var/log/domogik/
+
+[rest]
+rest_server_port = 40405
+rest_use_ssl = False
+"""
+
+
+class ConfigCacheTest(unittest.TestCase):
+    """ Test the config cache of the Loader, on a temporary config file
+    """
+    def setUp(self):
+        """ Setup context.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "domogik.cfg")
+        with open(self.filename, "w") as cfg_file:
+            cfg_file.write(CONFIG)
+        self.saved = (configloader.CONFIG_FILE, configloader.LOCK_FILE, configloader._cache)
+        configloader.CONFIG_FILE = self.filename
+        configloader.LOCK_FILE = os.path.join(self.directory, "lock", "config.lock")
+        configloader._cache = ConfigCache(self.filename)
+
+    def tearDown(self):
+        """ Restore context.
+        """
+        configloader.CONFIG_FILE, configloader.LOCK_FILE, configloader._cache = self.saved
+        shutil.rmtree(self.directory)
+
+    def test_load(self):
+        """ Test the file is parsed once for all the loaders
+        """
+        main, rest = Loader('rest').load()
+        self.assertEqual(main['log_level'], 'debug')
+        self.assertEqual(dict(rest)['rest_server_port'], '40405')
+        self.assertEqual(Loader().load(), (main, None))
+        self.assertEqual(configloader._cache.loads, 1)
+
+    def test_section(self):
+        """ Test the typed accessors and the read only view
+        """
+        section = Loader('rest').section()
+        self.assertEqual(section.get_int('rest_server_port'), 40405)
+        self.assertEqual(section.get_bool('rest_use_ssl'), False)
+        self.assertEqual(section.get_float('missing', 1.5), 1.5)
+        def assign():
+            section['rest_server_port'] = '1'
+        self.assertRaises(TypeError, assign)
+
+    def test_set(self):
+        """ Test a value set by a loader is seen by the other ones
+        """
+        loader = Loader('rest')
+        loader.load()
+        loader.set('rest', 'rest_server_port', '40406')
+        self.assertEqual(dict(Loader('rest').load()[1])['rest_server_port'], '40406')
+
+    def test_external_change(self):
+        """ Test a change of the file by another process is seen
+        """
+        Loader('rest').load()
+        time.sleep(0.01)
+        with open(self.filename, "w") as cfg_file:
+            cfg_file.write(CONFIG.replace("40405", "40407"))
+        # the inotify notification (if any) is asynchronous
+        for i in range(20):
+            if Loader('rest').section().get_int('rest_server_port') == 40407:
+                break
+            time.sleep(0.1)
+        self.assertEqual(Loader('rest').section().get_int('rest_server_port'), 40407)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- UpdateCacheTest
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import BaseHTTPServer
+import json
+import os
+import shutil
+import StringIO
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from domogik.common import packagemanager
+from domogik.common.packagemanager import PackageManager, PackageCatalog
+
+PACKAGES = [{"type" : "plugin", "id" : "x10", "fullname" : "plugin-x10",
+             "version" : "0.1", "changelog" : ""},
+            {"type" : "plugin", "id" : "ipx", "fullname" : "plugin-ipx",
+             "version" : "0.2", "changelog" : ""}]
+
+
+def build_data(packages):
+    """ Build the tgz data of a repository
+    """
+    data = StringIO.StringIO()
+    my_tar = tarfile.open(fileobj = data, mode = "w:gz")
+    for name, content in [("repo.info", json.dumps({"packages" : packages})),
+                          ("images/plugin/x10.png", "PNG"),
+                          ("plugins/plugin-x10-0.1.tgz", "ignored")]:
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        my_tar.addfile(info, StringIO.StringIO(content))
+    my_tar.close()
+    return data.getvalue()
+
+
+class RepositoryHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Local stand-in of a repository : /repo and /repo/data
+    """
+    def do_GET(self):
+        server = self.server
+        if self.path == "/repo":
+            self._answer(200, json.dumps({"count" : len(server.packages)}))
+        elif self.path == "/repo/data":
+            server.data_requests += 1
+            etag = '"%s"' % server.version
+            if self.headers.getheader("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            data = build_data(server.packages)
+            if server.truncate:
+                self._answer(200, data[:len(data) / 2], len(data), etag)
+            else:
+                self._answer(200, data, len(data), etag)
+        else:
+            self._answer(404, "")
+
+    def _answer(self, code, data, length = None, etag = None):
+        self.send_response(code)
+        self.send_header("Content-Length", length or len(data))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class UpdateCacheTest(unittest.TestCase):
+    """ Test the update of the repositories cache from a local repository
+    """
+    def setUp(self):
+        """ Setup context.
+        """
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), RepositoryHandler)
+        self.server.packages = PACKAGES
+        self.server.version = 1
+        self.server.truncate = False
+        self.server.data_requests = 0
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.start()
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        sources = os.path.join(self.directory, "sources.list")
+        with open(sources, "w") as src_file:
+            src_file.write("# local repository\n")
+            src_file.write("50 http://127.0.0.1:%s/repo/\n" % self.server.server_port)
+        self.saved = (packagemanager.REPO_CACHE_DIR, packagemanager.REPO_SRC_FILE,
+                      packagemanager.PACKAGE_MODE, packagemanager._catalog)
+        packagemanager.REPO_CACHE_DIR = self.cache_dir
+        packagemanager.REPO_SRC_FILE = sources
+        packagemanager.PACKAGE_MODE = True
+        packagemanager._catalog = PackageCatalog(self.cache_dir, [])
+        self.pkg_mgr = PackageManager()
+
+    def tearDown(self):
+        """ Restore context.
+        """
+        (packagemanager.REPO_CACHE_DIR, packagemanager.REPO_SRC_FILE,
+         packagemanager.PACKAGE_MODE, packagemanager._catalog) = self.saved
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_update(self):
+        """ Test the packages and the icons are cached
+        """
+        self.assertTrue(self.pkg_mgr.update_cache())
+        pkg_list = self.pkg_mgr.get_packages_list()
+        self.assertEqual([pkg["id"] for pkg in pkg_list], ["ipx", "x10"])
+        self.assertEqual(pkg_list[0]["priority"], "50")
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, "images")), ["x10.png"])
+
+    def test_not_modified(self):
+        """ Test unchanged data are not downloaded again
+        """
+        self.assertTrue(self.pkg_mgr.update_cache())
+        self.assertTrue(self.pkg_mgr.update_cache())
+        self.assertEqual(self.server.data_requests, 2)
+        self.assertEqual(len(self.pkg_mgr.get_packages_list()), 2)
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, "images", "x10.png")))
+        self.server.packages = PACKAGES[:1]
+        self.server.version = 2
+        self.assertTrue(self.pkg_mgr.update_cache())
+        self.assertEqual(len(self.pkg_mgr.get_packages_list()), 1)
+
+    def test_failure_keeps_cache(self):
+        """ Test the previous cache is kept when a download fails
+        """
+        self.assertTrue(self.pkg_mgr.update_cache())
+        self.server.version = 2
+        self.server.truncate = True
+        self.assertFalse(self.pkg_mgr.update_cache())
+        self.assertEqual(len(self.pkg_mgr.get_packages_list()), 2)
+        self.assertFalse(os.path.exists("%s.new" % self.cache_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
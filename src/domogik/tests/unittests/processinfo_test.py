@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- ProcessSamplerTest
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from domogik.common.processinfo import ProcessSampler, read_process
+
+
+class ProcessSamplerTest(unittest.TestCase):
+    """ Test the sampling of the processes which have a pid file
+    """
+    def setUp(self):
+        """ Setup context.
+        """
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, "test.pid"), "w") as pid_file:
+            pid_file.write("%s\n" % os.getpid())
+
+    def tearDown(self):
+        """ Restore context.
+        """
+        shutil.rmtree(self.directory)
+
+    def test_read_process(self):
+        """ Test the counters of the current process
+        """
+        event = threading.Event()
+        thread = threading.Thread(target = event.wait)
+        thread.start()
+        try:
+            sample = read_process(os.getpid())
+        finally:
+            event.set()
+            thread.join()
+        self.assertEqual(sample.pid, os.getpid())
+        self.assertTrue(sample.threads >= 2)
+        self.assertTrue(sample.fds > 0)
+        self.assertTrue(sample.memory_rss > 0)
+        self.assertTrue(sample.memory_vsz >= sample.memory_rss)
+
+    def test_sampler(self):
+        """ Test the ring buffers and the stale pid files
+        """
+        with open(os.path.join(self.directory, "stale.pid"), "w") as pid_file:
+            # above the default pid_max
+            pid_file.write("4194305")
+        sampler = ProcessSampler(self.directory, size = 3)
+        for i in range(5):
+            sampler.sample()
+        self.assertEqual(len(sampler.history("test")), 3)
+        usage = sampler.get_usage()
+        self.assertEqual(usage.keys(), ["test"])
+        self.assertEqual(usage["test"]["pid"], os.getpid())
+        os.unlink(os.path.join(self.directory, "test.pid"))
+        sampler.sample()
+        self.assertEqual(sampler.get_usage(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- DependencyResolverTest
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import unittest
+
+from domogik.common.resolver import DependencyResolver, version_match, version_key, priority_key
+
+PACKAGES = [
+    {"type" : "plugin", "id" : "x10", "version" : "0.1", "priority" : "10",
+     "dependencies" : [{"type" : "python", "id" : "pyserial (>= 2.4)"}]},
+    {"type" : "plugin", "id" : "x10", "version" : "0.2", "priority" : "5",
+     "dependencies" : [{"type" : "python", "id" : "pyserial (>= 2.5)"},
+                       {"type" : "plugin", "id" : "onewire (>= 0.1)"}]},
+    {"type" : "plugin", "id" : "onewire", "version" : "0.1", "priority" : "10",
+     "dependencies" : [{"type" : "python", "id" : "pyserial (>= 2.5)"}]},
+    {"type" : "plugin", "id" : "loop", "version" : "0.1", "priority" : "10",
+     "dependencies" : [{"type" : "plugin", "id" : "loop"}]},
+    {"type" : "plugin", "id" : "a", "version" : "1.0", "priority" : "10",
+     "dependencies" : [{"type" : "plugin", "id" : "c (>= 1.0)"}]},
+    {"type" : "plugin", "id" : "b", "version" : "1.0", "priority" : "10",
+     "dependencies" : [{"type" : "plugin", "id" : "c (>= 2.0)"}]},
+    {"type" : "plugin", "id" : "c", "version" : "1.5", "priority" : "10",
+     "dependencies" : []},
+]
+
+
+class Catalog():
+    """ Stand-in for the PackageCatalog of the repositories cache
+    """
+
+    def __init__(self, packages):
+        self.packages = packages
+
+    def versions(self, pkg_type, pkg_id):
+        return [pkg for pkg in self.packages if (pkg["type"], pkg["id"]) == (pkg_type, pkg_id)]
+
+    def latest(self, pkg_type, pkg_id):
+        pkgs = self.versions(pkg_type, pkg_id)
+        if len(pkgs) == 0:
+            return None
+        return max(pkgs, key = lambda k: (version_key(k["version"]), priority_key(k["priority"])))
+
+
+class DependencyResolverTest(unittest.TestCase):
+    """ Test the resolution of the dependencies
+    """
+
+    def test_version_match(self):
+        """ Test the version checks
+        """
+        self.assertTrue(version_match("pyserial (>= 2.4)", "2.5"))
+        self.assertFalse(version_match("pyserial (>= 2.4)", "2.3"))
+        self.assertFalse(version_match("pyserial (>= 2.4)", "not a version"))
+
+    def test_plan(self):
+        """ Test the dependencies are installed first
+        """
+        resolver = DependencyResolver(Catalog(PACKAGES), [])
+        plan = resolver.resolve([{"type" : "plugin", "id" : "x10"},
+                                 {"type" : "python", "id" : "pyserial (>= 2.5)"}])
+        self.assertEqual([(pkg["name"], pkg["candidate"]) for pkg in plan["packages"]],
+                         [("onewire", "0.1"), ("x10", "0.2")])
+        self.assertEqual(plan["python"], ["pyserial (>= 2.5)"])
+
+    def test_installed(self):
+        """ Test an installed package which satisfies the requirement is kept
+        """
+        resolver = DependencyResolver(Catalog(PACKAGES), [{"type" : "plugin", "id" : "x10", "version" : "0.1"}])
+        plan = resolver.resolve([{"type" : "plugin", "id" : "x10 (>= 0.1)"}])
+        self.assertEqual(len(plan["packages"]), 1)
+        self.assertTrue(plan["packages"][0]["installed"])
+        self.assertEqual(plan["python"], [])
+        plan = resolver.resolve([{"type" : "plugin", "id" : "x10 (>= 0.2)"}])
+        self.assertEqual(plan["packages"][-1]["candidate"], "0.2")
+
+    def test_errors(self):
+        """ Test missing and circular dependencies
+        """
+        resolver = DependencyResolver(Catalog(PACKAGES), [])
+        plan = resolver.resolve([{"type" : "plugin", "id" : "x10 (>= 1.0)"},
+                                 {"type" : "plugin", "id" : "loop"}])
+        self.assertNotEqual(plan["packages"][0]["error"], "")
+        self.assertTrue("Circular" in plan["packages"][1]["error"])
+        self.assertEqual(plan["packages"][2]["name"], "loop")
+
+    def test_conflict(self):
+        """ Test a package already chosen is checked against the next requirements
+        """
+        resolver = DependencyResolver(Catalog(PACKAGES), [])
+        plan = resolver.resolve([{"type" : "plugin", "id" : "a"},
+                                 {"type" : "plugin", "id" : "b"}])
+        self.assertEqual([(pkg["name"], pkg["candidate"]) for pkg in plan["packages"]],
+                         [("c", "1.5"), ("a", "1.0"), ("c", ""), ("b", "1.0")])
+        self.assertEqual(plan["packages"][0]["error"], "")
+        self.assertTrue("Conflict" in plan["packages"][2]["error"])
+        self.assertEqual(plan["packages"][2]["id"], "c (>= 2.0)")
+
+
+if __name__ == "__main__":
+    unittest.main()
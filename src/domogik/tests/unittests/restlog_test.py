@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- RestLogTest
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+from domogik.xpl.lib.rest.request import ProcessRequest
+from domogik.xpl.lib.rest.router import UrlRouter
+
+
+class FakeContext():
+    """ The data of the REST server used by the /log urls
+    """
+
+    def __init__(self, log_dir_path):
+        self.log = logging.getLogger("restlog_test")
+        self.log_dm = self.log
+        self.log_dir_path = log_dir_path
+        self._stop = threading.Event()
+        # the follow requests end at once
+        self._stop.set()
+
+    def get_sanitized_hostname(self):
+        return "myhost"
+
+    def get_stop(self):
+        return self._stop
+
+
+class FakeHandler():
+    """ The HTTP handler which owns the request context
+    """
+
+    def __init__(self, context):
+        self._request_context = context
+
+
+class RestLogTest(unittest.TestCase):
+    """ Test the /log urls through the url router
+    """
+
+    def setUp(self):
+        """ Setup context.
+        """
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, "test.log"), "w") as log_file:
+            log_file.write("line1\nline2\nline3\n")
+        self.context = FakeContext(self.directory)
+        self.router = UrlRouter(ProcessRequest, ProcessRequest.urls, ProcessRequest.fallback_urls)
+        self.responses = []
+
+    def tearDown(self):
+        """ Restore context.
+        """
+        shutil.rmtree(self.directory)
+
+    def dispatch(self, path):
+        """ Build a request for an url and route it
+        """
+        self.wfile = StringIO()
+        request = ProcessRequest((FakeHandler(self.context),), path, "GET", {},
+                                 self.responses.append,
+                                 lambda *args: None,
+                                 lambda: None,
+                                 self.wfile,
+                                 None,
+                                 None, None, None,
+                                 self.responses.append,
+                                 self.responses.append)
+        self.assertNotEqual(self.router.match(request.rest_type, request.path), None)
+        self.router.dispatch(request, request.rest_type, request.path)
+
+    def test_tail(self):
+        """ Test the tail urls
+        """
+        self.dispatch("/log/tail/txt/myhost/test/2/0")
+        self.assertEqual(self.responses, ["line2\nline3\n"])
+        self.dispatch("/log/tail/html/myhost/test/1/1")
+        self.assertTrue("line2" in self.responses[1])
+        self.assertFalse("line3" in self.responses[1])
+
+    def test_follow(self):
+        """ Test the follow url of an existing and of a missing file
+        """
+        self.dispatch("/log/follow/myhost/test")
+        self.assertEqual(self.responses, [200])
+        self.dispatch("/log/follow/myhost/missing")
+        self.assertTrue(self.responses[1].startswith("Unable to read"))
+
+
+if __name__ == "__main__":
+    unittest.main()
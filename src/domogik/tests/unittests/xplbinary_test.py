@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- XplBinaryTest
+- BinaryManager
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import logging
+import threading
+import unittest
+
+from domogik.common.dmg_exceptions import XplMessageError
+from domogik.xpl.common import xplbinary
+from domogik.xpl.common.xplconnector import Manager
+from domogik.xpl.common.xplfragment import SentFragmentsCache
+from domogik.xpl.common.xplmessage import XplMessage
+from domogik.xpl.common.xplmetrics import Metrics
+
+
+class FakeSocket:
+    """ Keep the sent packets
+    """
+    def __init__(self):
+        self.packets = []
+
+    def sendto(self, packet, address):
+        self.packets.append(packet)
+
+
+class FakePlugin:
+    """ Plugin of the Manager : logger and stop event
+    """
+    def __init__(self):
+        self.log = logging.getLogger("xplbinary_test")
+        self._stop = threading.Event()
+
+    def get_stop(self):
+        return self._stop
+
+
+class BinaryManager(Manager):
+    """ Manager without network whose hub announced the binary encoding
+    """
+    def __init__(self):
+        self.p = FakePlugin()
+        self.metrics = Metrics(0)
+        self._send_waiting = 0
+        self._send_waiting_lock = threading.Lock()
+        self._lock_send = threading.Semaphore()
+        self._transport = None
+        self._hub_binary = True
+        self._broadcast = "255.255.255.255"
+        self._UDPSock = FakeSocket()
+        self._fragment_uid = 1
+        self._sent_fragments = SentFragmentsCache()
+        self._source_fields = []
+        self._headers = {}
+
+
+class XplBinaryTest(unittest.TestCase):
+    """ Test the binary encoding of xPL messages.
+    """
+    def setUp(self):
+        """ Setup context.
+        """
+        self.__xpl_message = XplMessage()
+        self.__xpl_message.set_type("xpl-trig")
+        self.__xpl_message.set_source("domogik-teleinfo.myhost")
+        self.__xpl_message.set_target("*")
+        self.__xpl_message.set_schema("teleinfo.basic")
+        self.__xpl_message.add_single_data("adco", "030928084432")
+        self.__xpl_message.add_single_data("device", "teleinfo")
+        self.__xpl_message.add_single_data("part", "1")
+        self.__xpl_message.add_single_data("part", "2")
+
+    def test_round_trip(self):
+        """ Test encoding then decoding a message.
+        """
+        packet = self.__xpl_message.to_binary()
+        self.assertTrue(xplbinary.is_binary(packet))
+        self.assertFalse(xplbinary.is_binary(self.__xpl_message.to_packet()))
+        message = XplMessage(packet)
+        self.assertEqual(message.to_packet(), self.__xpl_message.to_packet())
+        self.assertEqual(message.source_device_id, "teleinfo")
+        self.assertEqual(message.source_instance_id, "myhost")
+        self.assertEqual(message.target_vendor_id, None)
+        self.assertEqual(message.schema_class, "teleinfo")
+        self.assertEqual(message.data["part"], ["1", "2"])
+
+    def test_size(self):
+        """ Test a big message is not fragmented and is smaller than the text one.
+        """
+        for i in xrange(100):
+            self.__xpl_message.add_single_data("value", "v" * 30)
+            self.__xpl_message.add_single_data("key%s" % i, "v" * 200)
+        packet = self.__xpl_message.to_binary()
+        self.assertTrue(len(self.__xpl_message.to_packet()) > 1472)
+        self.assertTrue(len(packet) < xplbinary.MAX_SIZE)
+        self.assertTrue(len(packet) < len(self.__xpl_message.to_packet()))
+        self.assertEqual(XplMessage(packet).to_packet(), self.__xpl_message.to_packet())
+
+    def test_invalid(self):
+        """ Test invalid binary packets.
+        """
+        packet = self.__xpl_message.to_binary()
+        self.assertRaises(XplMessageError, XplMessage, packet[:-1])
+        self.assertRaises(XplMessageError, XplMessage, packet + "x")
+        self.assertRaises(XplMessageError, XplMessage, packet[:2] + "\x09" + packet[3:])
+
+    def test_text_fallback(self):
+        """ Test a value too long for the binary encoding is sent as text fragments.
+        """
+        self.__xpl_message.add_single_data("big", "v" * 40000)
+        self.assertRaises(XplMessageError, self.__xpl_message.to_binary)
+        manager = BinaryManager()
+        manager.send(self.__xpl_message)
+        self.assertEqual(manager.metrics.counters.get("send_errors"), None)
+        self.assertEqual(manager.metrics.counters["sent_fragmented"], 1)
+        packets = manager._UDPSock.packets
+        self.assertTrue(len(packets) > 1)
+        for packet in packets:
+            self.assertFalse(xplbinary.is_binary(packet))
+            self.assertTrue("fragment.basic" in packet)
+
+
+if __name__ == "__main__":
+    unittest.main()
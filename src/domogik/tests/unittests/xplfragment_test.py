@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- FragmentReassemblerTest
+- SentFragmentsCacheTest
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import unittest
+
+from domogik.xpl.common.xplmessage import XplMessage, FragmentedXplMessage
+from domogik.xpl.common.xplfragment import parse_partid, FragmentReassembler, SentFragmentsCache
+
+
+def build_big_message():
+    """ Build a message which needs 3 fragments
+    """
+    message = XplMessage()
+    message.set_type("xpl-trig")
+    message.set_source("domogik-rest.myhost")
+    message.set_target("*")
+    message.set_schema("domogik.package")
+    for i in xrange(60):
+        message.add_single_data("key%s" % i, "v" * 60)
+    return message
+
+
+class FragmentReassemblerTest(unittest.TestCase):
+    """ Test FragmentReassembler class.
+    """
+    def setUp(self):
+        """ Setup context.
+        """
+        self.__message = build_big_message()
+        self.__fragments = FragmentedXplMessage.fragment_message(self.__message, 42)
+
+    def test_parse_partid(self):
+        """ Test parse_partid() function.
+        """
+        self.assertEqual(parse_partid("2/3:42"), (2, 3, "42"))
+        self.assertRaises(ValueError, parse_partid, "2:42")
+        self.assertRaises(ValueError, parse_partid, "a/3:42")
+
+    def test_reassembly(self):
+        """ Test the reassembly of fragments received in any order, with duplicates.
+        """
+        self.assertEqual(len(self.__fragments), 3)
+        reassembler = FragmentReassembler()
+        self.assertEqual(reassembler.add(self.__fragments[3], 100), None)
+        self.assertEqual(reassembler.add(self.__fragments[1], 100), None)
+        self.assertEqual(reassembler.add(self.__fragments[1], 100), None)
+        self.assertEqual(len(reassembler), 1)
+        message = reassembler.add(self.__fragments[2], 100)
+        self.assertEqual(message.to_packet(), self.__message.to_packet())
+        self.assertEqual(len(reassembler), 0)
+        self.assertEqual(reassembler.get_size(), 0)
+
+    def test_completed_released(self):
+        """ Test the completed messages are not kept for the expiry.
+        """
+        reassembler = FragmentReassembler()
+        for uid in xrange(1000):
+            fragments = FragmentedXplMessage.fragment_message(self.__message, uid)
+            for part in fragments:
+                reassembler.add(fragments[part], 100)
+        self.assertEqual(len(reassembler), 0)
+        self.assertEqual(len(reassembler._age), 0)
+        self.assertEqual(reassembler.next_deadline(), None)
+
+    def test_expire(self):
+        """ Test the missing parts request and the expiry of incomplete messages.
+        """
+        reassembler = FragmentReassembler(ttl = 10)
+        reassembler.add(self.__fragments[1], 100, now = 0)
+        self.assertEqual(reassembler.next_deadline(), 5)
+        self.assertEqual(reassembler.expire(now = 1), [])
+        requests = reassembler.expire(now = 5)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0].schema, "fragment.request")
+        self.assertEqual(requests[0].target, "domogik-rest.myhost")
+        self.assertEqual(requests[0].data["message"], "42")
+        self.assertEqual(requests[0].data["part"], ["2", "3"])
+        # only one request per message
+        self.assertEqual(reassembler.expire(now = 6), [])
+        self.assertEqual(reassembler.next_deadline(), 10)
+        reassembler.expire(now = 10)
+        self.assertEqual(len(reassembler), 0)
+        self.assertEqual(reassembler.dropped, 1)
+        self.assertEqual(reassembler.next_deadline(), None)
+
+    def test_budget(self):
+        """ Test the byte budget.
+        """
+        reassembler = FragmentReassembler(max_bytes = 1000)
+        first = FragmentedXplMessage.fragment_message(self.__message, 1)
+        second = FragmentedXplMessage.fragment_message(self.__message, 2)
+        reassembler.add(first[1], 600)
+        reassembler.add(second[1], 600)
+        self.assertEqual(len(reassembler), 1)
+        self.assertEqual(reassembler.get_size(), 600)
+        self.assertEqual(reassembler.add(first[2], 600), None)
+        self.assertEqual(reassembler.dropped, 2)
+
+
+class SentFragmentsCacheTest(unittest.TestCase):
+    """ Test SentFragmentsCache class.
+    """
+    def test_bounded(self):
+        """ Test the cache only keeps the last messages.
+        """
+        cache = SentFragmentsCache(size = 2)
+        message = build_big_message()
+        for uid in xrange(1, 4):
+            cache.store(uid, FragmentedXplMessage.fragment_message(message, uid))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(1, 1), None)
+        self.assertEqual(cache.get(3, 2).data["partid"], "2/3:3")
+
+    def test_get_requested(self):
+        """ Test the answer to a fragment.request message.
+        """
+        cache = SentFragmentsCache()
+        message = build_big_message()
+        cache.store(7, FragmentedXplMessage.fragment_message(message, 7))
+        request = XplMessage()
+        request.set_type("xpl-cmnd")
+        request.set_schema("fragment.request")
+        request.add_single_data("command", "resend")
+        request.add_single_data("message", "7")
+        request.add_single_data("part", "1")
+        request.add_single_data("part", "3")
+        request.add_single_data("part", "9")
+        fragments = cache.get_requested(request)
+        self.assertEqual([f.data["partid"] for f in fragments], ["1/3:7", "3/3:7"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Unit tests.
+
+Implements
+==========
+
+- HistogramTest
+- MetricsTest
+
+@author: Domogik project
+@copyright: (C) 2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import unittest
+
+from domogik.xpl.common.xplmetrics import Histogram, Metrics, bucket_index, bucket_value, BUCKETS
+
+
+class HistogramTest(unittest.TestCase):
+    """ Test the latency histograms
+    """
+
+    def test_buckets(self):
+        """ Test each value is in the bucket which covers it
+        """
+        for value in range(0, 100000, 7):
+            index = bucket_index(value)
+            self.assertTrue(bucket_value(index) >= value)
+            if index > 0:
+                self.assertTrue(bucket_value(index - 1) < value)
+        self.assertEqual(bucket_index(10 ** 12), BUCKETS - 1)
+
+    def test_percentiles(self):
+        """ Test the percentiles are within the precision of the buckets
+        """
+        histogram = Histogram()
+        for value in range(1, 1001):
+            histogram.record(value / 1000000.0)
+        self.assertEqual(histogram.count, 1000)
+        self.assertTrue(500e-6 <= histogram.percentile(50) <= 500e-6 * 1.125)
+        self.assertTrue(990e-6 <= histogram.percentile(99) <= 1000e-6)
+        self.assertEqual(histogram.summary()["max"], 1.0)
+
+
+class MetricsTest(unittest.TestCase):
+    """ Test the counters and the sampled timings
+    """
+
+    def test_sampling(self):
+        """ Test all the calls are timed with a rate of 1, none with 0
+        """
+        metrics = Metrics(1)
+        for i in range(10):
+            metrics.stop("timed", metrics.start())
+        self.assertEqual(metrics.snapshot()["histograms"]["timed"]["count"], 10)
+        metrics = Metrics(0)
+        for i in range(10):
+            metrics.stop("timed", metrics.start())
+        self.assertEqual(metrics.snapshot()["histograms"], {})
+
+    def test_counters(self):
+        """ Test the counters and the gauges
+        """
+        metrics = Metrics()
+        metrics.incr("parsed")
+        metrics.incr("parsed", 2)
+        metrics.gauge_max("waiting", 3)
+        metrics.gauge_max("waiting", 1)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"], {"parsed" : 3})
+        self.assertEqual(snapshot["gauges"], {"waiting" : 3})
+        self.assertTrue("parsed = 3" in metrics.dump())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -50,13 +50,14 @@ from domogik.common.configloader import Loader
 from domogik.xpl.common.xplconnector import Listener 
 from domogik.xpl.common.xplconnector import READ_NETWORK_TIMEOUT
 from domogik.xpl.common.xplmessage import XplMessage
-from domogik.xpl.common.plugin import XplPlugin
+from domogik.xpl.common.plugin import XplPlugin, TIME_BETWEEN_EACH_PROCESS_STATUS
 from domogik.xpl.common.queryconfig import Query
 from domogik.common.packagemanager import PackageManager, PKG_PART_XPL
 from domogik.common.packagejson import PackageJson, PackageException
 from domogik.xpl.common.xplconnector import XplTimer 
 from ConfigParser import NoSectionError
-from distutils2.version import VersionPredicate, IrrationalVersionError
+from domogik.common.processinfo import ProcessSampler
+from domogik.common.resolver import PythonPackages, ResolverException, parse_requirement, version_match
 # the try/except it to handle http://bugs.python.org/issue14317
 try:
     from distutils2.index.simple import Crawler
@@ -285,6 +286,8 @@ class SysManager(XplPlugin):
 
             # PackageManager instance
             self.pkg_mgr = PackageManager()
+            # installed python distributions, for the dependencies checks
+            self._python_packages = PythonPackages()
     
             # hbeat management for externals
             if self.options.check_external:
@@ -313,6 +316,14 @@ class SysManager(XplPlugin):
                                           self.myxpl)
                 external_timer.start()
 
+            # usage (cpu, memory, threads...) of the Domogik processes of the host
+            self._process_sampler = ProcessSampler(self._pid_dir_path,
+                                                   TIME_BETWEEN_EACH_PROCESS_STATUS,
+                                                   self._send_usage,
+                                                   self.log,
+                                                   self.myxpl)
+            self._process_sampler.start()
+
             # inotify 
             wmgr = pyinotify.WatchManager() # Watch manager
             mask = pyinotify.IN_MODIFY | pyinotify.IN_MOVED_TO | pyinotify.IN_DELETE | pyinotify.IN_CREATE # watched events
@@ -1231,10 +1242,37 @@ class SysManager(XplPlugin):
         self.myxpl.send(mess)
 
 
+    def _send_usage(self, usage):
+        """ Send the usage of all the Domogik processes in one xpl message
+            @param usage : {name : {"pid" : ..., "cpu_percent" : ...}, ...}
+        """
+        mess = XplMessage()
+        mess.set_type("xpl-stat")
+        mess.set_schema("domogik.usage")
+        mess.add_data({"host" : self.get_sanitized_hostname()})
+        idx = 0
+        for name in sorted(usage):
+            data = usage[name]
+            mess.add_data({"name%s" % idx : name,
+                           "pid%s" % idx : data["pid"],
+                           "cpu-percent%s" % idx : data["cpu_percent"],
+                           "memory-percent%s" % idx : data["memory_percent"],
+                           "memory-rss%s" % idx : data["memory_rss"],
+                           "memory-vsz%s" % idx : data["memory_vsz"],
+                           "threads%s" % idx : data["threads"],
+                           "threads-max%s" % idx : data["threads_max"]})
+            if data["fds"] != None:
+                mess.add_data({"fds%s" % idx : data["fds"]})
+            idx += 1
+        if idx > 0:
+            self.myxpl.send(mess)
+
     def _pkg_check_dependencies(self, message):
         """ Check if python dependencies for a package are installed
             @param message : xpl message received
         """
+        # a dependency may have been installed since the last check
+        self._python_packages.invalidate()
         mess = XplMessage()
         mess.set_type('xpl-trig')
         mess.set_schema('domogik.package')
@@ -1252,15 +1290,15 @@ class SysManager(XplPlugin):
                 self.myxpl.send(mess)
                 return
             try:
-                ver = VersionPredicate(dep)
-            except IrrationalVersionError:
+                ver = parse_requirement(dep)
+            except ResolverException:
                 msg = "Irrational version for dependency '%s'" % dep
                 self.log.warning(msg)
                 mess.add_data({'error' : msg})
                 self.myxpl.send(mess)
                 return
 
-            is_installed, installed_version = self._pkg_is_dep_installed(ver)
+            is_installed, installed_version = self._pkg_is_dep_installed(dep)
             if is_installed:
                 installed = "yes"
                 mess.add_data({"dep%s-version" % idx : installed_version})
@@ -1272,7 +1310,7 @@ class SysManager(XplPlugin):
                 found = False
                 try:
                     for rel in crawler.get_releases(dep):
-                        if  ver.match(rel._version):
+                        if version_match(dep, rel._version):
                             found = True
                             mess.add_data({"dep%s-candidate" % idx : rel._version})
                             mess.add_data({"dep%s-cmd-line" % idx : "sudo pip install %s==%s" % (ver.name, rel._version)})
@@ -1289,21 +1327,12 @@ class SysManager(XplPlugin):
             idx += 1
         self.myxpl.send(mess)
 
-    def _pkg_is_dep_installed(self, version):
+    def _pkg_is_dep_installed(self, dep):
         """ Check if dependency is installed
-            @param dep : dependency as VersionPredicate. Example : pyserial >= 2.4
+            The installed distributions are read once for all the dependencies
+            @param dep : dependency. Example : pyserial (>= 2.4)
         """
-        subp = Popen("pip freeze | grep -i %s" % version.name, stdout=PIPE, shell=True)
-        res = subp.stdout.read()
-        subp.communicate()
-        if res == "":
-            return False, None
-        tab = res.rstrip().split("==")
-        if version.match(tab[1]):
-            return True, tab[1]
-        else:
-            return False, tab[1]
-        return True, None
+        return self._python_packages.check(dep)
         
 
     def _pkg_install(self, message):
@@ -54,8 +54,10 @@ from domogik.xpl.lib.rest.jsondata import JSonHelper
 from domogik.xpl.lib.rest.event import DmgEvents
 from domogik.xpl.lib.rest.eventrequest import RequestEvents
 from domogik.xpl.lib.rest.stat import StatsManager
-from domogik.xpl.lib.rest.request import ProcessRequest
+from domogik.xpl.lib.rest.request import ProcessRequest, RequestContext
+from domogik.xpl.lib.rest.router import UrlRouter
 from domogik.common.configloader import Loader
+from domogik.common.database import DbHelperPool
 from domogik.common.packagemanager import PackageManager
 from xml.dom import minidom
 import time
@@ -69,6 +71,7 @@ import socket
 from OpenSSL import SSL
 import SocketServer
 import os
+import sys
 import errno
 import pyinotify
 import calendar
@@ -109,6 +112,9 @@ TMP_DIR = tempfile.gettempdir()
 # Repository
 DEFAULT_REPO_DIR = TMP_DIR
 
+# Number of free DbHelper kept for the requests (the engine pool has 20 connections)
+DB_POOL_SIZE = 20
+
 
 
 ################################################################################
@@ -161,6 +167,13 @@ class Rest(XplPlugin):
         # API version
         self._rest_api_version = REST_API_VERSION
 
+        # Url table, compiled once for all the requests
+        self._router = UrlRouter(ProcessRequest, ProcessRequest.urls, \
+                                 ProcessRequest.fallback_urls)
+        self.log.debug("%s urls compiled" % self._router.count())
+        for pattern, name in self._router.missing:
+            self.log.warning("No function %s for url %s" % (name, pattern))
+
         # Hosts list
         self._hosts_list = {self.get_sanitized_hostname() : 
                                 {"id" : self.get_sanitized_hostname(),
@@ -188,6 +201,9 @@ class Rest(XplPlugin):
                 print("Set package path to '%s' " % self._package_path)
                 self._design_dir = "%s/domogik_packages/design/" % self._package_path
                 self.package_mode = True
+                # packages are imported from here (helpers)
+                if self._package_path not in sys.path:
+                    sys.path.insert(0, self._package_path)
             else:
                 self.log.info("No package path defined in config file")
                 self._package_path = None
@@ -692,6 +708,10 @@ class Rest(XplPlugin):
         # Start HTTP server
         self.log.info("Start HTTP Server on %s:%s..." % (self.server_ip, self.server_port))
 
+        # Data shared by all the requests
+        self._db_pool = DbHelperPool(size = DB_POOL_SIZE)
+        self._request_context = RequestContext(self)
+
         if self.use_ssl:
             self.server = HTTPSServerWithParam((self.server_ip, int(self.server_port)), RestHandler, \
                                          handler_params = [self])
@@ -909,6 +929,7 @@ class RestHandler(BaseHTTPRequestHandler):
         """ Create an object for each request. This object will process 
             the REST url
         """
+        request = None
         try:
             request = ProcessRequest(self.server.handler_params, self.path, \
                                  self.command, \
@@ -926,6 +947,9 @@ class RestHandler(BaseHTTPRequestHandler):
             request.do_for_all_methods()
         except:
             self.server.handler_params[0].log.error("%s" % self.server.handler_params[0].get_exception())
+        finally:
+            if request is not None:
+                request.release()
         
 
 
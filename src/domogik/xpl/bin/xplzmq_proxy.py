@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+ZeroMQ proxy for the xPL messages (used when xpl_transport = zmq)
+
+The plugins publish on the XSUB side (xpl_pub_port) and subscribe on the
+XPUB side (xpl_sub_port). Subscriptions are forwarded to the publishers,
+so the messages are filtered by topic before they reach the plugins.
+
+Without configuration file, the proxy listens on 127.0.0.1 with the
+default ports, so it can be used to test the transport on a single host.
+
+Implements
+==========
+
+- XplZmqProxy
+- main
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+from optparse import OptionParser
+import os
+import sys
+import zmq
+
+from domogik.common import daemonize
+from domogik.common.configloader import Loader, CONFIG_FILE
+from domogik.xpl.common.xplzmq import XPL_PUB_PORT, XPL_SUB_PORT
+
+# version
+VERSION = 1.0
+
+
+class XplZmqProxy:
+    """ Forward the xPL messages from the publishers to the subscribers
+    """
+
+    def __init__(self, ip, pub_port, sub_port):
+        """
+        @param ip : ip to bind
+        @param pub_port : port on which the plugins publish
+        @param sub_port : port on which the plugins subscribe
+        """
+        self._context = zmq.Context.instance()
+        self._frontend = self._context.socket(zmq.XSUB)
+        self._frontend.bind("tcp://%s:%s" % (ip, pub_port))
+        self._backend = self._context.socket(zmq.XPUB)
+        self._backend.bind("tcp://%s:%s" % (ip, sub_port))
+        self.nb_messages = 0
+        self.nb_subscriptions = 0
+
+    def run(self):
+        """ Forward messages and subscriptions until the context is terminated
+        """
+        poller = zmq.Poller()
+        poller.register(self._frontend, zmq.POLLIN)
+        poller.register(self._backend, zmq.POLLIN)
+        while True:
+            try:
+                events = dict(poller.poll())
+            except zmq.ZMQError:
+                break
+            if self._frontend in events:
+                self._backend.send_multipart(self._frontend.recv_multipart())
+                self.nb_messages += 1
+            if self._backend in events:
+                # subscription changes ('\x01<topic>' or '\x00<topic>')
+                self._frontend.send_multipart(self._backend.recv_multipart())
+                self.nb_subscriptions += 1
+
+    def close(self):
+        """ Close the sockets
+        """
+        self._frontend.close(linger = 0)
+        self._backend.close(linger = 0)
+
+
+def main():
+    ### Options management
+    parser = OptionParser()
+    parser.add_option("-V",
+                      "--version",
+                      action="store_true",
+                      dest="display_version",
+                      default=False,
+                      help="Display the xPL proxy version.")
+    parser.add_option("-f",
+                      action="store_true",
+                      dest="run_in_foreground",
+                      default=False,
+                      help="Run the xPL proxy in foreground, default to background.")
+    parser.add_option("--ip", dest="ip", default=None,
+                      help="Ip to bind (default : ip of the mq section, or 127.0.0.1)")
+    parser.add_option("--pub-port", dest="pub_port", default=None,
+                      help="Port on which the plugins publish (default : %s)" % XPL_PUB_PORT)
+    parser.add_option("--sub-port", dest="sub_port", default=None,
+                      help="Port on which the plugins subscribe (default : %s)" % XPL_SUB_PORT)
+    (options, args) = parser.parse_args()
+    if options.display_version:
+        print(VERSION)
+        sys.exit(0)
+
+    conf = {}
+    if os.path.exists(CONFIG_FILE):
+        cfg = Loader('mq')
+        conf = dict(cfg.load()[1])
+    ip = options.ip or conf.get('ip', '127.0.0.1')
+    pub_port = options.pub_port or conf.get('xpl_pub_port', XPL_PUB_PORT)
+    sub_port = options.sub_port or conf.get('xpl_sub_port', XPL_SUB_PORT)
+
+    if not options.run_in_foreground:
+        daemonize.createDaemon()
+
+    print("xPL ZeroMQ proxy : publish on %s:%s, subscribe on %s:%s" % (ip, pub_port, ip, sub_port))
+    proxy = XplZmqProxy(ip, pub_port, sub_port)
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        print("%s messages forwarded" % proxy.nb_messages)
+    proxy.close()
+
+
+if __name__ == "__main__":
+    main()
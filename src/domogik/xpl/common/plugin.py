@@ -41,6 +41,7 @@ import threading
 import os
 import sys
 from domogik.xpl.common.xplconnector import XplMessage, Manager, Listener
+from domogik.xpl.common.xplmetrics import METRICS_SAMPLE_RATE
 from domogik.xpl.common.baseplugin import BasePlugin
 from domogik.common.configloader import Loader, CONFIG_FILE
 from domogik.common.processinfo import ProcessInfo
@@ -87,7 +88,8 @@ class XplPlugin(BasePlugin):
         @param reload_cb : Callback to call when a "RELOAD" order is received, if None,
         nothing will happen
         @param dump_cb : Callback to call when a "DUMP" order is received, if None,
-        nothing will happen
+        nothing will happen. The xPL metrics (see xplmetrics) are written in the log
+        in both cases
         @param parser : An instance of OptionParser. If you want to add extra options to the generic option parser,
         create your own optionparser instance, use parser.addoption and then pass your parser instance as parameter.
         Your options/params will then be available on self.options and self.args
@@ -119,17 +121,31 @@ class XplPlugin(BasePlugin):
             broadcast = config['broadcast']
         else:
             broadcast = "255.255.255.255"
+        if 'xpl_rcvbuf' in config:
+            rcvbuf = int(config['xpl_rcvbuf'])
+        else:
+            rcvbuf = None
+        if config.get('xpl_transport') == 'zmq':
+            transport = self._get_zmq_transport()
+        else:
+            transport = None
+        binary = config.get('xpl_binary') == 'True'
+        metrics_sample = int(config.get('xpl_metrics_sample', METRICS_SAMPLE_RATE))
         if 'bind_interface' in config:
-            self.myxpl = Manager(config['bind_interface'], broadcast = broadcast, plugin = self, nohub = nohub)
+            self.myxpl = Manager(config['bind_interface'], broadcast = broadcast, plugin = self, nohub = nohub,
+                                 rcvbuf = rcvbuf, transport = transport, binary = binary,
+                                 metrics_sample = metrics_sample)
         else:
-            self.myxpl = Manager(broadcast = broadcast, plugin = self, nohub = nohub)
+            self.myxpl = Manager(broadcast = broadcast, plugin = self, nohub = nohub, rcvbuf = rcvbuf,
+                                 transport = transport, binary = binary, metrics_sample = metrics_sample)
         self._l = Listener(self._system_handler, self.myxpl, {'schema' : 'domogik.system',
                                                                'xpltype':'xpl-cmnd'})
         self._reload_cb = reload_cb
         self._dump_cb = dump_cb
 
         # Create object which get process informations (cpu, memory, etc)
-        # TODO : activate
+        # The manager sends the usage of all the processes of the host, see
+        # ProcessSampler
         #self._process_info = ProcessInfo(os.getpid(),
         #                                 TIME_BETWEEN_EACH_PROCESS_STATUS,
         #                                 self._send_process_info,
@@ -139,6 +155,18 @@ class XplPlugin(BasePlugin):
 
         self.log.debug("end single xpl plugin")
 
+    def _get_zmq_transport(self):
+        """ Create the ZeroMQ transport for xPL messages, from the mq section of the config file
+        """
+        from domogik.xpl.common.xplzmq import ZmqTransport, XPL_PUB_PORT, XPL_SUB_PORT
+        cfg = Loader('mq')
+        mq_conf = dict(cfg.load()[1])
+        self.log.info("xPL messages will be sent through the ZeroMQ xPL proxy")
+        return ZmqTransport(self,
+                            mq_conf.get('ip', '127.0.0.1'),
+                            mq_conf.get('xpl_pub_port', XPL_PUB_PORT),
+                            mq_conf.get('xpl_sub_port', XPL_SUB_PORT))
+
     def get_config_files(self):
        """ Return list of config files
        """
@@ -198,6 +226,18 @@ class XplPlugin(BasePlugin):
         """
         self.myxpl.enable_hbeat(lock)
 
+    def get_metrics(self):
+        """ Return the counters and latency histograms of the xPL processing
+        """
+        return self.myxpl.metrics.snapshot()
+
+    def _dump_metrics(self):
+        """ Log the counters and latency histograms of the xPL processing
+        """
+        self.log.info("xPL metrics of %s :" % self.get_plugin_name())
+        for line in self.myxpl.metrics.dump():
+            self.log.info("  %s" % line)
+
     def _send_process_info(self, pid, data):
         """ Send process info (cpu, memory) on xpl
             @param : process pid
@@ -258,6 +298,7 @@ class XplPlugin(BasePlugin):
             else:
                 self._reload_cb()
         elif cmd == "dump":
+            self._dump_metrics()
             if self._dump_cb is None:
                 self.log.info("Someone asked to dump config of %s, but the plugin \
                 isn't able to do it." % self.get_plugin_name())
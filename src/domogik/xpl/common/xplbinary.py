@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Binary encoding of xPL messages, for the traffic between the Domogik
+processes and the Domogik python hub on the same host.
+
+A process which understands this encoding adds 'caps=bin' in its
+hbeat.app messages. The python hub then delivers it the messages in binary
+(and echoes its heartbeats in binary, which tells the process that it can
+send binary messages to the hub). Third party xPL devices always get text
+messages.
+
+Packet layout (all integers are big endian) :
+
+  magic (2 bytes) | version (1 byte) | body length (4 bytes) | body
+
+Body :
+
+  type (1 byte) | hop count (1 byte)
+  source length (1 byte) | source
+  target length (1 byte) | target
+  schema (string reference)
+  number of items (2 bytes)
+  items : key (string reference) | value length | value
+
+A string reference is the index of the string in SCHEMAS or KEYS
+(1 byte), or INLINE (1 byte) followed by the length (1 byte) and the
+string. A value length is 1 byte if it is lower than 128, else 2 bytes
+with the highest bit set.
+
+The SCHEMAS and KEYS tables are part of the protocol : new entries must
+be appended, existing ones must never be moved or removed.
+
+Implements
+==========
+
+- is_binary
+- encode
+- decode
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+import struct
+
+from domogik.common.dmg_exceptions import XplMessageError
+from domogik.common.ordereddict import OrderedDict
+
+# first bytes of a binary packet. Text packets start with 'xpl-'
+MAGIC = "\xd0\x78"
+VERSION = 1
+# capability announced in the hbeat.app messages
+CAPABILITY = "bin"
+# max size of a binary packet (a bigger message is sent as text fragments)
+MAX_SIZE = 60000
+
+INLINE = 0xFF
+
+TYPES = ("xpl-cmnd", "xpl-trig", "xpl-stat")
+
+SCHEMAS = ("hbeat.app", "hbeat.end", "hbeat.request", "hbeat.basic",
+           "fragment.basic", "fragment.request",
+           "domogik.system", "domogik.config", "domogik.package", "domogik.usage",
+           "sensor.basic", "x10.basic", "lighting.basic", "lighting.config",
+           "lighting.device", "datetime.basic", "dawndusk.basic", "dawndusk.request",
+           "timer.basic", "earth.basic", "earth.request", "teleinfo.basic",
+           "teleinfo.short", "plcbus.basic", "telldus.basic", "scene.basic",
+           "control.basic", "knx.basic", "zwave.basic", "ozwave.basic",
+           "bluez.basic", "mvhr.basic", "helper.basic", "cid.basic",
+           "weather.basic", "calendar.basic", "ac.basic", "homeeasy.basic")
+
+KEYS = ("interval", "port", "remote-ip", "status", "caps",
+        "partid", "schema", "command", "message", "part",
+        "plugin", "host", "key", "value", "element", "hostname",
+        "device", "type", "current", "units", "level", "unit",
+        "name", "id", "fullname", "version", "release", "priority",
+        "pid", "cpu-percent", "memory-percent", "memory-rss", "memory-vsz",
+        "address", "channel", "protocol", "data", "state", "action", "delay",
+        "technology", "enabled", "description", "author", "email", "source")
+
+_TYPE_CODES = dict((name, code) for code, name in enumerate(TYPES))
+# string references, already encoded
+_SCHEMA_CODES = dict((name, chr(code)) for code, name in enumerate(SCHEMAS))
+_KEY_CODES = dict((name, chr(code)) for code, name in enumerate(KEYS))
+_INLINE_CHR = chr(INLINE)
+
+_HEADER = struct.Struct(">2sBI")
+_SHORT = struct.Struct(">H")
+_TYPE_HOP = struct.Struct(">BB")
+
+
+def is_binary(packet):
+    """ Check if a packet is a binary xPL packet
+    @param packet : the received packet
+    """
+    return packet[:2] == MAGIC
+
+
+def _encode_ref(parts, string, codes):
+    """ Append a string reference to parts
+    """
+    code = codes.get(string)
+    if code is None:
+        if len(string) > 255:
+            raise XplMessageError("String too long for binary encoding (%s)" % string)
+        parts.append(_INLINE_CHR)
+        parts.append(chr(len(string)))
+        parts.append(string)
+    else:
+        parts.append(code)
+
+
+def _encode_value(parts, key, value):
+    """ Append an item to parts
+    """
+    _encode_ref(parts, key, _KEY_CODES)
+    value = str(value)
+    length = len(value)
+    if length < 0x80:
+        parts.append(chr(length))
+    elif length < 0x8000:
+        parts.append(_SHORT.pack(length | 0x8000))
+    else:
+        raise XplMessageError("Value too long for binary encoding (%s)" % key)
+    parts.append(value)
+
+
+def encode(message):
+    """ Encode a message
+    @param message : XplMessage instance
+    @return the binary packet
+    """
+    try:
+        parts = [_TYPE_HOP.pack(_TYPE_CODES[message.type], message.hop_count),
+                 chr(len(message.source)), message.source,
+                 chr(len(message.target)), message.target]
+    except (KeyError, ValueError, struct.error):
+        raise XplMessageError("Can't encode the message header in binary")
+    _encode_ref(parts, message.schema, _SCHEMA_CODES)
+    count_index = len(parts)
+    parts.append(None)
+    count = 0
+    for key, value in message.data.iteritems():
+        if type(value) == list:
+            for v in value:
+                _encode_value(parts, key, v)
+                count += 1
+        else:
+            _encode_value(parts, key, value)
+            count += 1
+    parts[count_index] = _SHORT.pack(count)
+    body = "".join(parts)
+    return _HEADER.pack(MAGIC, VERSION, len(body)) + body
+
+
+def _decode_ref(packet, pos, table):
+    """ Read a string reference
+    @return (string, new position)
+    """
+    code = ord(packet[pos])
+    pos += 1
+    if code == INLINE:
+        length = ord(packet[pos])
+        pos += 1
+        return packet[pos:pos + length], pos + length
+    return table[code], pos
+
+
+def _decode_str(packet, pos):
+    """ Read a string prefixed by its length (1 byte)
+    @return (string, new position)
+    """
+    length = ord(packet[pos])
+    pos += 1
+    return packet[pos:pos + length], pos + length
+
+
+def _split_address(address):
+    """ Split an xPL address in (vendor id, device id, instance id)
+    """
+    if address == "*":
+        return (None, None, None)
+    vendor, rest = address.split("-", 1)
+    device, instance = rest.split(".", 1)
+    return (vendor, device, instance)
+
+
+def decode(packet, message):
+    """ Decode a binary packet in a message
+    The message fields are set without being checked again by regexp
+    @param packet : the binary packet
+    @param message : XplMessage instance to fill
+    @raise XplMessageError if the packet is not valid
+    """
+    try:
+        magic, version, length = _HEADER.unpack_from(packet, 0)
+        if magic != MAGIC or version != VERSION:
+            raise XplMessageError("Unknown binary packet version")
+        if len(packet) != _HEADER.size + length:
+            raise XplMessageError("Invalid binary packet length")
+        pos = _HEADER.size
+        type_code, hop_count = _TYPE_HOP.unpack_from(packet, pos)
+        pos += 2
+        source, pos = _decode_str(packet, pos)
+        target, pos = _decode_str(packet, pos)
+        schema, pos = _decode_ref(packet, pos, SCHEMAS)
+        count = _SHORT.unpack_from(packet, pos)[0]
+        pos += 2
+        data = OrderedDict()
+        for i in xrange(count):
+            key, pos = _decode_ref(packet, pos, KEYS)
+            value_length = ord(packet[pos])
+            if value_length & 0x80:
+                value_length = _SHORT.unpack_from(packet, pos)[0] & 0x7FFF
+                pos += 2
+            else:
+                pos += 1
+            value = packet[pos:pos + value_length]
+            pos += value_length
+            if key in data:
+                if type(data[key]) != list:
+                    data[key] = [data[key]]
+                data[key].append(value)
+            else:
+                data[key] = value
+        if pos != len(packet):
+            raise XplMessageError("Invalid binary packet length")
+        message.type = TYPES[type_code]
+        message.hop_count = hop_count
+        message.source = source
+        message.source_vendor_id, message.source_device_id, message.source_instance_id = _split_address(source)
+        message.target = target
+        message.target_vendor_id, message.target_device_id, message.target_instance_id = _split_address(target)
+        message.schema = schema
+        message.schema_class, message.schema_type = schema.split(".", 1)
+        message.data = data
+    except (IndexError, ValueError, struct.error):
+        raise XplMessageError("Invalid binary packet")
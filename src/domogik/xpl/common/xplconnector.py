@@ -40,6 +40,7 @@ Implements
 - Listener:.add_filter(self, key, value)
 - Listener:.del_filter(self, key)
 - Listener:.get_filter_list(self)
+- Manager.metrics : counters and latency histograms (see xplmetrics)
 - XPLException.__init__(self, value)
 - XPLException.__str__(self)
 - Message:.__init__(self, mess=None)
@@ -71,20 +72,32 @@ Implements
 @organization: Domogik
 """
 
+import os
 import sys
+import errno
+import logging
+import fcntl
 import select
 import threading
 import traceback
 import random
 #from socket import socket, gethostbyname, gethostname, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST
-from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST
+from socket import socket, error as socket_error, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_RCVBUF, MSG_DONTWAIT
 #from domogik.common import logger
 #from domogik.xpl.common.baseplugin import BasePlugin
 from domogik.xpl.common.xplmessage import XplMessage, FragmentedXplMessage
+from domogik.xpl.common.xplfragment import FragmentReassembler, SentFragmentsCache
+from domogik.xpl.common import xplbinary
+from domogik.xpl.common.xplmetrics import Metrics, METRICS_SAMPLE_RATE
 from domogik.common.dmg_exceptions import XplMessageError
 import time
 
 READ_NETWORK_TIMEOUT = 2
+# Maximum number of datagrams read from the socket for one wake up of the
+# monitor thread, so that a burst can't starve the stop request
+MAX_DATAGRAMS_PER_WAKE = 64
+# Max number of serialized message headers cached by a Manager
+HEADER_CACHE_SIZE = 256
 
 class Manager:
     """
@@ -100,13 +113,21 @@ class Manager:
     # _network = None
     # _UDPSock = None
 
-    def __init__(self, ip=None, port=0, broadcast="255.255.255.255", plugin = None, nohub = False):
+    def __init__(self, ip=None, port=0, broadcast="255.255.255.255", plugin = None, nohub = False, rcvbuf = None,
+                 transport = None, binary = False, metrics_sample = METRICS_SAMPLE_RATE):
         """
         Create a new manager instance
         @param ip : IP to listen to (default real ip address)
         @param port : port to listen to (default 0)
         @param plugin : The plugin associated with this xpl instance
         @param nohub : Don't start the hub discovery
+        @param rcvbuf : size of the socket receive buffer (SO_RCVBUF), system default if None
+        @param transport : alternate transport (xplzmq.ZmqTransport) used for
+        all messages except heartbeats, None to use only UDP
+        @param binary : announce the binary encoding capability in the heartbeats,
+        and send binary messages if the hub understands them (see xplbinary)
+        @param metrics_sample : one message out of metrics_sample is timed in
+        the metrics (see xplmetrics), 0 for no timing
         """
         if ip == None:
             ip = self.get_sanitized_hostname()
@@ -117,19 +138,49 @@ class Manager:
         # Define xPL base port
         self._source = source
         self._listeners = []
+        # counters and latency histograms of the xPL processing
+        self.metrics = Metrics(metrics_sample)
+        # Number of threads waiting for the send lock, and its own lock
+        self._send_waiting = 0
+        self._send_waiting_lock = threading.Lock()
+        self._transport = transport
+        self._binary = binary
+        # Set when the hub echoes our heartbeat in binary
+        self._hub_binary = False
         #Not really usefull
         #self.port = port
         # Initialise the socket
         self._UDPSock = socket(AF_INET, SOCK_DGRAM)
         #Set broadcast flag
         self._UDPSock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        if rcvbuf:
+            self._UDPSock.setsockopt(SOL_SOCKET, SO_RCVBUF, int(rcvbuf))
+        # The socket stays blocking for the senders (a full send buffer
+        # makes sendto wait instead of failing) : the monitor thread drains
+        # it with non blocking reads (MSG_DONTWAIT) until EWOULDBLOCK
+        # Wake up pipe : the monitor thread blocks in select() without
+        # timeout, leave() writes in the pipe to make it return
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
         self._broadcast = broadcast
         #xPL plugins only needs to connect on local xPL Hub on localhost
         addr = (ip, port)
         #UID for the fragment management
         self._fragment_uid = 1
-        self._sent_fragments_buffer = {}
-        self._received_fragments_buffer = {}
+        self._sent_fragments = SentFragmentsCache()
+        self._reassembler = FragmentReassembler(log = self.p.log)
+
+        # Header fields set on the messages sent without source, and cache of
+        # serialized headers, keyed by (type, hop count, source, target, schema)
+        source_message = XplMessage()
+        source_message.set_source(source)
+        self._source_fields = [(key, getattr(source_message, key)) for key in \
+                ("source", "source_vendor_id", "source_device_id", "source_instance_id")]
+        self._headers = {}
+        # hbeat messages sent in broadcast, keyed by (target, schema)
+        self._hbeat_messages = {}
 
         #Define locks
         self._lock_send = threading.Semaphore()
@@ -162,6 +213,9 @@ class Manager:
             self.port = self._UDPSock.getsockname()[1]
             #Get the port number assigned by the system
             self._ip, self._port = self._UDPSock.getsockname()
+            # the binary encoding is only used for the traffic on this host
+            if not (self._ip.startswith("127.") or broadcast.startswith("127.")):
+                self._binary = False
             self.p.log.debug("xPL plugin %s socket bound to %s, port %s" \
                             % (self.p.get_plugin_name(), self._ip, self._port))
             self._h_timer = None
@@ -177,6 +231,8 @@ class Manager:
                     "thread-monitor", (), {})
             self.p.register_thread(self._network)
             self._network.start()
+            if self._transport is not None:
+                self._transport.start(self._process_packet)
             self.p.log.debug("xPL thread started for %s " % self.p.get_plugin_name())
         # start hbeat discovery
         self.hub_discovery()
@@ -232,65 +288,140 @@ class Manager:
         """
         self.p.log.debug("send hbeat.end")
         self._SendHeartbeat(schema='hbeat.end')
+        if self._transport is not None:
+            self._transport.stop()
+        self._wake_up()
+        if threading.current_thread() is not self._network:
+            self._network.join()
         self._UDPSock.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
         self.p.log.debug("xPL thread stopped")
 
+    def _wake_up(self):
+        """
+        Make the monitor thread leave select()
+        """
+        try:
+            os.write(self._wake_w, "x")
+        except OSError as exc:
+            # pipe full : a wake up is already pending
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
     def send(self, message):
         """
         This function allows you to send an xPL message on the Bus
         Be carreful, there is no check on message correctness
-        This method is protected by semaphore because in some plugin (REST for example)
-        many threads can call it.
+        The message is serialized once, with a cached header. Many threads
+        can call this method (REST for example) : sending a datagram is
+        atomic, so only the fragmentation of big messages is protected by
+        semaphore.
         """
-        self._lock_send.acquire()
         try:
             if not message.hop_count:
                 message.set_hop_count("5")
             if not message.source:
-                message.set_source(self._source)
+                for key, value in self._source_fields:
+                    setattr(message, key, value)
             if not message.target:
                 message.set_target("*")
+            use_transport = self._transport is not None and self._transport.accepts(message)
+            packet = None
+            if self._hub_binary and not use_transport:
+                try:
+                    packet = message.to_binary()
+                except XplMessageError:
+                    # value or name too long for the binary encoding
+                    packet = None
+                if packet is not None and len(packet) > xplbinary.MAX_SIZE:
+                    packet = None
+            if packet is None:
+                key = (message.type, message.hop_count, message.source, message.target, message.schema)
+                header = self._headers.get(key)
+                if header is None:
+                    header = message.header_to_packet()
+                    if len(self._headers) < HEADER_CACHE_SIZE:
+                        self._headers[key] = header
+                packet = header + message.data_to_packet()
+            self.metrics.incr("sent")
             try:
-                if len(message.to_packet()) > 1472:
-                    fragments = FragmentedXplMessage.fragment_message(message, self._fragment_uid)
-                    self._sent_fragments_buffer[self._fragment_uid] = fragments
-                    for fragment in fragments.keys():
-                        self.p.log.debug("fragment send")
-                        self._UDPSock.sendto(fragments[fragment].__str__(), (self._broadcast, 3865))
+                if use_transport:
+                    self._transport.send(message, packet)
+                elif len(packet) > 1472 and not xplbinary.is_binary(packet):
+                    self.metrics.incr("sent_fragmented")
+                    self._send_fragmented(message)
                 else:
-                    self.p.log.debug("normal send")
-                    self._UDPSock.sendto(message.__str__(), (self._broadcast, 3865))
+                    self._UDPSock.sendto(packet, (self._broadcast, 3865))
             except:
                 if self.p.get_stop().is_set():
                     pass
                 else:
                     raise
-            else:
-                self._fragment_uid = self._fragment_uid + 1
-            self.p.log.debug("xPL Message sent by thread %s : %s" % (threading.currentThread().getName(), message))
+            if self.p.log.isEnabledFor(logging.DEBUG):
+                self.p.log.debug("xPL Message sent by thread %s : %s", threading.currentThread().getName(), message)
         except:
+            self.metrics.incr("send_errors")
             self.p.log.warning("Error during send of message")
             self.p.log.debug(traceback.format_exc())
-        self._lock_send.release()
+
+    def _acquire_send_lock(self):
+        """
+        Acquire the send lock, with the number of threads waiting for it and
+        the waiting time in the metrics
+        """
+        with self._send_waiting_lock:
+            self._send_waiting += 1
+            self.metrics.gauge_max("send_lock_waiting", self._send_waiting)
+        start = self.metrics.start()
+        self._lock_send.acquire()
+        self.metrics.stop("send_lock_wait", start)
+        with self._send_waiting_lock:
+            self._send_waiting -= 1
+
+    def _send_fragmented(self, message):
+        """
+        Split a message in fragments, store them for a later resend and send them
+        @param message : the XplMessage to send
+        """
+        self._acquire_send_lock()
+        try:
+            uid = self._fragment_uid
+            self._fragment_uid = self._fragment_uid + 1
+            fragments = FragmentedXplMessage.fragment_message(message, uid)
+            self._sent_fragments.store(uid, fragments)
+            for fragment in fragments.keys():
+                self.p.log.debug("fragment send")
+                self._UDPSock.sendto(fragments[fragment].__str__(), (self._broadcast, 3865))
+        finally:
+            self._lock_send.release()
 
     def _SendHeartbeat(self, target='*', test="", schema="hbeat.app"):
         """
         Send heartbeat message in broadcast on the network, on the bus port
         (3865)
         This make the application able to be discovered by the hub
+        The broadcasted heartbeat messages are built once, only the status
+        is updated.
         This method is not called by childs, so no need to protect it.
         """
         self._lock_status.acquire()
         self.p.log.debug("send hbeat")
-        mesg = XplMessage()
-        mesg.set_type( "xpl-stat" )
-        mesg.set_hop_count( 1 )
-        mesg.set_source( self._source )
-        mesg.set_target( target )
-        mesg.set_schema( schema )
-        mesg.add_single_data( "interval", "5" )
-        mesg.add_single_data( "port", self.port )
-        mesg.add_single_data( "remote-ip", self._ip )
+        mesg = self._hbeat_messages.get((target, schema))
+        if mesg is None:
+            mesg = XplMessage()
+            mesg.set_type( "xpl-stat" )
+            mesg.set_hop_count( 1 )
+            mesg.set_source( self._source )
+            mesg.set_target( target )
+            mesg.set_schema( schema )
+            mesg.add_single_data( "interval", "5" )
+            mesg.add_single_data( "port", self.port )
+            mesg.add_single_data( "remote-ip", self._ip )
+            if self._binary:
+                mesg.add_single_data( "caps", xplbinary.CAPABILITY )
+            if target == '*':
+                self._hbeat_messages[(target, schema)] = mesg
         if schema != 'hbeat.end':
             if self._status == 0:
                 msg = "HUB discovery > looking for the hub. I hope there is one hub, Domogik won't work without the hub!"
@@ -307,7 +438,7 @@ class Manager:
                 self.p.log.warning(msg)
                 print(msg)
 
-            mesg.add_single_data( "status", self._status )
+            mesg.data["status"] = str(self._status)
         if self is not None:
             self.send( mesg )
         self._lock_status.release()
@@ -323,55 +454,125 @@ class Manager:
         The monitor thread receive all messages on the connection and check
         them to see if the target is the application.
         If it is, call all listeners
+        The thread sleeps in select() until a datagram arrives or leave()
+        writes in the wake up pipe, then drains all pending datagrams.
         This method is not called by childs, so no need to protect it.
         """
         while not self.p.should_stop():
+            # only wake up periodically while fragmented messages are waiting for their parts
+            deadline = self._reassembler.next_deadline()
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(0, deadline - time.time())
             try:
-                readable, writeable, errored = select.select([self._UDPSock], [], [], READ_NETWORK_TIMEOUT)
+                readable, writeable, errored = select.select([self._UDPSock, self._wake_r], [], [], timeout)
             except:
+                if self.p.should_stop():
+                    break
                 self.p.log.info("Error during the read of the socket : %s" % traceback.format_exc())
-            else:
-                if len(readable) == 1:
+                continue
+            if self._wake_r in readable:
+                try:
+                    os.read(self._wake_r, 512)
+                except OSError:
+                    pass
+                if self.p.should_stop():
+                    break
+            if self._UDPSock in readable:
+                self._drain_socket()
+            if deadline is not None and time.time() >= deadline:
+                for request in self._reassembler.expire():
+                    self.p.log.info("Ask %s to resend missing fragments" % request.target)
+                    self.send(request)
+        self.p.log.info("self._should_stop set, leave.")
+
+    def _drain_socket(self):
+        """
+        Read all the datagrams waiting in the socket buffer (at most
+        MAX_DATAGRAMS_PER_WAKE) and process them
+        """
+        for i in xrange(MAX_DATAGRAMS_PER_WAKE):
+            try:
+                data, addr = self._UDPSock.recvfrom(self._buff, MSG_DONTWAIT)
+            except socket_error as exc:
+                if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.p.log.debug("bad data received")
+                return
+            self._process_packet(data)
+
+    def _resend_fragments(self, request):
+        """
+        Answer a fragment.request message with the requested fragments
+        @param request : the fragment.request message
+        """
+        fragments = self._sent_fragments.get_requested(request)
+        if fragments == []:
+            self.p.log.debug("Fragments requested by %s are no more available" % request.source)
+            return
+        self._acquire_send_lock()
+        try:
+            for fragment in fragments:
+                self._UDPSock.sendto(fragment.__str__(), (self._broadcast, 3865))
+        except:
+            self.p.log.warning("Error during resend of fragments")
+            self.p.log.debug(traceback.format_exc())
+        self._lock_send.release()
+
+    def _process_packet(self, data):
+        """
+        Decode a received datagram and give it to the listeners
+        @param data : the raw datagram
+        """
+        mess = data
+        metrics = self.metrics
+        start = metrics.start()
+        try:
+            mess = XplMessage(data)
+            metrics.incr("parsed")
+            if (mess.source == self._source) and (mess.schema == "hbeat.app"):
+                # The hub echoes our heartbeat, in binary if it understands it
+                hub_binary = self._binary and xplbinary.is_binary(data)
+                if hub_binary != self._hub_binary:
+                    self.p.log.info("HUB binary encoding support : %s" % hub_binary)
+                    self._hub_binary = hub_binary
+                if not self._foundhub.is_set():
+                    self.foundhub()
+            elif (mess.target == "*" or (mess.target == self._source)) and\
+                (self._source != mess.source):
+                update = False
+                if mess.schema == "fragment.basic":
+                    metrics.incr("fragments_received")
                     try:
-                        data, addr = self._UDPSock.recvfrom(self._buff)
-                    except:
-                        self.p.log.debug("bad data received")
+                        mess = self._reassembler.add(mess, len(data))
+                    except (KeyError, ValueError) as exc:
+                        metrics.incr("fragments_dropped")
+                        self.p.log.warning("Bad fragment received from %s : %s" % (mess.source, exc))
                     else:
-                        try:
-                            mess = XplMessage(data)
-                            if (not self._foundhub.is_set()) and (mess.source == self._source)\
-                                and (mess.schema == "hbeat.app"):
-                                self.foundhub()
-                            elif (mess.target == "*" or (mess.target == self._source)) and\
-                                (self._source != mess.source):
-                                update = False
-                                if mess.schema == "fragment.basic":
-                                    key = (mess.source, mess.data["partid"].split(':')[1])
-                                    if not key in self._received_fragments_buffer:
-                                        self._received_fragments_buffer[key] = {}
-                                    self._received_fragments_buffer[key][mess.data["partid"].split('/')[0]] = mess
-                                    if len(self._received_fragments_buffer[key]) == int(mess.data["partid"].split('/')[1].split(':')[0]):
-                                        nf = FragmentedXplMessage()
-                                        for f in self._received_fragments_buffer[key].keys():
-                                            nf.add_fragment(self._received_fragments_buffer[key][f])
-                                        mess = nf.build_message()
-                                        update = True
-                                        del self._received_fragments_buffer[key]
-                                else:
-                                    update = True
-                                if update:
-                                    for l in self._listeners:
-                                        l.new_message(mess)
-                                #Enabling this debug will really polute your logs
-                                #self.p.log.debug("New message received : %s" % \
-                                #        mess.type)
-                        except XPLException:
-                            self.p.log.warning("XPL Exception occured in : %s" % sys.exc_info()[2])
-                        except XplMessageError as exc:
-                            self.p.log.warning("Malformated message received, ignoring it.")
-                            self.p.log.warning("Error was : %s" % exc)
-                            self.p.log.warning("Message was : %s" % mess)
-        self.p.log.info("self._should_stop set, leave.")
+                        update = mess is not None
+                        if update:
+                            metrics.incr("reassembled")
+                else:
+                    if mess.schema == "fragment.request" and mess.target == self._source:
+                        self._resend_fragments(mess)
+                    update = True
+                if update:
+                    for l in self._listeners:
+                        l.new_message(mess)
+                    if start is not None:
+                        metrics.stop("schema.%s" % mess.schema, start)
+            else:
+                metrics.incr("ignored")
+                #Enabling this debug will really polute your logs
+                #self.p.log.debug("New message received : %s" % \
+                #        mess.type)
+        except XPLException:
+            self.p.log.warning("XPL Exception occured in : %s" % sys.exc_info()[2])
+        except XplMessageError as exc:
+            metrics.incr("malformed")
+            self.p.log.warning("Malformated message received, ignoring it.")
+            self.p.log.warning("Error was : %s" % exc)
+            self.p.log.warning("Message was : %s" % mess)
 
     def add_listener(self, listener):
         """
@@ -380,6 +581,8 @@ class Manager:
         """
         self._lock_list.acquire()
         self._listeners.append(listener)
+        if self._transport is not None:
+            listener._prefixes = self._transport.subscribe(listener.get_filter())
         self._lock_list.release()
 
     def del_listener(self, listener):
@@ -389,8 +592,26 @@ class Manager:
         """
         self._lock_list.acquire()
         self._listeners.remove(listener)
+        if self._transport is not None:
+            self._transport.unsubscribe(listener._prefixes)
+            listener._prefixes = []
         self._lock_list.release()
 
+    def update_listener(self, listener):
+        """
+        Subscribe again a listener whose filter changed
+        @param listener : the listener instance
+        """
+        self._lock_list.acquire()
+        try:
+            if self._transport is not None and listener in self._listeners:
+                # subscribe first : no message is lost between the two
+                prefixes = self._transport.subscribe(listener.get_filter())
+                self._transport.unsubscribe(listener._prefixes)
+                listener._prefixes = prefixes
+        finally:
+            self._lock_list.release()
+
 class Listener:
     """
     Listener are objects which are able to check if a message
@@ -413,9 +634,31 @@ class Listener:
         self._callback = cb
         self._filter = filter
         self._manager = manager
+        self._metrics = manager.metrics
+        self._set_metrics_names()
+        # prefixes subscribed on the transport of the manager
+        self._prefixes = []
         manager.add_listener(self)
         self._cb_params = cb_params
 
+    def _set_metrics_names(self):
+        """
+        Set the names of the histograms of the listener in the metrics
+        """
+        name = ",".join(["%s=%s" % (key, self._filter[key]) for key in sorted(self._filter)])
+        self._filter_metric = "filter.%s" % name
+        self._callback_metric = "callback.%s" % name
+
+    def _timed_callback(self, *args):
+        """
+        Call the callback function and record its duration in the metrics
+        """
+        start = time.time()
+        try:
+            self._callback(*args)
+        finally:
+            self._metrics.record(self._callback_metric, time.time() - start)
+
     def unregister(self):
         self._manager.del_listener(self)
 
@@ -435,6 +678,7 @@ class Listener:
         The goal of this function is to check if message match filter rules,
         and to call the callback function if it does
         """
+        start = self._metrics.start()
         suffixe = ""
         ok = True
         for key in self._filter:
@@ -454,13 +698,21 @@ class Listener:
                 ok = ok and (self._filter[key] == message.source_instance_id)
             elif not (key in message.data or key in ("xpltype", "schema")):
                 ok = False
+        if start is not None:
+            self._metrics.stop(self._filter_metric, start)
         #The message match the filter, we can call  the callback function
         if ok:
+            self._metrics.incr("callbacks")
+            # the callback of the sampled messages is timed
+            if start is not None:
+                target = self._timed_callback
+            else:
+                target = self._callback
             try:
                 if self._cb_params != {} and self._callback.func_code.co_argcount > 1:  
-                    thread = threading.Thread(target=self._callback, args = (message, self._cb_params), name="Manager-new-message-cb-%s" % suffixe)
+                    thread = threading.Thread(target=target, args = (message, self._cb_params), name="Manager-new-message-cb-%s" % suffixe)
                 else:
-                    thread = threading.Thread(target=self._callback, args = (message,), name="Manager-new-message-cb-%s" % suffixe)
+                    thread = threading.Thread(target=target, args = (message,), name="Manager-new-message-cb-%s" % suffixe)
                 self._manager.p.register_thread(thread)
                 thread.start()
             except:
@@ -472,6 +724,8 @@ class Listener:
         If the key already exists, the new value is used
         """
         self._filter[key] = value
+        self._set_metrics_names()
+        self._manager.update_listener(self)
 
     def del_filter(self, key):
         """
@@ -480,6 +734,8 @@ class Listener:
         """
         if key in self._filter:
             del self._filter[key]
+            self._set_metrics_names()
+            self._manager.update_listener(self)
 
     def get_filter_list(self):
         """
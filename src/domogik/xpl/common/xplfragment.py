@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Reassembly and retransmission of fragmented xPL messages (fragment.basic
+and fragment.request schemas).
+
+Received fragments are kept until the message is complete, with :
+- a time to live : a message which is not complete after FRAGMENT_TTL
+  seconds is dropped. At half of its life, a fragment.request is generated
+  to ask the sender for the missing parts
+- a global byte budget : when the fragments waiting for reassembly use more
+  than FRAGMENT_MAX_BYTES, the oldest messages are dropped
+
+Sent fragments are kept in a bounded cache, so that fragment.request
+messages can be answered.
+
+Implements
+==========
+
+- parse_partid
+- FragmentReassembler
+- SentFragmentsCache
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+import time
+from collections import deque
+
+from domogik.xpl.common.xplmessage import FragmentedXplMessage
+
+# Time (in seconds) to wait for all the fragments of a message
+FRAGMENT_TTL = 30
+# Max number of bytes of the fragments waiting for reassembly
+FRAGMENT_MAX_BYTES = 512 * 1024
+# Number of fragmented messages kept to answer fragment.request messages
+FRAGMENT_SENT_CACHE_SIZE = 32
+
+
+def parse_partid(partid):
+    """ Parse the partid value of a fragment.basic message
+    @param partid : partid value, as '<part>/<total>:<message id>'
+    @return a tuple (part, total, message id)
+    @raise ValueError if the partid can't be parsed
+    """
+    try:
+        part, message_id = partid.split(':', 1)
+        part, total = part.split('/', 1)
+        return (int(part), int(total), message_id)
+    except (AttributeError, ValueError):
+        raise ValueError("Can't parse partid '%s'" % partid)
+
+
+class _PendingMessage(object):
+    """ A fragmented message waiting for its missing parts
+    """
+    __slots__ = ('fragmented', 'total', 'size', 'created', 'requested')
+
+    def __init__(self, total, created):
+        self.fragmented = FragmentedXplMessage()
+        self.total = total
+        self.size = 0
+        self.created = created
+        self.requested = False
+
+
+class FragmentReassembler(object):
+    """ Collect fragment.basic messages and rebuild the original messages
+    This object is not thread safe : it is used by the xPL monitor thread only
+    """
+
+    def __init__(self, ttl = FRAGMENT_TTL, max_bytes = FRAGMENT_MAX_BYTES, log = None):
+        """
+        @param ttl : time (in seconds) to wait for all the fragments of a message
+        @param max_bytes : max number of bytes of the fragments waiting for reassembly
+        @param log : logger instance
+        """
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._log = log
+        # (source, message id) => _PendingMessage
+        self._pending = {}
+        # (key, _PendingMessage) in arrival order, used for expiry and eviction.
+        # Completed messages are removed when they reach the front (see _prune)
+        self._age = deque()
+        self._bytes = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get_size(self):
+        """ Return the number of bytes of the fragments waiting for reassembly
+        """
+        return self._bytes
+
+    def add(self, fragment, size = 0, now = None):
+        """ Add a received fragment
+        @param fragment : fragment.basic XplMessage
+        @param size : size of the fragment on the network (for the byte budget)
+        @param now : current time (for tests)
+        @return the rebuilt XplMessage if the fragment completes a message, None otherwise
+        @raise ValueError if the fragment is not valid
+        """
+        part, total, message_id = parse_partid(fragment.data["partid"])
+        if not 1 <= part <= total:
+            raise ValueError("Invalid part number %s/%s" % (part, total))
+        if now is None:
+            now = time.time()
+        key = (fragment.source, message_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = _PendingMessage(total, now)
+            self._pending[key] = pending
+            self._age.append((key, pending))
+        elif pending.total != total:
+            raise ValueError("The number of fragments is not the same as previous fragments")
+        if part in pending.fragmented._fragments:
+            # duplicate (a resend we did not need)
+            return None
+        pending.fragmented.add_fragment(fragment, (part, total, message_id))
+        pending.size += size
+        self._bytes += size
+        if len(pending.fragmented._fragments) == total:
+            self._remove(key, pending)
+            self._prune()
+            return pending.fragmented.build_message()
+        self._enforce_budget()
+        return None
+
+    def expire(self, now = None):
+        """ Drop the messages older than the ttl
+        @param now : current time (for tests)
+        @return a list of fragment.request XplMessage to send for the
+        messages which reached half of their life
+        """
+        if now is None:
+            now = time.time()
+        requests = []
+        while self._age:
+            key, pending = self._age[0]
+            if self._pending.get(key) is not pending:
+                self._age.popleft()
+            elif now - pending.created >= self._ttl:
+                self._age.popleft()
+                self._drop(key, pending, "timeout")
+            else:
+                break
+        half_ttl = self._ttl / 2.0
+        for key, pending in self._age:
+            if now - pending.created < half_ttl:
+                break
+            if not pending.requested and self._pending.get(key) is pending:
+                pending.requested = True
+                request = pending.fragmented.generate_missing_request()
+                if request is not None:
+                    requests.append(request)
+        return requests
+
+    def next_deadline(self):
+        """ Return the time at which expire() should be called again or None
+        if there is no message waiting for reassembly
+        """
+        self._prune()
+        if not self._age:
+            return None
+        key, pending = self._age[0]
+        if pending.requested:
+            return pending.created + self._ttl
+        return pending.created + self._ttl / 2.0
+
+    def _prune(self):
+        """ Remove the completed or dropped messages from the front of the
+        arrival order : the front is always a message waiting for reassembly
+        (the ones behind it are removed when they reach the front, at the
+        latest after the ttl)
+        """
+        while self._age:
+            key, pending = self._age[0]
+            if self._pending.get(key) is pending:
+                break
+            self._age.popleft()
+
+    def _enforce_budget(self):
+        """ Drop the oldest messages until the byte budget is respected
+        """
+        while self._bytes > self._max_bytes and self._age:
+            key, pending = self._age.popleft()
+            if self._pending.get(key) is pending:
+                self._drop(key, pending, "memory budget exceeded")
+
+    def _drop(self, key, pending, reason):
+        """ Forget an incomplete message
+        """
+        self._remove(key, pending)
+        self.dropped += 1
+        if self._log is not None:
+            self._log.warning("Fragmented message %s from %s dropped (%s) : %s/%s parts received" % \
+                              (key[1], key[0], reason, len(pending.fragmented._fragments), pending.total))
+
+    def _remove(self, key, pending):
+        """ Remove a message from the pending ones
+        """
+        del self._pending[key]
+        self._bytes -= pending.size
+
+
+class SentFragmentsCache(object):
+    """ Keep the fragments of the last sent messages, to answer fragment.request
+    """
+
+    def __init__(self, size = FRAGMENT_SENT_CACHE_SIZE):
+        """
+        @param size : number of fragmented messages to keep
+        """
+        self._size = size
+        self._fragments = {}
+        self._order = deque()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def store(self, uid, fragments):
+        """ Store the fragments of a message, forget the oldest message if the cache is full
+        @param uid : message id
+        @param fragments : dictionnary { part number : fragment XplMessage }
+        """
+        uid = str(uid)
+        if uid not in self._fragments:
+            self._order.append(uid)
+        self._fragments[uid] = fragments
+        while len(self._order) > self._size:
+            del self._fragments[self._order.popleft()]
+
+    def get(self, uid, part):
+        """ Get a stored fragment
+        @param uid : message id
+        @param part : part number
+        @return the fragment XplMessage or None if it is not (or no more) stored
+        """
+        fragments = self._fragments.get(str(uid))
+        if fragments is None:
+            return None
+        try:
+            return fragments.get(int(part))
+        except ValueError:
+            return None
+
+    def get_requested(self, request):
+        """ Get the fragments asked by a fragment.request message
+        @param request : fragment.request XplMessage
+        @return a list of fragment XplMessage
+        """
+        if request.data.get("command") != "resend" or "message" not in request.data:
+            return []
+        parts = request.data.get("part", [])
+        if not isinstance(parts, list):
+            parts = [parts]
+        result = []
+        for part in parts:
+            fragment = self.get(request.data["message"], part)
+            if fragment is not None:
+                result.append(fragment)
+        return result
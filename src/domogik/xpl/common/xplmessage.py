@@ -57,6 +57,7 @@ The XplMessage object maps all values as object attributes:
 
 It is possible to build a message from a network packet or from scratch.
 It is also possible to create a network packet from the message.
+Network packets can be text (xPL standard) or binary (see xplbinary).
 
 More informations are available here:
 
@@ -79,6 +80,7 @@ import copy
 
 from domogik.common.dmg_exceptions import XplMessageError
 from domogik.common.ordereddict import OrderedDict
+from domogik.xpl.common import xplbinary
 
 REGEXP_TYPE = r"""(?P<type_>xpl-cmnd | xpl-trig | xpl-stat)
               """
@@ -379,13 +381,16 @@ class XplMessage(object):
     def from_packet(self, packet):
         """ Decode message from given packet.
 
-        @param packet: message packet, as sent on the network
+        @param packet: message packet, as sent on the network (text or binary)
         @type packet: str
 
         @raise XplMessageError: the message packet is incorrect
 
         @raise XplMessageError: invalid message packet
         """
+        if xplbinary.is_binary(packet):
+            xplbinary.decode(packet, self)
+            return
         match_global = XplMessage.__regexp_global.match(packet)
         if match_global is None:
             raise XplMessageError("Invalid message packet")
@@ -406,23 +411,43 @@ class XplMessage(object):
         @return: message packet, as sent on the network
         @rtype: str
         """
-        packet = "%s\n" % self.type
-        packet += "{\n"
-        packet += "hop=%d\n" % self.hop_count
-        packet += "source=%s\n" % self.source
-        packet += "target=%s\n" % self.target
-        packet += "}\n"
-        packet += "%s\n" % self.schema
-        packet += "{\n"
+        return self.header_to_packet() + self.data_to_packet()
+
+    def to_binary(self):
+        """ Convert the message to a binary packet.
+
+        @return: binary message packet (see xplbinary)
+        @rtype: str
+        """
+        return xplbinary.encode(self)
+
+    def header_to_packet(self):
+        """ Convert the message header and schema to packet.
+
+        The result only depends on type, hop count, source, target and
+        schema, so it can be cached by the senders.
+
+        @return: beginning of the message packet, up to the data block opening
+        @rtype: str
+        """
+        return "%s\n{\nhop=%d\nsource=%s\ntarget=%s\n}\n%s\n{\n" % \
+               (self.type, self.hop_count, self.source, self.target, self.schema)
+
+    def data_to_packet(self):
+        """ Convert the message data to packet.
+
+        @return: end of the message packet, from the data to the data block closing
+        @rtype: str
+        """
+        lines = []
         for key, value in self.data.iteritems():
             if type(value) == list:
                 for v in value:
-                    packet += "%s=%s\n" % (key, v)
+                    lines.append("%s=%s\n" % (key, v))
             else:
-                packet += "%s=%s\n" % (key, value)
-        packet += "}\n"
-
-        return packet
+                lines.append("%s=%s\n" % (key, value))
+        lines.append("}\n")
+        return "".join(lines)
 
     def is_valid(self):
         """ Check if the message is valid.
@@ -457,13 +482,15 @@ class FragmentedXplMessage(object):
             self._init_from_fragment(fragment)
             self.add_fragment(fragment)
 
-    def _init_from_fragment(self, fragment):
+    def _init_from_fragment(self, fragment, ids=None):
         """ Initialize the object with the first fragment
         @param fragment : fragment of the message
         @type fragment : XplMessage
+        @param ids : fragment ids, as returned by _extract_ids (extracted from fragment if None)
         @warning the schema will be initialized only with the first fragment
         """
-        ids = self._extract_ids(fragment)
+        if ids is None:
+            ids = self._extract_ids(fragment)
         self._message_id = ids[2]
         self._fragment_count = int(ids[1])
         self._mess_type = fragment.type
@@ -472,12 +499,15 @@ class FragmentedXplMessage(object):
         if "schema" in fragment.data:
             self._mess_schema = fragment.data["schema"]
 
-    def add_fragment(self, fragment):
+    def add_fragment(self, fragment, ids=None):
         """ Add a fragment to the message
+        @param fragment : fragment of the message
+        @param ids : fragment ids, as returned by _extract_ids (extracted from fragment if None)
         """
-        ids = self._extract_ids(fragment)
+        if ids is None:
+            ids = self._extract_ids(fragment)
         if (((not self._mess_schema) and (ids[0] == 1)) or not self._message_id):
-            self._init_from_fragment(fragment)
+            self._init_from_fragment(fragment, ids)
         if ids[2] != self._message_id:
             raise ValueError("The message ID is not the same as previous fragments")
         if ids[1] != self._fragment_count:
@@ -525,7 +555,7 @@ class FragmentedXplMessage(object):
                 msg.add_single_data("part",str(i))
         else:
             for i in range(1, self._fragment_count + 1):
-                if i not in self.fragments:
+                if i not in self._fragments:
                     msg.add_single_data("part",str(i))
         return msg
 
@@ -541,11 +571,25 @@ class FragmentedXplMessage(object):
         msg.set_schema(self._mess_schema)
         msg.set_source(self._mess_from)
         msg.set_target(self._mess_to)
+        # fragments data were already checked when the fragments were parsed,
+        # so they are copied without being parsed again
+        data = msg.data
         for i in range(1, self._fragment_count + 1):
             f = self._fragments[i]
-            for d in f.data.keys():
-                if d not in ["partid","schema"]:
-                    msg.add_single_data(d, f.data[d])
+            for d, value in f.data.iteritems():
+                if d in ("partid", "schema"):
+                    continue
+                if d in data:
+                    if type(data[d]) != list:
+                        data[d] = [data[d]]
+                    if type(value) == list:
+                        data[d].extend(value)
+                    else:
+                        data[d].append(value)
+                elif type(value) == list:
+                    data[d] = list(value)
+                else:
+                    data[d] = value
         return msg
 
     @staticmethod
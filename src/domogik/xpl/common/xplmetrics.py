@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+Counters and latency histograms of the xPL processing of a plugin (messages
+parsed, dropped, fragmented, time spent in the filters of the listeners, in
+the callbacks...).
+
+The instrumentation is left on in production :
+- the counters are simple increments, without lock : under concurrency a few
+  increments may be lost, which is fine for statistics
+- only one call out of METRICS_SAMPLE_RATE (on average) is timed
+- the histograms have fixed log-linear buckets (8 buckets per power of two,
+  so about 12% of precision), recording a value is a few integer operations
+
+Implements
+==========
+
+- Histogram
+- Metrics
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+import random
+import time
+
+# One call out of METRICS_SAMPLE_RATE is timed (0 : no timing)
+METRICS_SAMPLE_RATE = 16
+# Precision of the histograms : 2**SUB_BITS buckets per power of two
+SUB_BITS = 3
+# Values are recorded in microseconds, up to 2**MAX_BITS (about 4 minutes)
+MAX_BITS = 28
+BUCKETS = (MAX_BITS - SUB_BITS + 1) << SUB_BITS
+
+
+def bucket_index(value):
+    """ Return the bucket of a value
+        @param value : value in microseconds (integer)
+    """
+    if value < (2 << SUB_BITS):
+        return value
+    shift = value.bit_length() - SUB_BITS - 1
+    index = ((shift + 1) << SUB_BITS) + (value >> shift) - (1 << SUB_BITS)
+    return min(index, BUCKETS - 1)
+
+def bucket_value(index):
+    """ Return the highest value of a bucket
+        @param index : bucket index
+    """
+    if index < (2 << SUB_BITS):
+        return index
+    shift = (index >> SUB_BITS) - 1
+    mantissa = (index & ((1 << SUB_BITS) - 1)) + (1 << SUB_BITS)
+    return ((mantissa + 1) << shift) - 1
+
+
+class Histogram():
+    """ Distribution of durations
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, duration):
+        """ Add a duration
+            @param duration : duration in seconds
+        """
+        value = int(duration * 1000000)
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """ Return a percentile of the durations in seconds
+            @param percent : percentile (50, 99...)
+        """
+        if self.count == 0:
+            return 0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bucket_value(index), self.max) / 1000000.0
+        return self.max / 1000000.0
+
+    def summary(self):
+        """ Return the count and the main percentiles in milliseconds
+        """
+        if self.count == 0:
+            return {"count" : 0}
+        return {"count" : self.count,
+                "mean" : round(self.total / 1000.0 / self.count, 3),
+                "p50" : round(self.percentile(50) * 1000, 3),
+                "p90" : round(self.percentile(90) * 1000, 3),
+                "p99" : round(self.percentile(99) * 1000, 3),
+                "max" : round(self.max / 1000.0, 3)}
+
+
+class Metrics():
+    """ Counters, max gauges and sampled latency histograms
+    """
+
+    def __init__(self, sample_rate = METRICS_SAMPLE_RATE):
+        """ Init the metrics
+            @param sample_rate : one call out of sample_rate is timed, 0 for
+            no timing
+        """
+        self._sample_rate = sample_rate
+        # the timed calls are drawn at random : with a counter, nested
+        # timings (packet, then listeners) would always skip each other
+        if sample_rate > 0:
+            self._probability = 1.0 / sample_rate
+        else:
+            self._probability = 0
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def incr(self, name, value = 1):
+        """ Increment a counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge_max(self, name, value):
+        """ Keep the max of a value
+        """
+        if value > self.gauges.get(name, 0):
+            self.gauges[name] = value
+
+    def start(self):
+        """ Start a sampled timing
+            @return the start time, or None if this call is not timed
+        """
+        if random.random() >= self._probability:
+            return None
+        return time.time()
+
+    def stop(self, name, start):
+        """ End a sampled timing
+            @param name : histogram name
+            @param start : value returned by start()
+        """
+        if start is not None:
+            self.record(name, time.time() - start)
+
+    def record(self, name, duration):
+        """ Add a duration to a histogram
+            @param name : histogram name
+            @param duration : duration in seconds
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        histogram.record(duration)
+
+    def snapshot(self):
+        """ Return all the metrics
+        """
+        return {"counters" : dict(self.counters),
+                "gauges" : dict(self.gauges),
+                "histograms" : dict([(name, histogram.summary()) for name, histogram \
+                                     in self.histograms.items()])}
+
+    def dump(self):
+        """ Return the metrics as text lines
+        """
+        snapshot = self.snapshot()
+        lines = ["Sample rate : 1/%s" % self._sample_rate]
+        for name in sorted(snapshot["counters"]):
+            lines.append("%s = %s" % (name, snapshot["counters"][name]))
+        for name in sorted(snapshot["gauges"]):
+            lines.append("%s (max) = %s" % (name, snapshot["gauges"][name]))
+        for name in sorted(snapshot["histograms"]):
+            summary = snapshot["histograms"][name]
+            if summary["count"] == 0:
+                continue
+            lines.append("%s : %s sampled, mean %s ms, p50 %s ms, p90 %s ms, p99 %s ms, max %s ms" % \
+                         (name, summary["count"], summary["mean"], summary["p50"],
+                          summary["p90"], summary["p99"], summary["max"]))
+        return lines
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+
+ZeroMQ transport for xPL messages
+
+When 'xpl_transport = zmq' is set in the domogik section of domogik.cfg,
+the xPL Manager publishes the messages targeted at a Domogik process on a
+local ZeroMQ PUB/SUB proxy (dmg_xplzmq_proxy) instead of broadcasting them
+on UDP. Each message is
+sent as a 2 parts ZeroMQ message : a topic and the xPL packet.
+The topic is 'xpl/<schema>/<source>/', so that the subscriptions made from
+the Listener filters (schema, xplsource) are filtered by the proxy, not by
+each plugin.
+
+Heartbeats (hub discovery) and the messages for any target ('*') or for
+another xPL device still use UDP, so that the hub and the third party xPL
+devices receive them. Messages from xPL devices which don't use this
+transport are still received on UDP : the transport must be enabled on all
+the Domogik processes which talk together.
+
+Implements
+==========
+
+- topic_for
+- subscription_prefixes
+- ZmqTransport
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+import threading
+import traceback
+import zmq
+
+TOPIC_ROOT = "xpl/"
+# Default ports of the xPL proxy : plugins publish on XPL_PUB_PORT and
+# subscribe on XPL_SUB_PORT
+XPL_PUB_PORT = 40413
+XPL_SUB_PORT = 40414
+# Schemas which are always sent on UDP (hub discovery)
+UDP_ONLY_SCHEMAS = ("hbeat.app", "hbeat.end", "hbeat.request", "hbeat.basic")
+# Vendor of the Domogik processes, the only targets reached through ZeroMQ
+DOMOGIK_TARGET = "domogik-"
+
+
+def topic_for(message):
+    """ Return the topic of a message
+    @param message : XplMessage instance
+    """
+    return "%s%s/%s/" % (TOPIC_ROOT, message.schema, message.source)
+
+
+def subscription_prefixes(filter):
+    """ Return the topic prefixes to subscribe to for a Listener filter
+    @param filter : the Listener filter
+    @return a list of topic prefixes
+    """
+    schemas = filter.get('schema')
+    if not schemas:
+        return [TOPIC_ROOT]
+    if not isinstance(schemas, list):
+        schemas = [schemas]
+    source = filter.get('xplsource')
+    if source and not isinstance(source, list):
+        return ["%s%s/%s/" % (TOPIC_ROOT, schema, source) for schema in schemas]
+    return ["%s%s/" % (TOPIC_ROOT, schema) for schema in schemas]
+
+
+class ZmqTransport:
+    """ Publish and receive xPL packets through the xPL ZeroMQ proxy
+    """
+
+    def __init__(self, plugin, ip = "127.0.0.1", pub_port = XPL_PUB_PORT, sub_port = XPL_SUB_PORT):
+        """
+        @param plugin : the plugin instance (for log, threads and stop event)
+        @param ip : ip of the proxy
+        @param pub_port : port on which the messages are published
+        @param sub_port : port on which the messages are received
+        """
+        self._plugin = plugin
+        self.log = plugin.log
+        self._context = zmq.Context.instance()
+        self._pub = self._context.socket(zmq.PUB)
+        self._pub.connect("tcp://%s:%s" % (ip, pub_port))
+        self._sub = self._context.socket(zmq.SUB)
+        self._sub.connect("tcp://%s:%s" % (ip, sub_port))
+        # The SUB socket belongs to the receive thread : subscriptions
+        # are sent to it through an inproc socket
+        ctrl_endpoint = "inproc://xplzmq-ctrl-%s" % id(self)
+        self._ctrl_pull = self._context.socket(zmq.PULL)
+        self._ctrl_pull.bind(ctrl_endpoint)
+        self._ctrl_push = self._context.socket(zmq.PUSH)
+        self._ctrl_push.connect(ctrl_endpoint)
+        # zmq sockets are not thread safe
+        self._lock_pub = threading.Lock()
+        self._lock_ctrl = threading.Lock()
+        # topic prefix => number of listeners using it
+        self._subscriptions = {}
+        self._callback = None
+        self._thread = None
+
+    def start(self, callback):
+        """ Start the receive thread
+        @param callback : function called with each received packet
+        """
+        self._callback = callback
+        self._thread = threading.Thread(None, self._run_receive, "thread-xplzmq", (), {})
+        self._plugin.register_thread(self._thread)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the receive thread and close the sockets
+        """
+        self._control("stop", "")
+        if self._thread is not None and threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._pub.close(linger = 0)
+        self._ctrl_push.close(linger = 0)
+
+    def accepts(self, message):
+        """ Check if a message can be sent through this transport : only the
+        messages targeted at a Domogik process, the other ones must reach the
+        hub and the xPL devices
+        @param message : the XplMessage
+        """
+        return message.target is not None and message.target.startswith(DOMOGIK_TARGET) \
+               and message.schema not in UDP_ONLY_SCHEMAS
+
+    def send(self, message, packet):
+        """ Publish an xPL packet
+        @param message : the XplMessage (for the topic)
+        @param packet : the serialized message
+        """
+        self._lock_pub.acquire()
+        try:
+            self._pub.send_multipart([topic_for(message), packet])
+        finally:
+            self._lock_pub.release()
+
+    def subscribe(self, filter):
+        """ Subscribe to the messages matching a Listener filter
+        @param filter : the Listener filter
+        @return the subscribed prefixes, to give to unsubscribe() : the
+        filter may change in the meantime
+        """
+        prefixes = subscription_prefixes(filter)
+        for prefix in prefixes:
+            count = self._subscriptions.get(prefix, 0)
+            self._subscriptions[prefix] = count + 1
+            if count == 0:
+                self._control("sub", prefix)
+        return prefixes
+
+    def unsubscribe(self, prefixes):
+        """ Remove the subscriptions made for a Listener filter
+        @param prefixes : the prefixes returned by subscribe()
+        """
+        for prefix in prefixes:
+            count = self._subscriptions.get(prefix, 0)
+            if count <= 1:
+                self._subscriptions.pop(prefix, None)
+                if count == 1:
+                    self._control("unsub", prefix)
+            else:
+                self._subscriptions[prefix] = count - 1
+
+    def _control(self, command, prefix):
+        """ Send a command to the receive thread
+        """
+        self._lock_ctrl.acquire()
+        try:
+            self._ctrl_push.send_multipart([command, prefix])
+        finally:
+            self._lock_ctrl.release()
+
+    def _run_receive(self):
+        """ Receive the packets and the control commands
+        """
+        poller = zmq.Poller()
+        poller.register(self._sub, zmq.POLLIN)
+        poller.register(self._ctrl_pull, zmq.POLLIN)
+        running = True
+        while running:
+            try:
+                events = dict(poller.poll())
+            except zmq.ZMQError:
+                self.log.error("Error during the read of the xPL proxy : %s" % traceback.format_exc())
+                break
+            if self._ctrl_pull in events:
+                command, prefix = self._ctrl_pull.recv_multipart()
+                if command == "sub":
+                    self._sub.setsockopt(zmq.SUBSCRIBE, prefix)
+                elif command == "unsub":
+                    self._sub.setsockopt(zmq.UNSUBSCRIBE, prefix)
+                elif command == "stop":
+                    running = False
+            if self._sub in events:
+                # drain all the waiting messages
+                while True:
+                    try:
+                        topic, packet = self._sub.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    except ValueError:
+                        self.log.debug("bad data received from the xPL proxy")
+                        continue
+                    self._callback(packet)
+        self._sub.close(linger = 0)
+        self._ctrl_pull.close(linger = 0)
+        self.log.info("xPL ZeroMQ transport stopped")
@@ -48,7 +48,8 @@ from optparse import OptionParser
 #from domogik.xpl.bin.hub import VERSION
 
 
-from domogik.xpl.common.xplmessage import XplMessage, XplMessageError
+from domogik.xpl.common.xplmessage import XplMessage, XplMessageError, FragmentedXplMessage
+from domogik.xpl.common import xplbinary
 from domogik.common import daemonize
 
 from datetime import datetime
@@ -71,6 +72,9 @@ ALIVE = "alive"
 DEAD = "dead"
 STOPPED = "stopped"
 
+# max size of a text xPL message (bigger ones are fragmented)
+MAX_TEXT_SIZE = 1472
+
 
 
 
@@ -207,6 +211,7 @@ class MulticastPingPong(DatagramProtocol):
             'alive' : ALIVE / DEAD / STOPPED          # status
             'nb_valid_messages' : 99                  # number of valid messages sent by a client
             'nb_invalid_messages' : 9                 # number of invalid messages sent by a client
+            'binary' : True                           # the client understands binary messages (xplbinary)
            },...
           ]
 
@@ -247,6 +252,9 @@ class MulticastPingPong(DatagramProtocol):
         self._file_bandwidth = file_bandwidth
         self._bandwidth = []
 
+        ### UID of the fragments of the big messages delivered as text
+        self._fragment_uid = 1
+
         ### Invalid data
         self._do_log_invalid_data = do_log_invalid_data
         self._file_invalid_data = file_invalid_data
@@ -410,7 +418,17 @@ class MulticastPingPong(DatagramProtocol):
                                  'last_seen' : time(),
                                  'alive' : ALIVE,
                                  'nb_valid_messages' : 1,  
-                                 'nb_invalid_messages' : 0})
+                                 'nb_invalid_messages' : 0,
+                                 'binary' : self._has_binary_capability(xpl)})
+
+    def _has_binary_capability(self, xpl):
+        """ Check if a client announced the binary encoding capability in its hbeat
+            @param xpl : xpl hbeat message
+        """
+        caps = xpl.data.get('caps', '')
+        if type(caps) != list:
+            caps = caps.split(',')
+        return xplbinary.CAPABILITY in caps
  
     def _update_client(self, client_id, xpl):
         """ update the client with the new interval and the last seen date (now)
@@ -425,6 +443,7 @@ class MulticastPingPong(DatagramProtocol):
                 client['interval'] = int(xpl.data['interval'])
                 client['last_seen'] = time()
                 client['alive'] = ALIVE
+                client['binary'] = self._has_binary_capability(xpl)
                 found = True
                 break
         if found == False:
@@ -451,30 +470,61 @@ class MulticastPingPong(DatagramProtocol):
     def _get_delivery_addresses(self, xpl):
         """ return the port list of the local client to deliver the xpl message
             @param xpl : xpl message
+            @return : list of (ip, port, binary)
         """
         addresses = []
         if xpl.target == "*":
             msg = "Target=*. Client ids for delivery : *"
             for client in self._client_list:
-                addresses.append((client['ip'], client['port']))
+                addresses.append((client['ip'], client['port'], client['binary']))
                 msg += "%s, " % client['id']
         else:
             msg = "Target=%s. Client id for delivery : " % xpl.target
             for client in self._client_list:
                 if client['source'] == xpl.target:
                     msg += client['id']
-                    addresses.append((client['ip'], client['port']))
+                    addresses.append((client['ip'], client['port'], client['binary']))
         self.log.info(msg)
         return addresses
 
     def _deliver_xpl(self, delivery_addresss, xpl):
         """ Deliver the xpl message to all known xpl clients
-            @param delivery_address : (ip, port)
+            The message is encoded once in each needed format : binary for
+            the clients which announced it, text (fragmented if needed) for
+            the others
+            @param delivery_address : (ip, port, binary)
             @param xpl : xpl message to send
         """
-        for address in delivery_addresss:
-            self.transport.write(str(xpl), address)
-        pass
+        text_packets = None
+        binary_packet = None
+        for ip, port, binary in delivery_addresss:
+            if binary and binary_packet is None:
+                try:
+                    binary_packet = xpl.to_binary()
+                except XplMessageError:
+                    # value or name too long for the binary encoding
+                    binary_packet = False
+                if binary_packet and len(binary_packet) > xplbinary.MAX_SIZE:
+                    binary_packet = False
+            if binary and binary_packet:
+                self.transport.write(binary_packet, (ip, port))
+            else:
+                if text_packets is None:
+                    text_packets = self._text_packets(xpl)
+                for packet in text_packets:
+                    self.transport.write(packet, (ip, port))
+
+    def _text_packets(self, xpl):
+        """ Encode a message as text, with fragments if it is too big
+            @param xpl : xpl message
+            @return : list of packets
+        """
+        packet = xpl.to_packet()
+        if len(packet) <= MAX_TEXT_SIZE:
+            return [packet]
+        fragments = FragmentedXplMessage.fragment_message(xpl, "hub%s" % self._fragment_uid)
+        self._fragment_uid += 1
+        return [fragment.to_packet() for fragment in fragments.values()]
 
  
     def _list_clients(self):
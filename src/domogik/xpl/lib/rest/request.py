@@ -24,10 +24,10 @@ Plugin purpose
 Implements
 ==========
 
+RequestContext object
 ProcessRequest object
 
 
-
 @author: Friz <fritz.smh@gmail.com>
 @copyright: (C) 2007-2012 Domogik project
 @license: GPL(v3)
@@ -41,8 +41,9 @@ from domogik.common.database import DbHelper, DbHelperException
 from domogik.xpl.common.helper import HelperError
 from domogik.xpl.lib.rest.jsondata import JSonHelper
 from domogik.xpl.lib.rest.csvdata import CsvHelper
-from domogik.xpl.lib.rest.tail import Tail
+from domogik.xpl.lib.rest.tail import Tail, Follow
 from domogik.common.packagemanager import PackageManager, PKG_PART_XPL, PKG_PART_RINOR, PKG_CACHE_DIR, ICON_CACHE_DIR 
+from domogik.common.resolver import DependencyResolver
 from domogik.common.packagejson import PackageException
 from domogik.common.packagejson import PackageJson
 import time
@@ -79,6 +80,34 @@ PING_DURATION = 2
 #### END TEMPORARY DATA ################################
 
 
+class RequestContext():
+    """ Data of the REST server shared by all the requests. It is built once
+        when the HTTP server starts and is read only
+    """
+
+    attributes = ['get_sanitized_hostname', '_rest_api_version', 'myxpl',
+                  'log', 'log_dm', '_package_path', '_src_prefix', '_design_dir',
+                  'repo_dir', 'use_ssl', 'get_exception', 'log_dir_path',
+                  '_router', '_db_pool', 'get_stop',
+                  '_queue_timeout', '_queue_size', '_queue_command_size',
+                  '_queue_package_size', '_queue_life_expectancy',
+                  '_queue_event_size', '_get_from_queue', '_put_in_queue',
+                  '_queue_package', '_queue_system_list', '_queue_system_detail',
+                  '_queue_system_start', '_queue_system_stop', '_queue_command',
+                  '_event_dmg', '_event_requests', 'stat_mgr', '_hosts_list',
+                  'get_installed_packages', '_get_installed_packages_from_manager']
+
+    def __init__(self, rest):
+        """ Copy the shared data from the REST server
+            @param rest : the Rest object
+        """
+        for name in self.attributes:
+            self.__dict__[name] = getattr(rest, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The request context is read only")
+
+
 class ProcessRequest():
     """ Class for processing a request
     """
@@ -166,8 +195,9 @@ class ProcessRequest():
         },
         # /log
         'log': {
-            '^/log/tail/txt/(?P<host>[a-z]+)/(?P<file>[a-z\.]+)/(?P<number>[0-9]+)/(?P<ofset>[0-9]+)$': '_rest_log_tail_txt',
-            '^/log/tail/html/(?P<host>[a-z]+)/(?P<file>[a-z\.]+)/(?P<number>[0-9]+)/(?P<ofset>[0-9]+)$': '_rest_log_tail_html',
+            '^/log/tail/txt/(?P<host>[a-z]+)/(?P<filename>[a-z\.]+)/(?P<number>[0-9]+)/(?P<offset>[0-9]+)$': '_rest_log_tail_txt',
+            '^/log/tail/html/(?P<host>[a-z]+)/(?P<filename>[a-z\.]+)/(?P<number>[0-9]+)/(?P<offset>[0-9]+)$': '_rest_log_tail_html',
+            '^/log/follow/(?P<host>[a-z]+)/(?P<filename>[a-z\.]+)$':                                '_rest_log_follow',
         },
         # /package
         'package': {
@@ -218,6 +248,26 @@ class ProcessRequest():
         },
    }
 
+    # urls which are not (yet) in the url table : processed by type
+    fallback_urls = {
+        'command': 'rest_command',
+        'stats': 'rest_stats',
+        'events': 'rest_events',
+        # commented for security reasons
+        #'xpl-cmnd': 'rest_xpl_cmnd',
+        'base': 'rest_base',
+        'plugin': 'rest_plugin',
+        'account': 'rest_account',
+        'queuecontent': 'rest_queuecontent',
+        'helper': 'rest_helper',
+        'testlongpoll': 'rest_testlongpoll',
+        'repo': 'rest_repo',
+        'scenario': 'rest_scenario',
+        'package': 'rest_package',
+        'log': 'rest_log',
+        'host': 'rest_host',
+    }
+
 
 ######
 # init namespace
@@ -271,57 +321,16 @@ class ProcessRequest():
         self.xpl_cmnd_schema = None
         self._put_filename = None
 
-        # shorter access
-        self.get_sanitized_hostname = self.handler_params[0].get_sanitized_hostname
-        self._rest_api_version = self.handler_params[0]._rest_api_version
-        self.myxpl = self.handler_params[0].myxpl
-        self.log = self.handler_params[0].log
-        self.log_dm = self.handler_params[0].log_dm
-        self._package_path = self.handler_params[0]._package_path
-        self._src_prefix = self.handler_params[0]._src_prefix
-        self._design_dir = self.handler_params[0]._design_dir
-        self.repo_dir = self.handler_params[0].repo_dir
-        self.use_ssl = self.handler_params[0].use_ssl
-        self.get_exception = self.handler_params[0].get_exception
-        self.log_dir_path = self.handler_params[0].log_dir_path
+        # shorter access : the data shared by all the requests
+        self._context = self.handler_params[0]._request_context
 
         self.log.debug("Process request : init")
 
-        self._queue_timeout =  self.handler_params[0]._queue_timeout
-        self._queue_size =  self.handler_params[0]._queue_size
-        self._queue_command_size =  self.handler_params[0]._queue_command_size
-        self._queue_package_size =  self.handler_params[0]._queue_package_size
-        self._queue_life_expectancy = self.handler_params[0]._queue_life_expectancy
-        self._queue_event_size =  self.handler_params[0]._queue_event_size
-        self._get_from_queue = self.handler_params[0]._get_from_queue
-        self._put_in_queue = self.handler_params[0]._put_in_queue
-
-        self._queue_package =  self.handler_params[0]._queue_package
-
-        self._queue_system_list =  self.handler_params[0]._queue_system_list
-        self._queue_system_detail =  self.handler_params[0]._queue_system_detail
-        self._queue_system_start =  self.handler_params[0]._queue_system_start
-        self._queue_system_stop =  self.handler_params[0]._queue_system_stop
-        self._queue_command =  self.handler_params[0]._queue_command
-
-        self._event_dmg =  self.handler_params[0]._event_dmg
-        self._event_requests =  self.handler_params[0]._event_requests
-
-        self.stat_mgr =  self.handler_params[0].stat_mgr
-
-        self._hosts_list = self.handler_params[0]._hosts_list
-        self.get_installed_packages = self.handler_params[0].get_installed_packages
-        self._get_installed_packages_from_manager = self.handler_params[0]._get_installed_packages_from_manager
-
         # global init
         self.jsonp = False
         self.jsonp_cb = ""
         self.csv_export = False
 
-        # package path
-        if self._package_path != None:  # package mode
-            sys.path = [self._package_path] + sys.path
-
         # url processing
         #self.path = self.fixurl(self.path)
         #self.path = urllib.unquote(self.path)
@@ -356,14 +365,30 @@ class ProcessRequest():
         else:
             self.rest_request = []
 
-        # DB Helper
-        self._db = DbHelper()
+        # DB Helper : taken from the pool when first used (see __getattr__)
 
         #### TEMPORARY DATA FOR TEMPORARY FUNCTIONS ############
         self._pinglist = {}
 
         #### END TEMPORARY DATA ################################
 
+    def __getattr__(self, name):
+        """ Shorter access : self._context.* => self.*
+            The DbHelper (self._db) is taken from the pool on first use
+        """
+        if name == "_db":
+            self._db = self._context._db_pool.acquire()
+            return self._db
+        if name == "_context":
+            raise AttributeError(name)
+        return getattr(self._context, name)
+
+    def release(self):
+        """ Give back to the pool the DbHelper used by the request
+        """
+        if "_db" in self.__dict__:
+            self._context._db_pool.release(self.__dict__.pop("_db"))
+
     def fixurl(self, url):
         """ translate url in unicode
             @param url : url to put in unicode
@@ -404,63 +429,22 @@ class ProcessRequest():
         """ Process request
             This function call appropriate functions for processing path
         """
-        found = 0
         if self.rest_type == None:
-           self.rest_status()
-           found = 1 
+            self.rest_status()
+            return
+        self.parameters = {}
+        self.set_parameters(0)
+        if self._router.dispatch(self, self.rest_type, self.path):
+            return
+        self.log.warning("New url parser does not know url %s" % self.path)
+        print("New url parser does not know url %s" % self.path)
+        fallback = self._router.fallback(self.rest_type)
+        if fallback is not None:
+            fallback[1](self)
         else:
-            self.parameters = {}
-            self.set_parameters(0)
-            if self.rest_type in self.urls:
-                for k in self.urls[self.rest_type]:
-                    m = re.match(k, self.path)
-                    if m:
-                        found = 1
-                        if len( m.groupdict() ) == 0:
-                            eval('self.' + self.urls[self.rest_type][k] + '()')
-                        else:
-                            eval('self.'  + self.urls[self.rest_type][k] + '(' + ', '.join([v+"='"+k2+"'" for (v,k2) in m.groupdict().iteritems()]) + ')')
-                        break
-        if found == 0:
-	    self.log.warning("New url parser does not know url %s" % self.path) 
-	    print("New url parser does not know url %s" % self.path) 
-            if self.rest_type == "command":
-                self.rest_command()
-            elif self.rest_type == "stats":
-                self.rest_stats()
-            elif self.rest_type == "events":
-                self.rest_events()
-            # commented for security reasons
-            #elif self.rest_type == "xpl-cmnd":
-            #    self.rest_xpl_cmnd()
-            elif self.rest_type == "base":
-                self.rest_base()
-            elif self.rest_type == "plugin":
-                self.rest_plugin()
-            elif self.rest_type == "account":
-                self.rest_account()
-            elif self.rest_type == "queuecontent":
-                self.rest_queuecontent()
-            elif self.rest_type == "helper":
-                self.rest_helper()
-            elif self.rest_type == "testlongpoll":
-                self.rest_testlongpoll()
-            elif self.rest_type == "repo":
-                self.rest_repo()
-            elif self.rest_type == "scenario":
-                self.rest_scenario()
-            elif self.rest_type == "package":
-                self.rest_package()
-            elif self.rest_type == "log":
-                self.rest_log()
-            elif self.rest_type == "host":
-                self.rest_host()
-            elif self.rest_type == None:
-                self.rest_status()
-            else:
-                self.send_http_response_error(999, "Type [" + str(self.rest_type) + \
-                                          "] is not supported", \
-                                          self.jsonp, self.jsonp_cb)
+            self.send_http_response_error(999, "Type [" + str(self.rest_type) + \
+                                      "] is not supported", \
+                                      self.jsonp, self.jsonp_cb)
 
 
     def _parse_options(self):
@@ -3438,37 +3422,30 @@ class ProcessRequest():
         json_data.set_data_type("dependency")
 
         ### list dependencies
-        idx_python = 0
-        idx_plugin = 0
-        python_dep = []
+        # the package dependencies are resolved with their own dependencies,
+        # and all the python dependencies are checked in one xpl message
         pkg_mgr = PackageManager()
         pkg_list = self.get_installed_packages()
-        for dep in dep_list:
-            if dep["type"] == "python":
-                python_dep.append({"dep%s" % idx_python : dep["id"]})
-                idx_python += 1
-
-            if dep["type"] == "plugin":
-                id = dep["id"].split(" ")[0]
-                installed = False
-
-                if pkg_list.has_key(host):
-                    if pkg_list[host].has_key(pkg_type):
-                        for elt in pkg_list[host][pkg_type]:
-                            if elt["id"] == id:
-                                installed = True
-
-                data = {
-                           "type" : "plugin",
-                           "id" : dep["id"],
-                           "installed" : installed,
-                           "version" : "",
-                           "cmd_line" : "Install from Domogik Administration",
-                           "candidate" : "",
-                           "error" : "",
-                           }
-                json_data.add_data(data)
-                idx_plugin += 1
+        installed = []
+        if pkg_list.has_key(host):
+            for pkgs in pkg_list[host].itervalues():
+                installed.extend(pkgs)
+        resolver = DependencyResolver(pkg_mgr.get_catalog(), installed)
+        plan = resolver.resolve(dep_list)
+        for pkg in plan["packages"]:
+            data = {
+                       "type" : pkg["type"],
+                       "id" : pkg["id"],
+                       "installed" : pkg["installed"],
+                       "version" : pkg["version"],
+                       "cmd_line" : "Install from Domogik Administration",
+                       "candidate" : pkg["candidate"],
+                       "error" : pkg["error"],
+                       }
+            json_data.add_data(data)
+
+        idx_python = len(plan["python"])
+        python_dep = [{"dep%s" % idx : dep} for idx, dep in enumerate(plan["python"])]
 
         ### check python dependencies
         # if there are python dependencies, ask on xpl
@@ -3962,6 +3939,38 @@ class ProcessRequest():
             result = "Unable to read '%s' file" % path
         self.send_http_response_text_html(result)
 
+    def _rest_log_follow(self, host, filename):
+        """ Send (raw format, streamed) the lines appended to a log file
+            The response ends after tail.FOLLOW_TIMEOUT seconds or when
+            the client closes the connection
+            @param host : hostname for file
+            @param filename : filename (without ".log")
+        """
+        self.log.debug("Log : ask for follow action : %s > %s" % (host, filename))
+
+        if host == self.get_sanitized_hostname():
+            subdir = ""
+        else:
+            subdir = host.lower()
+        path = "%s/%s/%s.log" % (self.log_dir_path, subdir, os.path.basename(filename))
+        try:
+            follow = Follow(path, self.get_stop())
+        except (IOError, OSError):
+            self.send_http_response_text_plain("Unable to read '%s' file" % path)
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain')
+        self.send_header('Expires', '-1')
+        self.send_header('Cache-control', 'no-cache')
+        self.end_headers()
+        try:
+            for data in follow.lines():
+                self.wfile.write(data)
+                self.wfile.flush()
+        except IOError:
+            # client closed connexion
+            self.log.debug("Log : end of follow action : %s > %s" % (host, filename))
+
 ######
 # /host processing
 ######
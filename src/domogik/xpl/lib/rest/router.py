@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+=============
+
+- Route a REST url to the method of ProcessRequest which processes it
+
+The url table is compiled once when the REST server starts :
+- the routes are grouped by the first element of the url (/base, /plugin...)
+- each pattern is compiled and keeps its literal prefix, so that most of
+  the patterns are discarded with a startswith() before any regex is run
+- each route is bound to its handler function, which is called with the
+  named groups of the pattern as keyword parameters
+
+Implements
+==========
+
+UrlRouter object
+
+
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+import re
+
+# Characters which end the literal prefix of a pattern
+REGEX_SPECIAL = ".^$*+?{}[]\\|()"
+
+
+def literal_prefix(pattern):
+    """ Return the literal beginning of a pattern : '/base/device/' for
+        '^/base/device/del/(?P<id>[0-9]+)$'
+        @param pattern : the pattern
+    """
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+    prefix = ""
+    for char in pattern:
+        if char in REGEX_SPECIAL:
+            # a quantifier applies to the previous char
+            if char in "*+?{" and len(prefix) > 0:
+                prefix = prefix[:-1]
+            break
+        prefix += char
+    return prefix
+
+
+class UrlRouter():
+    """ Compiled url table
+    """
+
+    def __init__(self, handler_class, urls, fallbacks = {}):
+        """ Compile the url table
+            @param handler_class : class which owns the handlers
+            @param urls : { rest_type : { pattern : handler name } }
+            @param fallbacks : { rest_type : handler name } for the urls
+                               which are not in the url table
+        """
+        self.routes = {}
+        # patterns whose handler does not exist : these urls go to the fallback
+        self.missing = []
+        for rest_type, patterns in urls.iteritems():
+            routes = []
+            for pattern, name in patterns.iteritems():
+                if not hasattr(handler_class, name):
+                    self.missing.append((pattern, name))
+                    continue
+                routes.append((literal_prefix(pattern), re.compile(pattern), \
+                               name, getattr(handler_class, name)))
+            # the most specific routes first
+            routes.sort(key = lambda route: (-len(route[0]), route[1].pattern))
+            self.routes[rest_type] = [(prefix, regexp.match, name, handler) \
+                                      for (prefix, regexp, name, handler) in routes]
+        self.fallbacks = {}
+        for rest_type, name in fallbacks.iteritems():
+            # some urls lead to nothing : keep the old behaviour (an error)
+            if hasattr(handler_class, name):
+                self.fallbacks[rest_type] = (name, getattr(handler_class, name))
+
+    def count(self):
+        """ Return the number of routes
+        """
+        return sum([len(routes) for routes in self.routes.itervalues()])
+
+    def match(self, rest_type, path):
+        """ Find the route of an url
+            @param rest_type : first element of the url
+            @param path : url without parameters
+            @return (handler name, handler, parameters) or None
+        """
+        for prefix, match, name, handler in self.routes.get(rest_type, ()):
+            if path.startswith(prefix):
+                result = match(path)
+                if result:
+                    return name, handler, result.groupdict()
+        return None
+
+    def fallback(self, rest_type):
+        """ Find the handler of the urls which are not in the url table
+            @param rest_type : first element of the url
+            @return (handler name, handler) or None
+        """
+        return self.fallbacks.get(rest_type)
+
+    def dispatch(self, request, rest_type, path):
+        """ Call the handler of an url
+            @param request : the ProcessRequest object
+            @param rest_type : first element of the url
+            @param path : url without parameters
+            @return True if a route was found in the url table
+        """
+        route = self.match(rest_type, path)
+        if route is None:
+            return False
+        name, handler, params = route
+        handler(request, **params)
+        return True
@@ -142,6 +142,8 @@ class StatsManager:
             self._dev = dev
             self._stat = stat
             self._sen = sensor
+            # time of the database writes
+            self._metrics = xpl.metrics
             
             ### build the filter
             params = {'schema': stat.schema, 'xpltype': xpl_type}
@@ -191,7 +193,9 @@ class StatsManager:
                                         % (p.key, value))
                                 # do the store
                                 device_data.append({"value" : value, "sensor": p.sensor_id})
+                                start = self._metrics.start()
                                 my_db.add_sensor_history(p.sensor_id, value, current_date)
+                                self._metrics.stop("db.add_sensor_history", start)
             except:
                 error = "Error when processing stat : %s" % traceback.format_exc()
                 print("==== Error in Stats ====")
@@ -23,6 +23,11 @@ Purpose
 
 Tail functionnality
 
+The lines are found by scanning the mmaped file backwards for the newlines,
+so only the requested lines are copied, whatever the size of the file and
+the offset. Follow sends the lines appended to a file, waked up by inotify
+when pyinotify is available.
+
 @author: Fritz <fritz.smh@gmail.com>
 @copyright: (C) 2007-2012 Domogik project
 @license: GPL(v3)
@@ -30,9 +35,20 @@ Tail functionnality
 """
 
 import os
-import itertools
-import re
-import urllib
+import mmap
+import time
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+# Log levels, by priority, and their html class
+LEVELS = [("ERROR", "error"), ("WARNING", "warning"), ("INFO", "info"), ("DEBUG", "debug")]
+
+# Max duration of a follow request (seconds)
+FOLLOW_TIMEOUT = 300
+# Delay between two checks of the file (seconds) : max wait for inotify events
+FOLLOW_DELAY = 1
 
 class Tail():
     """ Tail tool
@@ -41,10 +57,9 @@ class Tail():
     def __init__(self, file, number, offset = 0):
         """ Return the N last lines of a file as a string
         """
-        f=open(file,'rb')
-        self.result = ""
-        for line in self.tail(f, number, offset):
-            self.result += "%s\n" % line
+        with open(file, 'rb') as f:
+            lines = self.tail(f, number, offset)
+        self.result = "".join(["%s\n" % line for line in lines])
 
     def get(self):
         """ return result
@@ -53,101 +68,140 @@ class Tail():
 
     def get_html(self):
         """ return result in html
+            Each line with a log level starts a new div, the other lines
+            are added to the previous one
         """
-        result = self.result
         unknown = "<div class='unknown'>"
-        error = "<div class='error'>"
-        warning = "<div class='warning'>"
-        info = "<div class='info'>"
-        debug = "<div class='debug'>"
         date = "<span class='date'>"
         type = "<span class='type'>"
         text = "<span class='text'>"
         end_span = "</span>"
         end_div = "</div>"
-        result = re.sub(r'(.*)(ERROR)(.*)', 
-                            "%s%s%s%s\\1%s%s\\2%s%s\\3" % (end_span,
-                                                           end_div,
-                                                           error, date,
-                                                           end_span, type,
-                                                           end_span, text),
-                            result)
-        result = re.sub(r'(.*)(WARNING)(.*)', 
-                            "%s%s%s%s\\1%s%s\\2%s%s\\3" % (end_span,
-                                                           end_div,
-                                                           warning, date,
-                                                           end_span, type,
-                                                           end_span, text),
-                            result)
-        result = re.sub(r'(.*)(INFO)(.*)', 
-                            "%s%s%s%s\\1%s%s\\2%s%s\\3" % (end_span,
-                                                           end_div,
-                                                           info, date,
-                                                           end_span, type,
-                                                           end_span, text),
-                            result)
-        result = re.sub(r'(.*)(DEBUG)(.*)', 
-                            "%s%s%s%s\\1%s%s\\2%s%s\\3" % (end_span,
-                                                           end_div,
-                                                           debug, date,
-                                                           end_span, type,
-                                                           end_span, text),
-                            result)
-        return "%s%s%s%s%s%s%s%s%s" % (unknown,
-                                 date, end_span,
-                                 type, end_span,
-                                 text, result,
-                                 end_span, end_div)
-
-    def rblocks(self, f, blocksize=4096):
-        """Read file as series of blocks from end of file to start.
-    
-        The data itself is in normal order, only the order of the blocks is reversed.
-        ie. "hello world" -> ["ld","wor", "lo ", "hel"]
-        Note that the file must be opened in binary mode.
-        """
-        if 'b' not in f.mode.lower():
-            raise Exception("File must be opened using binary mode.")
-        size = os.stat(f.name).st_size
-        fullblocks, lastblock = divmod(size, blocksize)
-    
-        # The first(end of file) block will be short, since this leaves 
-        # the rest aligned on a blocksize boundary.  This may be more 
-        # efficient than having the last (first in file) block be short
-        f.seek(-lastblock,2)
-        yield f.read(lastblock)
-    
-        for i in range(fullblocks-1,-1, -1):
-            f.seek(i * blocksize)
-            yield f.read(blocksize)
-    
+        html = [unknown, date, end_span, type, end_span, text]
+        for line in self.result.split("\n"):
+            for level, css in LEVELS:
+                idx = line.rfind(level)
+                if idx != -1:
+                    html.append("%s%s<div class='%s'>%s%s%s%s%s%s%s%s" % \
+                                (end_span, end_div, css, date, line[:idx], end_span,
+                                 type, level, end_span, text, line[idx + len(level):]))
+                    break
+            else:
+                html.append(line)
+            html.append("\n")
+        # no newline after the last line
+        html.pop()
+        html.append(end_span)
+        html.append(end_div)
+        return "".join(html)
+
     def tail(self, f, nlines, offset):
         """ tail
             @param nlines : number of lines to get
             @param offset : start at N lines from the end
         """
-        buf = ''
-        result = []
-        for block in self.rblocks(f):
-            buf = block + buf
-            lines = buf.splitlines()
-    
-            # Return all lines except the first (since may be partial)
-            if lines:
-                result.extend(lines[1:]) # First line may not be complete
-                if(len(result) >= nlines + offset):
-                    if offset == 0:
-                        return result[-nlines - offset:]
-                    else:
-                        return result[-nlines - offset:-offset]
-    
-                buf = lines[0]
-    
-        if offset == 0:
-            return ([buf]+result)[-nlines - offset:]
-        else:
-            return ([buf]+result)[-nlines - offset:-offset]
-    
+        size = os.fstat(f.fileno()).st_size
+        if size == 0 or nlines <= 0:
+            return []
+        data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            # a newline at the end of the file does not start a new line
+            stop = size
+            if data[stop - 1] == "\n":
+                stop -= 1
+            # skip the offset lines
+            for i in xrange(offset):
+                stop = data.rfind("\n", 0, stop)
+                if stop == -1:
+                    return []
+            # find the beginning of the first line
+            start = stop
+            for i in xrange(nlines):
+                start = data.rfind("\n", 0, start)
+                if start == -1:
+                    break
+            return [line.rstrip("\r") for line in data[start + 1:stop].split("\n")]
+        finally:
+            data.close()
+
+
+class Follow():
+    """ Send the lines appended to a file
+    """
+
+    def __init__(self, file, stop, timeout = FOLLOW_TIMEOUT):
+        """ Follow a file from its current end
+            @param file : the file
+            @param stop : Event to stop following
+            @param timeout : max duration (seconds)
+        """
+        self._file = file
+        self._stop = stop
+        self._timeout = timeout
+        self._f = open(file, 'rb')
+        self._f.seek(0, os.SEEK_END)
+        # incomplete last line
+        self._partial = ""
+
+    def _read(self):
+        """ Return the complete lines appended since the last read
+        """
+        # clear the end of file flag
+        self._f.seek(self._f.tell())
+        data = self._f.read()
+        try:
+            stat = os.stat(self._file)
+            if stat.st_ino != os.fstat(self._f.fileno()).st_ino:
+                # the file was rotated : end of the old file, then the new one
+                self._f.close()
+                self._f = open(self._file, 'rb')
+                data += self._f.read()
+            elif stat.st_size < self._f.tell():
+                # the file was truncated
+                self._f.seek(0)
+                self._partial = ""
+                data = self._f.read()
+        except (OSError, IOError):
+            # rotation in progress
+            pass
+        data = self._partial + data
+        end = data.rfind("\n") + 1
+        self._partial = data[end:]
+        return data[:end]
+
+    def lines(self):
+        """ Generator of the appended lines, until timeout or stop
+        """
+        notifier = None
+        if pyinotify != None:
+            try:
+                wmgr = pyinotify.WatchManager()
+                # the events only wake up the loop : default processing does nothing
+                notifier = pyinotify.Notifier(wmgr, pyinotify.ProcessEvent(), \
+                                              timeout = FOLLOW_DELAY * 1000)
+                # watch the directory : the file may be rotated
+                wmgr.add_watch(os.path.dirname(self._file), \
+                               pyinotify.IN_MODIFY | pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO)
+            except:
+                notifier = None
+        try:
+            end_time = time.time() + self._timeout
+            while not self._stop.isSet() and time.time() < end_time:
+                data = self._read()
+                if data != "":
+                    yield data
+                if notifier != None:
+                    if notifier.check_events():
+                        notifier.read_events()
+                        notifier.process_events()
+                else:
+                    self._stop.wait(FOLLOW_DELAY)
+        finally:
+            self._f.close()
+            if notifier != None:
+                notifier.stop()
+
+
 if __name__ == "__main__":
     print(Tail("/tmp/tail", 5).get())
     print("----")
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Purpose
+=======
+
+Tests for the journal store of the cron jobs : no plugin is needed.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from domogik_packages.xpl.lib.cron_tools import CronStore, ERROR_NO, ERROR_STORE
+from domogik_packages.xpl.lib import journal_store
+
+JOBFILE = """[Job]
+device = job1
+devicetype = timer
+frequence = 60
+
+[Stats]
+state = started
+runs = 3
+
+[Sensor]
+status = low
+
+[Timers]
+1 = 20121224120000
+2 = 20121225120000
+"""
+
+class CronStoreTest(unittest.TestCase):
+    """ Test the cron store
+    """
+
+    def setUp(self):
+        logging.basicConfig()
+        self.log = logging.getLogger("cronstore_test")
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def load(self, store):
+        """ Return the jobs of a store
+        """
+        jobs = {}
+        def add_job(device, devicetype, data):
+            jobs[device] = data
+            return ERROR_NO
+        store.load_all(add_job)
+        return jobs
+
+    def test_migration(self):
+        """ Test the .job files are moved in the journal
+        """
+        with open(os.path.join(self.data_dir, "job1.job"), "w") as jobfile:
+            jobfile.write(JOBFILE)
+        jobs = self.load(CronStore(self.log, self.data_dir))
+        self.assertEqual(jobs["job1"]["devicetype"], "timer")
+        self.assertEqual(jobs["job1"]["runs"], "3")
+        self.assertEqual(jobs["job1"]["sensor_status"], "low")
+        self.assertEqual(jobs["job1"]["timer"], set(["20121224120000", "20121225120000"]))
+        self.assertFalse(os.path.exists(os.path.join(self.data_dir, "job1.job")))
+        self.assertEqual(self.load(CronStore(self.log, self.data_dir)), jobs)
+
+    def test_life_cycle(self):
+        """ Test start, fire, stop and halt are replayed from the journal
+        """
+        store = CronStore(self.log, self.data_dir)
+        data = {"device" : "job2", "devicetype" : "alarm", "action" : "start",
+                "alarm" : set(["20121224120000"]), "sensor_status" : "low"}
+        self.assertEqual(store.on_start("job2", data), ERROR_NO)
+        for runs in range(1, 10):
+            self.assertEqual(store.on_fire("job2", "high", 0, 0, runs), ERROR_NO)
+        self.assertEqual(store.on_fire("unknown", "high", 0, 0, 1), ERROR_STORE)
+        self.assertEqual(store.on_stop("job2", 0, 12, 9), ERROR_NO)
+        jobs = self.load(CronStore(self.log, self.data_dir))
+        self.assertEqual(jobs["job2"]["state"], "stopped")
+        self.assertEqual(jobs["job2"]["runs"], "9")
+        self.assertEqual(jobs["job2"]["sensor_status"], "high")
+        self.assertEqual(jobs["job2"]["alarm"], set(["20121224120000"]))
+        self.assertFalse("action" in jobs["job2"])
+        self.assertEqual(store.on_halt("job2"), ERROR_NO)
+        self.assertEqual(self.load(CronStore(self.log, self.data_dir)), {})
+
+    def test_compaction(self):
+        """ Test the journal is compacted and a truncated line is dropped
+        """
+        store = CronStore(self.log, self.data_dir)
+        store.on_start("job3", {"device" : "job3", "devicetype" : "interval"})
+        for runs in range(journal_store.COMPACT_MIN * 2):
+            store.on_stop("job3", 0, 0, runs)
+        filename = os.path.join(self.data_dir, "jobs.journal")
+        self.assertTrue(len(open(filename).readlines()) <= journal_store.COMPACT_MIN)
+        with open(filename, "a") as journal:
+            journal.write('{"op": "upd", "key": "job3", "da')
+        jobs = self.load(CronStore(self.log, self.data_dir))
+        self.assertEqual(jobs["job3"]["runs"], str(journal_store.COMPACT_MIN * 2 - 1))
+        self.assertEqual(len(open(filename).readlines()), 1)
+
+    def test_periodic_flush(self):
+        """ Test a single update is written after the flush delay
+        """
+        filename = os.path.join(self.data_dir, "jobs.journal")
+        store = CronStore(self.log, self.data_dir,
+            backend=journal_store.JournalStore(self.log, filename, flush_delay=0.2))
+        store.on_start("job4", {"device" : "job4", "devicetype" : "interval"})
+        self.assertEqual(store.on_fire("job4", "high", 0, 0, 1), ERROR_NO)
+        self.assertNotEqual(self.load(CronStore(self.log, self.data_dir))["job4"].get("runs"), "1")
+        time.sleep(0.5)
+        self.assertEqual(self.load(CronStore(self.log, self.data_dir))["job4"]["runs"], "1")
+
+
+if __name__ == "__main__":
+    unittest.main()
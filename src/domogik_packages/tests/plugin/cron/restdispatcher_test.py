@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Purpose
+=======
+
+Tests for the dispatcher of the calls to rinor : a local http server
+stands for rinor, no plugin is needed.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import BaseHTTPServer
+import logging
+import socket
+import threading
+import time
+import unittest
+from domogik_packages.xpl.lib.cron_tools import RestDispatcher
+
+class FakeRinor(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Answer OK to /command, 500 to the other urls, with keep-alive
+    """
+    protocol_version = "HTTP/1.1"
+    paths = []
+    clients = set()
+
+    def do_GET(self):
+        FakeRinor.paths.append(self.path)
+        FakeRinor.clients.add(self.client_address)
+        body = '{"status" : "OK"}'
+        self.send_response(200 if self.path.startswith("/command/") else 500)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class RestDispatcherTest(unittest.TestCase):
+    """ Test the rest dispatcher
+    """
+
+    def setUp(self):
+        logging.basicConfig()
+        FakeRinor.paths = []
+        FakeRinor.clients = set()
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), FakeRinor)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.rinor = "127.0.0.1:%s" % self.server.server_address[1]
+        self.dispatcher = RestDispatcher(logging.getLogger("restdispatcher_test"), workers=1)
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        self.server.shutdown()
+
+    def wait_for(self, job, counter, value):
+        for i in range(50):
+            if self.dispatcher.get_stats(job).get(counter) == value:
+                return
+            time.sleep(0.1)
+        self.fail("%s %s != %s" % (job, counter, self.dispatcher.get_stats(job)))
+
+    def test_dispatch(self):
+        """ Test the requests are sent on one connection and the callbacks are called
+        """
+        done = []
+        for i in range(5):
+            self.dispatcher.dispatch("job1", self.rinor, ["command", "knx", "1/2/3", 50],
+                done.append, [i])
+        self.wait_for("job1", "done", 5)
+        self.assertEqual(done, range(5))
+        self.assertEqual(FakeRinor.paths[0], "/command/knx/1%2F2%2F3/50")
+        self.assertEqual(len(FakeRinor.clients), 1)
+
+    def test_retries(self):
+        """ Test a request which can't be sent is retried then counted as failed
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        closed = "127.0.0.1:%s" % sock.getsockname()[1]
+        sock.close()
+        done = []
+        self.dispatcher.dispatch("job2", closed, ["command", "knx", "1/2/3", 50], done.append, [1])
+        self.wait_for("job2", "failed", 1)
+        self.assertEqual(self.dispatcher.get_stats("job2")["retries"], 2)
+        self.assertEqual(self.dispatcher.get_stats("job2")["errors"], 3)
+        self.assertEqual(done, [])
+
+    def test_no_retry(self):
+        """ Test a request which was sent is not retried on an error status
+        """
+        done = []
+        self.dispatcher.dispatch("job3", self.rinor, ["base", "error"], done.append, [1])
+        self.wait_for("job3", "failed", 1)
+        self.assertEqual(self.dispatcher.get_stats("job3").get("retries"), None)
+        self.assertEqual(self.dispatcher.get_stats("job3")["errors"], 1)
+        self.assertEqual(FakeRinor.paths, ["/base/error"])
+        self.assertEqual(done, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
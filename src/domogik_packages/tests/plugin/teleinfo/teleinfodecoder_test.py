@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Purpose
+=======
+
+Tests for the teleinfo decoder : recorded meter output is replayed
+through the decoder, no teleinfo modem is needed.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import unittest
+from domogik_packages.xpl.lib.teleinfo import TeleinfoDecoder
+
+# historic mode (1200 bauds), single phase meter with peak/off peak hours
+HISTORIC_FRAME = "\x02\nADCO 030928084432 B\r\nOPTARIF HC.. <\r\nISOUSC 45 ?\r" \
+                 "\nHCHC 041152807 \"\r\nHCHP 050377184 6\r\nPTEC HP..  \r" \
+                 "\nIINST 005 \\\r\nIMAX 042 E\r\nPAPP 01160 )\r\nHHPHC D /\r" \
+                 "\nMOTDETAT 000000 B\r\x03"
+
+# standard mode (9600 bauds)
+STANDARD_FRAME = "\x02\nADSC\t041876097391\tD\r\nVTIC\t02\tJ\r" \
+                 "\nDATE\tH210405194600\t\tA\r\nNGTF\t      BASE      \t<\r" \
+                 "\nEAST\t000813345\t'\r\nIRMS1\t002\t0\r\nURMS1\t233\tB\r" \
+                 "\nSINSTS\t00411\tL\r\nSMAXSN\tH210405031422\t01458\t7\r\x03"
+
+
+class TeleinfoDecoderTest(unittest.TestCase):
+    """ Test the teleinfo decoder
+    """
+
+    def setUp(self):
+        self.decoder = TeleinfoDecoder()
+
+    def test_historic(self):
+        """ Test a historic frame, the first partial frame is ignored
+        """
+        frames = self.decoder.feed(HISTORIC_FRAME[40:] + HISTORIC_FRAME)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(len(frames[0]), 11)
+        self.assertEqual(frames[0][0], {"name" : "ADCO", "value" : "030928084432", "checksum" : "B"})
+        # the checksum char can be a space
+        self.assertEqual(frames[0][5], {"name" : "PTEC", "value" : "HP..", "checksum" : " "})
+        self.assertEqual(self.decoder.corrupted, 0)
+
+    def test_standard(self):
+        """ Test a standard frame, with dated groups
+        """
+        frames = self.decoder.feed(STANDARD_FRAME)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(len(frames[0]), 9)
+        self.assertEqual(frames[0][3]["value"], "      BASE      ")
+        self.assertEqual(frames[0][8], {"name" : "SMAXSN", "date" : "H210405031422",
+                                        "value" : "01458", "checksum" : "7"})
+
+    def test_chunks(self):
+        """ Test frames given byte per byte
+        """
+        frames = []
+        for char in STANDARD_FRAME + HISTORIC_FRAME:
+            frames.extend(self.decoder.feed(char))
+        self.assertEqual([len(frame) for frame in frames], [9, 11])
+
+    def test_corrupted(self):
+        """ Test only the corrupted groups are dropped
+        """
+        # bad checksum, missing CR, control char
+        stream = HISTORIC_FRAME.replace("ISOUSC 45 ?", "ISOUSC 46 ?") \
+                               .replace("IMAX 042 E\r", "IMAX 042 E") \
+                               .replace("HHPHC D", "HHPHC \x01D")
+        frames = self.decoder.feed(stream)
+        self.assertEqual(len(frames), 1)
+        names = [group["name"] for group in frames[0]]
+        self.assertEqual(names, ["ADCO", "OPTARIF", "HCHC", "HCHP", "PTEC", "IINST", "PAPP", "MOTDETAT"])
+        self.assertEqual(self.decoder.corrupted, 3)
+
+    def test_interrupted(self):
+        """ Test an interrupted frame (EOT) is dropped
+        """
+        frames = self.decoder.feed(HISTORIC_FRAME[:50] + "\x04" + HISTORIC_FRAME)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(len(frames[0]), 11)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Purpose
+=======
+
+Tests for the velbus frame decoder : captured byte streams are replayed
+through the library, no velbus device is needed.
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+import binascii
+import logging
+import threading
+import unittest
+from domogik_packages.xpl.lib.velbus import VelbusFramer, VelbusDev
+
+# node type : VMB1RY at address 0x10
+NODE_TYPE = binascii.unhexlify("0FFB1004FF020001E004")
+# relay switch status : channel 1 on
+RELAY_STATUS = binascii.unhexlify("0FFB1008FB01000100000000E104")
+# switch status : channel 2 pressed
+SWITCH_STATUS = binascii.unhexlify("0FF8220400020000D104")
+# module type request (rtr)
+TYPE_REQUEST = binascii.unhexlify("0FFB22409404")
+
+
+class FakeDevice:
+    """ Device which returns a captured byte stream, in chunks
+    """
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    def read(self, size):
+        return self._chunks.pop(0)
+
+    def inWaiting(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class VelbusFramerTest(unittest.TestCase):
+    """ Test the velbus framer and the messages dispatch
+    """
+
+    def setUp(self):
+        self.framer = VelbusFramer()
+
+    def test_several_frames(self):
+        """ Test several frames in one read
+        """
+        frames = self.framer.feed(NODE_TYPE + RELAY_STATUS + TYPE_REQUEST)
+        self.assertEqual(frames, [NODE_TYPE, RELAY_STATUS, TYPE_REQUEST])
+        self.assertEqual(self.framer.skipped, 0)
+
+    def test_split_frames(self):
+        """ Test frames split across reads, byte per byte
+        """
+        stream = NODE_TYPE + SWITCH_STATUS
+        frames = []
+        for byte in stream:
+            frames.extend(self.framer.feed(byte))
+        self.assertEqual(frames, [NODE_TYPE, SWITCH_STATUS])
+
+    def test_resync(self):
+        """ Test garbage and invalid frames are skipped
+        """
+        bad_checksum = RELAY_STATUS[:-2] + "\x00" + RELAY_STATUS[-1]
+        stream = "\x12\x0F\x34" + bad_checksum + NODE_TYPE + "\x0F\x0F" + SWITCH_STATUS
+        self.assertEqual(self.framer.feed(stream), [NODE_TYPE, SWITCH_STATUS])
+        self.assertEqual(self.framer.skipped, 3 + len(bad_checksum) + 2)
+
+    def test_dispatch(self):
+        """ Test a captured stream is decoded in xPL messages
+        """
+        messages = []
+        def send_xpl(schema, data):
+            messages.append((schema, data))
+        logging.basicConfig()
+        dev = VelbusDev(logging.getLogger("velbusframer_test"), send_xpl, None, threading.Event())
+        dev._dev = FakeDevice([NODE_TYPE + RELAY_STATUS[:5], RELAY_STATUS[5:] + SWITCH_STATUS])
+        dev.read()
+        dev.read()
+        dev.close()
+        self.assertEqual(messages,
+            [("lighting.device", {"device" : "16", "channel" : "1", "level" : 255}),
+             ("sensor.basic", {"device" : "34", "channel" : "2", "type" : "input", "current" : "HIGH"})])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -144,6 +144,12 @@ class Cron(XplHlpPlugin):
                 "cb" : self._cron.helpers.helper_memory,
                 "desc" : "Show memory usage of variables. Experimental.",
                 "usage" : "memory",
+              },
+             "rest" :
+              {
+                "cb" : self._cron.helpers.helper_rest,
+                "desc" : "Show the counters of the calls to rinor, by job.",
+                "usage" : "rest",
               }
             }
         self.enable_helper()
@@ -114,78 +114,52 @@ class OneWireManager(XplPlugin):
             ### DS18B20 support
             if ds18b20_enabled == "True":
                 self.log.info("DS18B20 support enabled")
-                ds18b20 = threading.Thread(None, 
-                                           ComponentDs18b20, 
-                                           "ds18b20",
-                                           (self.log,
-                                            ow, 
-                                            float(ds18b20_interval), 
-                                            ds18b20_resolution,
-                                            self.send_xpl,
-                                            self.get_stop()),
-                                           {})
-                ds18b20.start()
+                ow.add_component(ComponentDs18b20(self.log,
+                                                  ow,
+                                                  float(ds18b20_interval),
+                                                  ds18b20_resolution,
+                                                  self.send_xpl))
     
             ### DS18S20 support
             if ds18s20_enabled == "True":
                 self.log.info("DS18S20 support enabled")
-                ds18s20 = threading.Thread(None, 
-                                           ComponentDs18s20, 
-                                           "ds18s20",
-                                           (self.log,
-                                            ow, 
-                                            float(ds18s20_interval), 
-                                            self.send_xpl,
-                                            self.get_stop()),
-                                           {})
-                ds18s20.start()
+                ow.add_component(ComponentDs18s20(self.log,
+                                                  ow,
+                                                  float(ds18s20_interval),
+                                                  self.send_xpl))
     
             ### DS2401 support
             if ds2401_enabled == "True":
                 self.log.info("DS2401 support enabled")
-                ds2401 = threading.Thread(None, 
-                                           ComponentDs2401, 
-                                           "ds2401",
-                                           (self.log,
-                                            ow, 
-                                            float(ds2401_interval), 
-                                            self.send_xpl,
-                                            self.get_stop()),
-                                           {})
-                ds2401.start()
+                ow.add_component(ComponentDs2401(self.log,
+                                                 ow,
+                                                 float(ds2401_interval),
+                                                 self.send_xpl))
     
             ### DS2438 support
             if ds2438_enabled == "True":
                 self.log.info("DS2438 support enabled")
-                ds2438 = threading.Thread(None, 
-                                           ComponentDs2438, 
-                                           "ds2438",
-                                           (self.log,
-                                            ow, 
-                                            float(ds2438_interval), 
-                                            self.send_xpl,
-                                            self.get_stop()),
-                                           {})
-                ds2438.start()
-    
-
+                ow.add_component(ComponentDs2438(self.log,
+                                                 ow,
+                                                 float(ds2438_interval),
+                                                 self.send_xpl))
 
             ### DS2408 support
             if ds2408_enabled == "True":
                 self.log.info("DS2408 support enabled")
-                ds2408 = threading.Thread(None,
-                                           ComponentDs2408,
-                                           "ds2408",
-                                           (self.log,
-                                            ow,
-                                            float(ds2408_interval),
-                                            self.send_xpl,
-                                            self.get_stop()),
-                                           {})
-                ds2408.start()
-
-
-
+                ow.add_component(ComponentDs2408(self.log,
+                                                 ow,
+                                                 float(ds2408_interval),
+                                                 self.send_xpl))
+
+            ### One polling thread for all the components
+            poll = threading.Thread(None,
+                                    ow.poll,
+                                    "onewire-poll",
+                                    (self.get_stop(),),
+                                    {})
+            self.register_thread(poll)
+            poll.start()
 
         except:
             self.log.error("Plugin error : stopping plugin... Trace : %s" % traceback.format_exc())
@@ -51,7 +51,7 @@ class RfxcomUsbManager(XplPlugin):
     def __init__(self):
         """ Init plugin
         """
-        XplPlugin.__init__(self, name='rfxcom')
+        XplPlugin.__init__(self, name='rfxcom', dump_cb = self.dump)
         # Get config
         #   - device
         self._config = Query(self.myxpl, self.log)
@@ -64,6 +64,7 @@ class RfxcomUsbManager(XplPlugin):
 
         # Init RFXCOM
         self.rfxcom  = RfxcomUsb(self.log, self.send_xpl, self.send_trig, self.get_stop())
+        self.add_stop_cb(self.rfxcom.stop_write)
         
         # Create a listener for all messages used by RFXCOM
         # TODO !!!!!
@@ -197,8 +198,6 @@ class RfxcomUsbManager(XplPlugin):
     def send_xpl(self, schema, data = {}):
         """ Send xPL message on network
         """
-        print("schema:%s, data:%s" % (schema, data))
-        self.log.debug("schema:%s, data:%s" % (schema, data))
         msg = XplMessage()
         msg.set_type("xpl-trig")
         msg.set_schema(schema)
@@ -206,6 +205,12 @@ class RfxcomUsbManager(XplPlugin):
             msg.add_data({key : data[key]})
         self.myxpl.send(msg)
 
+    def dump(self):
+        """ Log the RFXCOM transmit metrics
+        """
+        if hasattr(self, "rfxcom"):
+            self.log.info("RFXCOM transmit metrics : %s" % self.rfxcom.get_metrics())
+
     def send_trig(self, message):
         """ Send xpl-trig given message
             @param message : xpl-trig message
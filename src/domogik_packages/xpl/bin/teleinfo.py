@@ -40,6 +40,7 @@ from domogik.common.dmg_exceptions import XplMessageError
 from domogik.xpl.common.plugin import XplPlugin
 from domogik_packages.xpl.lib.teleinfo import Teleinfo
 from domogik_packages.xpl.lib.teleinfo import TeleinfoException
+from domogik_packages.xpl.lib.teleinfo import MODE_HISTORIC, MODE_STANDARD
 from domogik.xpl.common.queryconfig import Query
 import threading
 import re
@@ -58,13 +59,16 @@ class TeleinfoManager(XplPlugin):
         self._config = Query(self.myxpl, self.log)
         device = self._config.query('teleinfo', 'device')
         interval = self._config.query('teleinfo', 'interval')
+        mode = self._config.query('teleinfo', 'mode')
+        if mode not in (MODE_HISTORIC, MODE_STANDARD):
+            mode = MODE_HISTORIC
 
         # Init Teleinfo
         teleinfo  = Teleinfo(self.log, self.send_xpl)
         
         # Open Teleinfo modem
         try:
-            teleinfo.open(device)
+            teleinfo.open(device, mode)
         except TeleinfoException as err:
             self.log.error(err.value)
             print(err.value)
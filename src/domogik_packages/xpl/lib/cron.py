@@ -60,7 +60,6 @@ When updating code, run the stress test :
 import traceback
 import datetime
 import time
-import urllib2
 import threading
 from domogik.xpl.common.xplconnector import XplTimer
 from domogik.xpl.common.xplmessage import XplMessage
@@ -68,10 +67,10 @@ from apscheduler.scheduler import Scheduler
 from domogik_packages.xpl.lib.cron_tools import *
 from domogik_packages.xpl.lib.cron_helpers import CronHelpers
 from domogik.common.configloader import Loader
+from domogik_packages.xpl.lib.sensor_broadcaster import SensorBroadcaster
 from pympler.asizeof import asizeof
 import ast
 import logging
-from threading import Timer
 
 logging.basicConfig()
 
@@ -1614,10 +1613,13 @@ class CronAPI:
         self.rest_server_ip = conf_rest['rest_server_ip']
         self.rest_server_port = conf_rest['rest_server_port']
         self.rest = CronRest(self.rest_server_ip,self.rest_server_port,log)
-        self.helpers = CronHelpers(self.log, self.jobs)
+        self.dispatcher = RestDispatcher(log)
+        self.helpers = CronHelpers(self.log, self.jobs, self.dispatcher)
+        self.broadcaster = None
         if (self.delay_sensor > 0):
-            self.timer_stat = Timer(self.delay_sensor, self.send_sensors)
-            self.timer_stat.start()
+            self.broadcaster = SensorBroadcaster(self.log, self.myxpl, self._stop, \
+                self.get_sensors, self.delay_sensor, self.delay_stat, name="cron")
+            self.broadcaster.start()
 
     def fire_job(self, device, parameters=None, value=None):
         """
@@ -1643,45 +1645,21 @@ class CronAPI:
                 "level" in parameters and parameters["level"] != None and \
                 "valueon" in parameters["level"] and parameters["level"]["valueon"] != None :
                 level = parameters["level"]["valueon"]
-            the_url = None
+            job = self.jobs.data[device]
+            path = None
             if (value == None or value == "valueon") :
-                if self.jobs.data[device]["nst-command"]=='':
-                    the_url = 'http://%s/command/%s/%s/%s' % (
-                        self.jobs.data[device]["rinorip"]+":"+self.jobs.data[device]["rinorport"],
-                        self.jobs.data[device]["nst-techno"],
-                        self.jobs.data[device]["nst-device"],
-                        level)
-                else:
-                    the_url = 'http://%s/command/%s/%s/%s/%s' % (
-                        self.jobs.data[device]["rinorip"]+":"+self.jobs.data[device]["rinorport"],
-                        self.jobs.data[device]["nst-techno"],
-                        self.jobs.data[device]["nst-device"],
-                        self.jobs.data[device]["nst-command"],
-                        level)
+                path = [job["nst-techno"], job["nst-device"], job["nst-command"], level]
             elif (value == "valueoff"):
-                if self.jobs.data[device]["nst-command"]=='':
-                    the_url = 'http://%s/command/%s/%s/%s' % (
-                        self.jobs.data[device]["rinorip"]+":"+self.jobs.data[device]["rinorport"],
-                        self.jobs.data[device]["nst-techno"],
-                        self.jobs.data[device]["nst-device"],
-                        self.jobs.data[device]["nst-value1"])
-                else:
-                    the_url = 'http://%s/command/%s/%s/%s/%s' % (
-                        self.jobs.data[device]["rinorip"]+":"+self.jobs.data[device]["rinorport"],
-                        self.jobs.data[device]["nst-techno"],
-                        self.jobs.data[device]["nst-device"],
-                        self.jobs.data[device]["nst-command"],
-                        self.jobs.data[device]["nst-value1"])
-            if (the_url != None):
-                #We change the status of the sensors
-                req = urllib2.Request(the_url)
-                handle = urllib2.urlopen(req)
-                resp1 = handle.read()
-                self.jobs.data[device]['runs'] = int(self.jobs.data[device]['runs'])+1
-                self._send_sensor_trig(self.myxpl, device, parameters, value)
-                self.log.debug("cronAPI.fire_job : rinor called with = %s" % the_url)
+                path = [job["nst-techno"], job["nst-device"], job["nst-command"], job["nst-value1"]]
+            if (path != None):
+                if job["nst-command"] == '':
+                    del(path[2])
+                #The request is sent by the dispatcher. We change the status
+                #of the sensors when it succeeded.
+                self.dispatcher.dispatch(device, "%s:%s" % (job["rinorip"], job["rinorport"]),
+                    ["command"] + path, self._rinor_done, [device, parameters, value])
             else :
-                self.log.debug("cronAPI.fire_job : can't call rinor = %s" % the_url)
+                self.log.debug("cronAPI.fire_job : can't call rinor for value %s" % value)
         else:
             mess = self.jobs.get_xpl_trig(device, parameters, value)
             if mess != None:
@@ -1690,6 +1668,19 @@ class CronAPI:
                 self.log.debug("cronAPI.fire_job : xplmessage = %s" % mess)
         self.log.debug("cronAPI.fire_job : Done :)")
 
+    def _rinor_done(self, device, parameters, value):
+        """
+        Called by the dispatcher when rinor has been called for a job
+
+        @param device : The timer
+        @param parameters : the parameters used
+        @param value : the value
+
+        """
+        if device in self.jobs.data:
+            self.jobs.data[device]['runs'] = int(self.jobs.data[device]['runs'])+1
+            self._send_sensor_trig(self.myxpl, device, parameters, value)
+
     def request_listener(self, message):
         """
         Listen to timer.request messages
@@ -2176,52 +2167,19 @@ class CronAPI:
         mess.add_data({"current" :  self.jobs.data[device]["sensor_status"]})
         myxpl.send(mess)
 
-    def send_sensors(self):
+    def get_sensors(self):
         """
-        Send the sensors stat messages
+        Return the status of the sensors of the started jobs, for the
+        broadcaster
 
         """
         try :
-            self.log.debug("cronAPI.send_sensors : Try to acquire lock")
-            #self.jobs._jobs_lock.acquire()
-            self.log.debug("cronAPI.send_sensors : Lock acquired")
-            keys = self.jobs.data.keys()
-            for dev in keys :
-                try :
-                    wait = False
-                    self.jobs._jobs_lock.acquire()
-                    if dev in self.jobs.data :
-                        if self.jobs.data[dev]["state"] == "started":
-                            self._send_sensor_stat(self.myxpl,dev)
-                            wait = True
-                finally :
-                    self.jobs._jobs_lock.release()
-                    self.log.debug("cronAPI.send_sensors : Release lock")
-                    if wait :
-                        self._stop.wait(self.delay_stat)
-                    if self._stop.isSet() :
-                        break
+            self.jobs._jobs_lock.acquire()
+            return [(dev, self.jobs.data[dev]["sensor_status"]) \
+                for dev in self.jobs.data \
+                if self.jobs.data[dev]["state"] == "started"]
         finally :
-            #self.jobs._jobs_lock.release()
-            self.timer_stat = Timer(self.delay_sensor, self.send_sensors)
-            self.timer_stat.start()
-
-    def _send_sensor_stat(self, myxpl, device):
-        """
-        Send the XPL stat message
-
-        @param myxpl : The XPL sender
-        @param device : the device/job
-        @param value : the value of the sensor
-        @param type : the type of message (xpl-trig or xpl-stat)
-
-        """
-        mess = XplMessage()
-        mess.set_type("xpl-stat")
-        mess.set_schema("sensor.basic")
-        mess.add_data({"device" : device})
-        mess.add_data({"current" :  self.jobs.data[device]["sensor_status"]})
-        myxpl.send(mess)
+            self.jobs._jobs_lock.release()
 
     def _send_xpl_trig(self, myxpl, device, action, error, caller=None):
         """
@@ -2295,5 +2253,6 @@ class CronAPI:
         self.log.info("cronAPI.stop_all : close all jobs.")
         self.jobs.close_all()
         self.jobs.stop_scheduler()
-        if (self.delay_sensor >0):
-            self.timer_stat.cancel()
+        self.dispatcher.stop()
+        if self.broadcaster != None:
+            self.broadcaster.stop()
@@ -39,12 +39,13 @@ class CronHelpers():
     Encapsulate the helpers
     """
 
-    def __init__(self, log, jobs):
+    def __init__(self, log, jobs, dispatcher=None):
         """
         Initialise the helper class
         """
         self._log = log
         self._jobs = jobs
+        self._dispatcher = dispatcher
 
 
     def helper_list(self, params={}):
@@ -77,6 +78,23 @@ class CronHelpers():
         self._log.debug("helper_memory : Done ...")
         return data
 
+    def helper_rest(self, params={}):
+        """
+        Return the counters of the calls to the rest server.
+        """
+        self._log.debug("helper_rest : Start ...")
+        data = []
+        if self._dispatcher == None:
+            data.append("No rest dispatcher")
+        else:
+            data.append("Calls to rest : ")
+            stats = self._dispatcher.get_stats()
+            for job in sorted(stats):
+                data.append(" %s : %s" % (job, ", ".join(["%s=%s" % (key, stats[job][key]) \
+                    for key in sorted(stats[job])])))
+        self._log.debug("helper_rest : Done ...")
+        return data
+
     def helper_info(self, params={}):
         """
         Return informations on a device
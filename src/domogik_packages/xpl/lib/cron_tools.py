@@ -24,6 +24,8 @@ XPL Cron server.
 
 Implements
 ==========
+class CronRest
+class RestDispatcher
 class CronStore
 class cronTools
 
@@ -41,6 +43,12 @@ import glob
 import json
 import urllib2
 import urllib
+import httplib
+import socket
+import threading
+import time
+import Queue
+from domogik_packages.xpl.lib.journal_store import JournalStore
 
 ERROR_NO = 0
 ERROR_PARAMETER = 1
@@ -64,6 +72,18 @@ CRONERRORS = { ERROR_NO: 'No error',
                ERROR_REST: 'Error with REST.',
                }
 
+#The max number of concurrent requests to the rest server
+REST_WORKERS = 4
+#The timeout of a request to the rest server, in seconds
+REST_TIMEOUT = 10
+#The number of retries of a failed request
+REST_RETRIES = 2
+#The max idle time of a kept-alive connection, in seconds. The server may
+#close it after that and a request sent on it could not be retried
+REST_KEEPALIVE = 5
+#The max number of requests waiting for a worker
+REST_QUEUE_SIZE = 200
+
 class CronRest():
     """
     Manipulate Domogik's devices associated to the cron jobs through the rest interface
@@ -176,6 +196,199 @@ class CronRest():
         else :
             return False
 
+class RestDispatcher():
+    """
+    Call the rest server (rinor) for the jobs, out of the scheduler threads.
+
+    The requests are queued and sent by a pool of REST_WORKERS threads.
+    Each worker keeps its HTTP connections open (keep-alive) and reuses
+    them for the next requests to the same server. A request which could
+    not be sent (connection refused, closed connection...) is retried up to
+    REST_RETRIES times. A request which was sent is never retried, even on
+    a timeout or an error status : rinor may have run the command. The
+    results are counted by job.
+    """
+    def __init__(self, log, workers=REST_WORKERS, timeout=REST_TIMEOUT, \
+            retries=REST_RETRIES, queue_size=REST_QUEUE_SIZE):
+        """
+        Start the workers
+
+        @param log : the logger
+        @param workers : the max number of concurrent requests
+        @param timeout : the timeout of a request, in seconds
+        @param retries : the number of retries of a request which could not
+        be sent
+        @param queue_size : the max number of waiting requests
+
+        """
+        self._log = log
+        self._timeout = timeout
+        self._retries = retries
+        self._queue = Queue.Queue(queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = dict()
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(None, self._work, "cron-rest-%s" % i, (), {})
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+
+    def dispatch(self, job, server, path, callback=None, args=None):
+        """
+        Queue a request for a job.
+
+        @param job : the job name
+        @param server : the rest server, "ip:port"
+        @param path : the list of the elements of the url path, they are quoted
+        @param callback : the function to call when the request succeeded
+        @param args : the arguments of the callback
+        @return True if the request is queued, False if the queue is full
+
+        """
+        url = "/" + "/".join([urllib.quote(str(elt), safe='') for elt in path])
+        try:
+            self._queue.put_nowait((job, server, url, callback, args, time.time()))
+            self._count(job, "queued")
+            return True
+        except Queue.Full:
+            self._count(job, "dropped")
+            self._log.error("RestDispatcher : queue is full, request %s for job %s dropped" % \
+                (url, job))
+            return False
+
+    def stop(self):
+        """
+        Stop the workers. The waiting requests are dropped.
+
+        """
+        for worker in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except Queue.Full:
+                break
+
+    def get_stats(self, job=None):
+        """
+        Return the counters of a job, or of all the jobs.
+
+        @param job : the job name
+
+        """
+        with self._stats_lock:
+            if job is not None:
+                return dict(self._stats.get(job, {}))
+            return dict([(key, dict(val)) for key, val in self._stats.iteritems()])
+
+    def _count(self, job, counter, value=1):
+        """
+        Increment a counter of a job.
+
+        """
+        with self._stats_lock:
+            stats = self._stats.setdefault(job, dict())
+            stats[counter] = stats.get(counter, 0) + value
+
+    def _send(self, connections, server, url):
+        """
+        Send a request on a (reused) connection and return the connection.
+
+        """
+        conn = connections.get(server)
+        if conn is not None and time.time() - conn.last_used > REST_KEEPALIVE:
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = httplib.HTTPConnection(server, timeout=self._timeout)
+            connections[server] = conn
+        try:
+            conn.request("GET", url)
+            conn.last_used = time.time()
+            return conn
+        except:
+            conn.close()
+            del(connections[server])
+            raise
+
+    def _response(self, connections, server, conn):
+        """
+        Read the response of a request sent by _send().
+
+        """
+        try:
+            resp = conn.getresponse()
+            body = resp.read()
+            conn.last_used = time.time()
+            return resp.status, body
+        except:
+            conn.close()
+            del(connections[server])
+            raise
+
+    def _work(self):
+        """
+        Send the queued requests.
+
+        """
+        #The keep-alive connections of this worker, by server
+        connections = dict()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            job, server, url, callback, args, queued = item
+            self._count(job, "wait", time.time() - queued)
+            for tries in range(self._retries + 1):
+                if tries > 0:
+                    self._count(job, "retries")
+                start = time.time()
+                try:
+                    conn = self._send(connections, server, url)
+                except:
+                    #Not sent : it is safe to retry
+                    self._count(job, "errors")
+                    self._count(job, "time", time.time() - start)
+                    self._log.warning("RestDispatcher : can't send %s%s for job %s : %s" % \
+                        (server, url, job, traceback.format_exc()))
+                    continue
+                #Sent : the command may have been run, it is never retried
+                status = None
+                try:
+                    status, body = self._response(connections, server, conn)
+                except socket.timeout:
+                    self._count(job, "timeouts")
+                    self._log.warning("RestDispatcher : timeout calling %s%s for job %s" % \
+                        (server, url, job))
+                except:
+                    self._count(job, "errors")
+                    self._log.warning("RestDispatcher : error calling %s%s for job %s : %s" % \
+                        (server, url, job, traceback.format_exc()))
+                self._count(job, "time", time.time() - start)
+                if status is None:
+                    self._count(job, "failed")
+                    break
+                if status != 200:
+                    self._count(job, "errors")
+                    self._count(job, "failed")
+                    self._log.error("RestDispatcher : status %s calling %s%s for job %s" % \
+                        (status, server, url, job))
+                    break
+                self._count(job, "done")
+                self._log.debug("RestDispatcher : rinor called with %s%s" % (server, url))
+                if callback != None:
+                    try:
+                        callback(*(args or []))
+                    except:
+                        self._log.error("RestDispatcher : callback of job %s : %s" % \
+                            (job, traceback.format_exc()))
+                break
+            else:
+                self._count(job, "failed")
+                self._log.error("RestDispatcher : can't call %s%s for job %s" % \
+                    (server, url, job))
+        for conn in connections.itervalues():
+            conn.close()
+
 class PluginStoreInf():
     """
     A class to store plugin data in the file system.
@@ -463,15 +676,19 @@ class PluginStoreInf():
 
 class CronStore():
     """
-    Store the jobs in the filesystem. We use a ConfigParser file per job.
-    Sections [Job] [Stats] [Alarms] [Timers]
+    Store the jobs in an append-only journal (jobs.journal) in the data
+    directory. The statistics updated when a job is fired are batched.
+    The ConfigParser files used before (one <job>.job file per job, with
+    sections [Job] [Stats] [Alarms] [Timers]) are migrated when the journal
+    is created.
     """
-    def __init__(self, log, data_dir):
+    def __init__(self, log, data_dir, backend=None):
         """
         Initialise the store engine. Create the directory if necessary.
 
         @param log : the logger
         @param data_dir : the data directory where store the cron files
+        @param backend : the store backend, a JournalStore in data_dir by default
 
         """
         self._log = log
@@ -480,58 +697,116 @@ class CronStore():
                 self._data_files_dir)
         self._badfields = ["action", "starttime", "uptime", ]
         self._statfields = ["current", "state", "runs", "createtime", "runtime"]
+        self._listfields = ["timer", "alarm", "date"]
+        if backend is None:
+            backend = JournalStore(log, os.path.join(data_dir, "jobs.journal"))
+        self._backend = backend
+        if not self._backend.exists():
+            self._migrate()
+
+    def _read_jobfile(self, jobfile):
+        """
+        Read a job from a ConfigParser file.
+
+        @param jobfile : the file of the job
+
+        """
+        config = ConfigParser.ConfigParser()
+        config.read(jobfile)
+        data = dict()
+        for option in config.options('Job'):
+            data[option] = config.get('Job', option)
+        for option in config.options('Stats'):
+            data[option] = config.get('Stats', option)
+        if config.has_section('Sensor'):
+            for option in config.options('Sensor'):
+                data['sensor_'+option] = config.get('Sensor', option)
+        for section, key in [('Timers', 'timer'), ('Dates', 'date'), ('Alarms', 'alarm')]:
+            if config.has_section(section):
+                values = set()
+                for option in config.options(section):
+                    values.add(config.get(section, option))
+                data[key] = values
+        return data
+
+    def _migrate(self):
+        """
+        Move the jobs of the *.job files in the journal. The files are
+        renamed to *.job.migrated.
+
+        """
+        for jobfile in glob.iglob(self._data_files_dir+"/*.job") :
+            try:
+                job = os.path.basename(jobfile)[:-len(".job")]
+                self._backend.put(job, self._to_record(self._read_jobfile(jobfile)))
+                os.rename(jobfile, jobfile + ".migrated")
+                self._log.info("cronJobs.store_init : Job %s migrated from %s" % \
+                    (job, jobfile))
+            except:
+                self._log.error("cronJobs.store_init : Can't migrate %s : %s" % \
+                    (jobfile, traceback.format_exc()))
+
+    def _to_record(self, data, record=None):
+        """
+        Convert the parameters of a job to a record of the store.
+
+        @param data : a dict() containing the parameters of the job
+        @param record : the record to update
+
+        """
+        if record is None:
+            record = dict()
+        lists = dict()
+        for key in data:
+            listkey = [lkey for lkey in self._listfields if key.startswith(lkey)]
+            if len(listkey) > 0:
+                values = lists.setdefault(listkey[0], list())
+                if type(data[key])==type(""):
+                    values.append(data[key])
+                else:
+                    values.extend([str(val) for val in data[key]])
+            elif key in self._badfields:
+                continue
+            else :
+                record[key] = str(data[key])
+        record.update(lists)
+        return record
+
+    def _from_record(self, record):
+        """
+        Convert a record of the store to the parameters of a job.
+
+        @param record : the record
+
+        """
+        data = dict(record)
+        for key in self._listfields:
+            if key in data:
+                data[key] = set(data[key])
+        return data
 
     def load_all(self, add_job_cb):
         """
-        Load all jobs from the filesystem. Parse all the *.job files
-        in directory and call the callback method to add it to the cron
-        jobs.
+        Load all jobs from the store and call the callback method to add
+        them to the cron jobs.
 
         @param add_job_cb : callback to the function who add the job to CronJobs
 
         """
-        for jobfile in glob.iglob(self._data_files_dir+"/*.job") :
-            config = ConfigParser.ConfigParser()
-            config.read(jobfile)
-            self._log.debug("cronJobs.store_init : Load job from %s" % \
-                    jobfile)
-            data = dict()
-            for option in config.options('Job'):
-                data[option] = config.get('Job', option)
-            for option in config.options('Stats'):
-                data[option] = config.get('Stats', option)
-            if config.has_section('Sensor'):
-                for option in config.options('Sensor'):
-                    data['sensor_'+option] = config.get('Sensor', option)
-            if config.has_section('Timers'):
-                timers = set()
-                for option in config.options('Timers'):
-                    timers.add(config.get('Timers', option))
-                data['timer'] = timers
-            #Will be implement in the future
-            if config.has_section('Dates'):
-                timers = set()
-                for option in config.options('Dates'):
-                    timers.add(config.get('Dates', option))
-                data['date'] = timers
-            if config.has_section('Alarms'):
-                alarms = set()
-                for option in config.options('Alarms'):
-                    alarms.add(config.get('Alarms', option))
-                data['alarm'] = alarms
+        for job in self._backend.keys():
+            self._log.debug("cronJobs.store_init : Load job %s" % job)
+            data = self._from_record(self._backend.get(job))
             err = add_job_cb(data['device'], data['devicetype'], data)
             if err != ERROR_NO :
-                self._log.warning("Can't load job from %s : error=%s" % \
-                    (jobfile,CRONERRORS[err]))
+                self._log.warning("Can't load job %s : error=%s" % \
+                    (job, CRONERRORS[err]))
 
-    def _get_jobfile(self, job):
+    def count(self):
         """
-        Return the filename associated to a job.
-
-        @param job : the job name
+        Return the number of jobs in the store.
 
         """
-        return os.path.join(self._data_files_dir, job + ".job")
+        return self._backend.count()
 
     def on_start(self, job, data):
         """
@@ -545,70 +820,10 @@ class CronStore():
         try:
             self._log.debug("cronJobs.store_on_start : job %s" % \
                 job)
-            config = ConfigParser.ConfigParser()
-            if os.path.isfile(self._get_jobfile(job)):
-                #The file already exists. We are in resume case.
-                config.read(self._get_jobfile(job))
-            timer_idx = 1
-            alarm_idx = 1
-            date_idx = 1
-            if not config.has_section('Job'):
-                config.add_section('Job')
-            if not config.has_section('Stats'):
-                config.add_section('Stats')
-            for key in data:
-                if key.startswith("timer") :
-                    if not config.has_section('Timers'):
-                        config.add_section('Timers')
-                    if type(data[key])==type(""):
-                        config.set('Timers', str(timer_idx), data[key])
-                        timer_idx = timer_idx + 1
-                    else:
-                        for tim in data[key] :
-                            config.set('Timers', str(timer_idx), tim)
-                            timer_idx = timer_idx + 1
-                elif key.startswith("alarm") :
-                    if not config.has_section('Alarms'):
-                        config.add_section('Alarms')
-                    if type(data[key])==type(""):
-                        config.set('Alarms', str(alarm_idx), data[key])
-                        alarm_idx = alarm_idx + 1
-                    else:
-                        for aal in data[key] :
-                            config.set('Alarms', str(alarm_idx), aal)
-                            alarm_idx = alarm_idx + 1
-                #Will be implement in the future
-                elif key.startswith("date") :
-                    if not config.has_section('Dates'):
-                        config.add_section('Dates')
-                    if type(data[key])==type(""):
-                        config.set('Dates', str(date_idx), data[key])
-                        date_idx = date_idx + 1
-                    else:
-                        for aal in data[key] :
-                            config.set('Dates', str(date_idx), aal)
-                            date_idx = date_idx + 1
-                elif key.startswith("sensor_") :
-                    if not config.has_section('Sensor'):
-                        config.add_section('Sensor')
-                    config.set('Sensor', key[7:], data[key])
-                elif key in self._statfields:
-                    if key == "createtime":
-                        config.set('Stats', key, data[key])
-                        #We do nothing, this jobs may not be updated as the jobs where stopped
-                    else:
-                        config.set('Stats', key, data[key])
-                elif key in self._badfields:
-                    continue
-                else :
-                    config.set('Job', key, data[key])
-            if not config.has_section('Stats'):
-                config.add_section('Stats')
-            config.set('Stats', "state", "started")
-            with open(self._get_jobfile(job), 'w') \
-                    as configfile:
-                config.write(configfile)
-            configfile.close
+            #If the job already exists, we are in resume case.
+            record = self._to_record(data, self._backend.get(job))
+            record["state"] = "started"
+            self._backend.put(job, record)
             return ERROR_NO
         except:
             self._log.error("cronJobs.store_on_start : " + \
@@ -617,8 +832,8 @@ class CronStore():
 
     def on_halt(self, job):
         """
-        Must be called when a job is halted. It deletes the file
-        associated to the job.
+        Must be called when a job is halted. It deletes the job from
+        the store.
 
         @param job : the job name
 
@@ -626,14 +841,29 @@ class CronStore():
         try:
             self._log.debug("cronJobs.store_on_halt : job %s" % \
                 job)
-            if os.path.isfile(self._get_jobfile(job)):
-                os.remove(self._get_jobfile(job))
+            self._backend.delete(job)
             return ERROR_NO
         except:
             self._log.error("cronJobs.store_on_halt : " + \
                 traceback.format_exc())
             return ERROR_STORE
 
+    def _update(self, job, data, flush):
+        """
+        Update the statistics of a job.
+
+        @param job : the job name
+        @param data : a dict() containing the fields to update
+        @param flush : write the update now
+
+        """
+        if not self._backend.update(job, dict([(key, str(data[key])) for key in data])):
+            self._log.error("cronJobs.store : job %s is not in the store" % job)
+            return ERROR_STORE
+        if flush:
+            self._backend.flush()
+        return ERROR_NO
+
     def on_stop(self, job, uptime, runtime, runs):
         """
         Must be called when a job is stopped.
@@ -647,15 +877,8 @@ class CronStore():
         try:
             self._log.debug("cronJobs.store_on_stop : job %s" % \
                 job)
-            config = ConfigParser.ConfigParser()
-            config.read(self._get_jobfile(job))
-            config.set('Stats', "state", "stopped")
-            config.set('Stats', "runs", runs)
-            config.set('Stats', "runtime", runtime)
-            with open(self._get_jobfile(job), 'w') as configfile:
-                config.write(configfile)
-                configfile.close
-            return ERROR_NO
+            return self._update(job, {"state" : "stopped", "runs" : runs,
+                "runtime" : runtime}, True)
         except:
             self._log.error("cronJobs.store_on_stop : " + \
                 traceback.format_exc())
@@ -674,14 +897,7 @@ class CronStore():
         try:
             self._log.debug("cronJobs.store_on_close : job %s" % \
                 job)
-            config = ConfigParser.ConfigParser()
-            config.read(self._get_jobfile(job))
-            config.set('Stats', "runs", runs)
-            config.set('Stats', "runtime", runtime)
-            with open(self._get_jobfile(job), 'w') as configfile:
-                config.write(configfile)
-                configfile.close
-            return ERROR_NO
+            return self._update(job, {"runs" : runs, "runtime" : runtime}, True)
         except:
             self._log.error("cronJobs.store_on_close : " + \
                 traceback.format_exc())
@@ -697,7 +913,7 @@ class CronStore():
 
     def on_fire(self, job, status, uptime, runtime, runs):
         """
-        Must be called when a job is fired.
+        Must be called when a job is fired. The update is batched.
 
         @param job : the job name
         @param status : the status of the sensor associated to the job
@@ -709,14 +925,7 @@ class CronStore():
         try:
             self._log.debug("cronJobs.store_on_fire : job %s" % \
                 job)
-            config = ConfigParser.ConfigParser()
-            config.read(self._get_jobfile(job))
-            config.set('Sensor', "status", status)
-            config.set('Stats', "runs", runs)
-            with open(self._get_jobfile(job), 'w') as configfile:
-                config.write(configfile)
-                configfile.close
-            return ERROR_NO
+            return self._update(job, {"sensor_status" : status, "runs" : runs}, False)
         except:
             self._log.error("cronJobs.store_on_fire : " + \
                 traceback.format_exc())
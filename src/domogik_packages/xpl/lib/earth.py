@@ -35,7 +35,7 @@ import traceback
 import ephem
 import datetime
 import threading
-from threading import Timer
+from domogik_packages.xpl.lib.sensor_broadcaster import SensorBroadcaster
 from pympler.asizeof import asizeof
 from domogik.xpl.common.xplmessage import XplMessage
 from domogik_packages.xpl.lib.earth_tools import *
@@ -714,8 +714,8 @@ class EarthAPI:
             longitude = "5.043"
             horizon = "-6"
             pressure = 1010.0
-            self.delay_stat = 300
-            self.delay_sensor = 2
+            self.delay_stat = 2
+            self.delay_sensor = 300
             error = "Can't get configuration from XPL : %s" %  (traceback.format_exc())
             self.log.error("__init__ : " + error)
             self.log.error("Continue with default values.")
@@ -760,9 +760,11 @@ class EarthAPI:
 #        self.rest = CronRest(self.rest_server_ip,self.rest_server_port,log)
         self._zmq_reply_thread.start()
 
+        self.broadcaster = None
         if (self.delay_sensor >0):
-            self.timer_stat = Timer(self.delay_sensor, self.send_sensors)
-            self.timer_stat.start()
+            self.broadcaster = SensorBroadcaster(self.log, self.myxpl, self._stop, \
+                self.get_sensors, self.delay_sensor, self.delay_stat, name="earth")
+            self.broadcaster.start()
 
     def plugin_enabled(self,status):
         """
@@ -1381,38 +1383,21 @@ class EarthAPI:
         myxpl.send(mess)
         self.log.debug("_send_gateway : Done :)")
 
-    def send_sensors(self):
+    def get_sensors(self):
         """
-        Send the sensors stat messages
+        Return the value of the status, for the broadcaster
+
+        :returns: the list of (status, value)
+        :rtype: list
 
         """
         try :
             self._events_lock.acquire()
-            #for dev in self.jobs.data :
-            #    if self.jobs.data[dev]["current"] == "started":
-            #        self._send_sensor_stat(self.myxpl,dev)
-            #        self._stop.wait(self.delay_stat)
+            return [(status, self.events.device_status[status]["value"]) \
+                for status in self.events.get_list_status() \
+                if self.events.device_status[status]["value"] != None]
         finally :
             self._events_lock.release()
-            #self.timer_stat = Timer(self.delay_sensor, self.send_sensors)
-            #self.timer_stat.start()
-
-    def _send_sensor_stat(self, myxpl, status):
-        """
-        Send the XPL stat message
-
-        @param myxpl : The XPL sender
-        @param device : the device/job
-        @param value : the value of the sensor
-        @param type : the type of message (xpl-trig or xpl-stat)
-
-        """
-        mess = XplMessage()
-        mess.set_type("xpl-stat")
-        mess.set_schema("sensor.basic")
-        mess.add_data({"device" : status})
-        mess.add_data({"current" :  self.events.device_status[status]})
-        myxpl.send(mess)
 
     def stop_all(self):
         """
@@ -1420,8 +1405,8 @@ class EarthAPI:
         """
         self.log.info("EventAPI.stop_all : close all jobs.")
         self.plugin_enabled(False)
-        if (self.delay_sensor >0):
-            self.timer_stat.cancel()
+        if self.broadcaster != None:
+            self.broadcaster.stop()
         self.events.close_all()
         #sleep(10)
         #self._zmq_interface.close()
@@ -44,6 +44,7 @@ from random import choice
 from time import sleep
 from json import dumps, loads, JSONEncoder, JSONDecoder
 import pickle
+from domogik_packages.xpl.lib.journal_store import JournalStore
 
 ERROR_NO = 0
 ERROR_PARAMETER = 1
@@ -415,10 +416,12 @@ class EarthZmq():
 
 class EarthStore():
     """
-    Store the events in the filesystem. We use a ConfigParser file per eventype/delays.
-    Sections [Event] [Stats] [Delays]
+    Store the events in an append-only journal (events.journal) in the data
+    directory. The runs updated when an event is fired are batched.
+    The ConfigParser files used before (one file per eventype/delays, with
+    sections [Event] [Stats]) are migrated when the journal is created.
     """
-    def __init__(self, log, data_dir):
+    def __init__(self, log, data_dir, backend=None):
         """
         Initialise the store engine. Create the directory if necessary.
 
@@ -426,6 +429,8 @@ class EarthStore():
         :type log: Logger
         :param data_dir: the data directory where store the cron files
         :type data_dir: str
+        :param backend: the store backend, a JournalStore in data_dir by default
+        :type backend: JournalStore
 
         """
         self._log = log
@@ -433,70 +438,84 @@ class EarthStore():
         self._log.info("EarthStore.__init__ : Use directory %s to store events." % self._data_files_dir)
         self._badfields = ["action", "starttime", "uptime", ]
         self._statfields = ["current", "runs", "createtime", "runtime"]
+        if backend is None:
+            backend = JournalStore(log, os.path.join(data_dir, "events.journal"))
+        self._backend = backend
+        if not self._backend.exists():
+            self._migrate()
+
+    def _migrate(self):
+        """
+        Move the events of the *.evt files in the journal. The files are
+        renamed to *.evt.migrated.
+
+        """
+        for jobfile in glob.iglob(self._data_files_dir+"/*" + self._get_fileext()) :
+            try:
+                config = ConfigParser.ConfigParser()
+                config.read(jobfile)
+                data = dict()
+                for option in config.options('Event'):
+                    data[option] = config.get('Event', option)
+                for option in config.options('Stats'):
+                    data[option] = config.get('Stats', option)
+                self._backend.put(self._get_key(data['type'], data['delay']), data)
+                os.rename(jobfile, jobfile + ".migrated")
+                self._log.info("EarthStore.__init__ : Event migrated from %s" % jobfile)
+            except:
+                self._log.error("EarthStore.__init__ : Can't migrate %s : %s" % \
+                    (jobfile, traceback.format_exc()))
 
     def load_all(self, add_job_cb):
         """
-        Load all events from the filesystem. Parse all the *.ext files
-        in directory and call the callback method to add it to the earth's events.
+        Load all events from the store and call the callback method to add
+        them to the earth's events.
 
         :param add_job_cb: callback to the function who add the job to CronJobs
         :type add_job_cb: function
 
         """
-        for jobfile in glob.iglob(self._data_files_dir+"/*" + self._get_fileext()) :
-            config = ConfigParser.ConfigParser()
-            config.read(jobfile)
-            self._log.debug("EarthStore.load_all : Load event from %s" % jobfile)
-            data = dict()
-            for option in config.options('Event'):
-                data[option] = config.get('Event', option)
-            for option in config.options('Stats'):
-                data[option] = config.get('Stats', option)
-# Implement it in the future
+        for key in self._backend.keys():
+            self._log.debug("EarthStore.load_all : Load event %s" % key)
+            data = self._backend.get(key)
             err = add_job_cb(data['type'], data['delay'], data)
             if err != ERROR_NO :
-                self._log.warning("Can't load job from %s : error=%s" % \
-                    (jobfile, EARTHERRORS[err]))
+                self._log.warning("Can't load event %s : error=%s" % \
+                    (key, EARTHERRORS[err]))
 
     def count_files(self):
         """
-        Count the number of events in the data directory.
+        Count the number of events in the store.
 
-        :returns: the number of files in the directory
+        :returns: the number of events
         :rtype: int
 
         """
-        cnt = 0
-        for jobfile in glob.iglob(self._data_files_dir + "/*" + self._get_fileext()) :
-            cnt += 1
-        return cnt
+        return self._backend.count()
 
     def _get_fileext(self):
         """
-        Return the file extension associated to an event.
+        Return the file extension of the old event files.
 
-        :param event: : the event name
-        :type event: : string
-        :returns: the filename of the event
+        :returns: the file extension
         :rtype: str
 
         """
         return ".evt"
 
-    def _get_filename(self, event, delay):
+    def _get_key(self, event, delay):
         """
-        Return the filename associated to an event.
+        Return the key associated to an event.
 
         :param event: : the event name
         :type event: : string
-        :returns: the filename of the event
+        :param delay: : the delay
+        :type delay: : string
+        :returns: the key of the event in the store
         :rtype: str
 
         """
-        filename = "%s%s%s" % (event, delay, self._get_fileext())
-        #filename = filename.replace("+","p")
-        #filename = filename.replace("-","m")
-        return os.path.join(self._data_files_dir, filename )
+        return "%s%s" % (event, delay)
 
     def on_start(self, event, delay, data):
         """
@@ -513,28 +532,14 @@ class EarthStore():
         """
         try:
             self._log.debug("EarthStore.on_start : %s%s" % (event, delay))
-            config = ConfigParser.ConfigParser()
-            if os.path.isfile(self._get_filename(event, delay)):
-                #The file already exists. We are in resume case.
-                config.read(self._get_filename(event, delay))
-            #delay_idx = 1
-            #data['state'] = "started"
-            #data['starttime'] = datetime.datetime.today().strftime("%x %X")
-            if not config.has_section('Event'):
-                config.add_section('Event')
-            if not config.has_section('Stats'):
-                config.add_section('Stats')
+            #If the event already exists, we are in resume case.
+            record = self._backend.get(self._get_key(event, delay))
+            if record is None:
+                record = dict()
             for key in data:
-                if key in self._statfields:
-                    config.set('Stats', key, data[key])
-                elif key in self._badfields:
-                    pass
-                else :
-                    config.set('Event', key, data[key])
-            with open(self._get_filename(event, delay), 'w') \
-                    as configfile:
-                config.write(configfile)
-            configfile.close
+                if key not in self._badfields:
+                    record[key] = str(data[key])
+            self._backend.put(self._get_key(event, delay), record)
             return ERROR_NO
         except:
             self._log.error("EarthStore.on_start : Exception " + traceback.format_exc())
@@ -542,27 +547,45 @@ class EarthStore():
 
     def on_halt(self, event, delay):
         """
-        Must be called when a job is halted. It deletes the file
-        associated to the job.
+        Must be called when a job is halted. It deletes the event
+        from the store.
 
         :param event: : the event name
         :type event: : string
         :param delay: : the delay
         :type delay: : string
-        :param data : the parameters of the event
-        :type data : dict()
 
         """
         try:
             self._log.debug("EarthStore.on_halt : %s%s" % (event, delay))
-            filename = self._get_filename(event, delay)
-            if os.path.isfile(filename):
-                os.remove(filename)
+            self._backend.delete(self._get_key(event, delay))
             return ERROR_NO
         except:
             self._log.error("EarthStore.on_halt : " + traceback.format_exc())
             return ERROR_STORE
 
+    def _update(self, event, delay, data, flush):
+        """
+        Update the statistics of an event.
+
+        :param event: : the event name
+        :type event: : string
+        :param delay: : the delay
+        :type delay: : string
+        :param data : the fields to update
+        :type data : dict()
+        :param flush : write the update now
+        :type flush : bool
+
+        """
+        if not self._backend.update(self._get_key(event, delay), \
+                dict([(key, str(data[key])) for key in data])):
+            self._log.error("EarthStore : event %s%s is not in the store" % (event, delay))
+            return ERROR_STORE
+        if flush:
+            self._backend.flush()
+        return ERROR_NO
+
     def on_stop(self, event, delay, state, runs, runtime):
         """
         Must be called when a job is stopped.
@@ -579,15 +602,8 @@ class EarthStore():
         """
         try:
             self._log.debug("EarthStore.on_stop : %s%s" % (event, delay))
-            config = ConfigParser.ConfigParser()
-            config.read(self._get_filename(event, delay))
-            config.set('Stats', "current", state)
-            config.set('Stats', "runs", runs)
-            config.set('Stats', "runtime", runtime)
-            with open(self._get_filename(event, delay), 'w') as configfile:
-                config.write(configfile)
-                configfile.close
-            return ERROR_NO
+            return self._update(event, delay, {"current" : state, "runs" : runs,
+                "runtime" : runtime}, True)
         except:
             self._log.error("EarthStore.on_stop : " + traceback.format_exc())
             return ERROR_STORE
@@ -608,14 +624,7 @@ class EarthStore():
         """
         try:
             self._log.debug("EarthStore.on_close : event %s%s" % (event, delay))
-            config = ConfigParser.ConfigParser()
-            config.read(self._get_filename(event, delay))
-            config.set('Stats', "runs", runs)
-            config.set('Stats', "runtime", runtime)
-            with open(self._get_filename(event, delay), 'w') as configfile:
-                config.write(configfile)
-                configfile.close
-            return ERROR_NO
+            return self._update(event, delay, {"runs" : runs, "runtime" : runtime}, True)
         except:
             self._log.error("EarthStore.on_close : " + traceback.format_exc())
             return ERROR_STORE
@@ -633,7 +642,7 @@ class EarthStore():
 
     def on_fire(self, event, delay, runs):
         """
-        Must be called when a job is fired.
+        Must be called when a job is fired. The update is batched.
 
         :param event: : the event name
         :type event: : string
@@ -644,15 +653,8 @@ class EarthStore():
 
         """
         try:
-            self._log.debug("EarthStore.on_fire : job %s" % (event, delay))
-            config = ConfigParser.ConfigParser()
-            config.read(self._get_filename(event, delay))
-            config.set('Stats', "runs", runs)
-            with open(self._get_filename(event, delay), 'w') as configfile:
-                config.write(configfile)
-                configfile.close
-            return ERROR_NO
+            self._log.debug("EarthStore.on_fire : event %s%s" % (event, delay))
+            return self._update(event, delay, {"runs" : runs}, False)
         except:
             self._log.error("EarthStore.on_fire : " + traceback.format_exc())
             return ERROR_STORE
-
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+Append-only journal used to store the cron jobs and the earth events.
+
+All the records are kept in memory. Each change is appended to a journal
+file, one json line per change :
+
+  {"op": "put", "key": ..., "data": {...}}  : create or replace a record
+  {"op": "upd", "key": ..., "data": {...}}  : update some fields of a record
+  {"op": "del", "key": ...}                 : delete a record
+
+Updates (the statistics of the jobs) are batched : a timer writes them
+flush_delay seconds after the first pending one at most, and they are
+written before any put/delete or on flush().
+When the journal holds too many dead lines, it is compacted : the records
+are written to a new file which atomically replaces the journal.
+
+Implements
+==========
+class JournalStore
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+
+#Compact when the journal has more than COMPACT_RATIO lines by record
+COMPACT_RATIO = 4
+#... and at least COMPACT_MIN lines
+COMPACT_MIN = 100
+#Max delay before writing the batched updates (in seconds)
+FLUSH_DELAY = 30
+
+def _to_str(obj):
+    """
+    Convert the unicode strings returned by json to str, like the values
+    read by ConfigParser.
+
+    @param obj : the object decoded by json
+
+    """
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    elif isinstance(obj, list):
+        return [_to_str(val) for val in obj]
+    elif isinstance(obj, dict):
+        return dict((_to_str(key), _to_str(val)) for key, val in obj.iteritems())
+    return obj
+
+class JournalStore():
+    """
+    Store records (dicts of strings or lists of strings) in an append-only
+    journal file.
+    """
+    def __init__(self, log, filename, flush_delay=FLUSH_DELAY):
+        """
+        Open the journal and replay it.
+
+        @param log : the logger
+        @param filename : the journal file
+        @param flush_delay : the max delay before writing the updates
+
+        """
+        self._log = log
+        self._filename = filename
+        self._flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._records = dict()
+        #Updates not written in the journal, by key
+        self._pending = dict()
+        self._last_flush = time.time()
+        #The timer which writes the pending updates
+        self._flush_timer = None
+        self._lines = 0
+        self._exists = os.path.isfile(filename)
+        if self._exists:
+            self._replay()
+        self._journal = open(self._filename, 'a')
+
+    def exists(self):
+        """
+        Return True if the journal file existed when the store was opened.
+
+        """
+        return self._exists
+
+    def _replay(self):
+        """
+        Read the journal and rebuild the records. A truncated last line
+        (the process was killed while writing) is dropped.
+
+        """
+        bad = 0
+        with open(self._filename, 'r') as journal:
+            for line in journal:
+                self._lines += 1
+                try:
+                    entry = _to_str(json.loads(line))
+                    if entry['op'] == 'put':
+                        self._records[entry['key']] = entry['data']
+                    elif entry['op'] == 'upd':
+                        if entry['key'] in self._records:
+                            self._records[entry['key']].update(entry['data'])
+                    elif entry['op'] == 'del':
+                        self._records.pop(entry['key'], None)
+                except (ValueError, KeyError, TypeError):
+                    bad += 1
+        if bad > 0:
+            self._log.warning("JournalStore : %s invalid line(s) in %s dropped" % \
+                (bad, self._filename))
+            self._compact()
+        self._log.debug("JournalStore : %s records loaded from %s" % \
+            (len(self._records), self._filename))
+
+    def _append(self, entries):
+        """
+        Append entries to the journal.
+
+        """
+        self._journal.write("".join([json.dumps(entry) + "\n" for entry in entries]))
+        self._journal.flush()
+        self._lines += len(entries)
+        if self._lines > max(COMPACT_MIN, COMPACT_RATIO * len(self._records)):
+            self._compact()
+
+    def _write_pending(self):
+        """
+        Write the batched updates.
+
+        """
+        self._last_flush = time.time()
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if len(self._pending) == 0:
+            return
+        entries = [{'op' : 'upd', 'key' : key, 'data' : data} \
+            for key, data in self._pending.iteritems()]
+        self._pending = dict()
+        self._append(entries)
+
+    def _compact(self):
+        """
+        Write the records to a new journal and replace the old one.
+
+        """
+        tmpname = self._filename + ".tmp"
+        with open(tmpname, 'w') as journal:
+            for key, data in self._records.iteritems():
+                journal.write(json.dumps({'op' : 'put', 'key' : key, 'data' : data}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(tmpname, self._filename)
+        if hasattr(self, "_journal"):
+            self._journal.close()
+            self._journal = open(self._filename, 'a')
+        self._lines = len(self._records)
+        self._log.debug("JournalStore : %s compacted" % self._filename)
+
+    def keys(self):
+        """
+        Return the keys of the records.
+
+        """
+        with self._lock:
+            return self._records.keys()
+
+    def get(self, key):
+        """
+        Return a copy of a record, None if it does not exist.
+
+        @param key : the key of the record
+
+        """
+        with self._lock:
+            if key not in self._records:
+                return None
+            return dict(self._records[key])
+
+    def count(self):
+        """
+        Return the number of records.
+
+        """
+        return len(self._records)
+
+    def put(self, key, data):
+        """
+        Create or replace a record. Written immediately.
+
+        @param key : the key of the record
+        @param data : a dict()
+
+        """
+        with self._lock:
+            self._pending.pop(key, None)
+            self._write_pending()
+            self._records[key] = dict(data)
+            self._append([{'op' : 'put', 'key' : key, 'data' : data}])
+
+    def update(self, key, data):
+        """
+        Update some fields of a record. The update is batched with the
+        other ones.
+
+        @param key : the key of the record
+        @param data : a dict() with the fields to update
+
+        """
+        with self._lock:
+            if key not in self._records:
+                return False
+            self._records[key].update(data)
+            self._pending.setdefault(key, dict()).update(data)
+            delay = self._flush_delay - (time.time() - self._last_flush)
+            if delay <= 0:
+                self._write_pending()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(delay, self.flush)
+                self._flush_timer.setDaemon(True)
+                self._flush_timer.start()
+            return True
+
+    def delete(self, key):
+        """
+        Delete a record. Written immediately.
+
+        @param key : the key of the record
+
+        """
+        with self._lock:
+            self._pending.pop(key, None)
+            self._write_pending()
+            if key in self._records:
+                del(self._records[key])
+                self._append([{'op' : 'del', 'key' : key}])
+
+    def flush(self):
+        """
+        Write the batched updates.
+
+        """
+        with self._lock:
+            try:
+                self._write_pending()
+            except:
+                self._log.error("JournalStore.flush : " + traceback.format_exc())
+
+    def close(self):
+        """
+        Write the batched updates and close the journal.
+
+        """
+        with self._lock:
+            self._write_pending()
+            self._journal.close()
@@ -45,6 +45,15 @@ import time
 import traceback
 from threading import Event
 
+# DS18B20 resolutions (temperature9 ... temperature12 OWFS attributes)
+RESOLUTIONS = ("9", "10", "11", "12")
+# time between two enumerations of the bus, in seconds
+DISCOVERY_INTERVAL = 300
+# OWFS file which starts the conversion of all the temperature sensors
+SIMULTANEOUS_TEMPERATURE = "/simultaneous/temperature"
+# max conversion time of the temperature sensors (12 bits), in seconds
+CONVERSION_TIME = 0.75
+
 
 
 
@@ -63,12 +72,32 @@ class OneWireException(Exception):
 
 
 
+def get_msg_type(old_values, my_id, value):
+    """
+    Return xpl-trig if the value of a component changed (or is new), else xpl-stat
+    @param old_values : dict id => last value, updated with value
+    @param my_id : component id
+    @param value : value read
+    """
+    if my_id in old_values and old_values[my_id] == value:
+        my_type = "xpl-stat"
+    else:
+        my_type = "xpl-trig"
+    old_values[my_id] = value
+    return my_type
+
+
 class ComponentDs18b20:
     """
     DS18B20 support
     """
+    families = ("DS18B20",)
+    # temperature conversion : can use simultaneous conversion
+    conversion = True
+    # presence detection : needs a bus enumeration before each read
+    presence = False
 
-    def __init__(self, log, onewire, interval, resolution, callback, stop):
+    def __init__(self, log, onewire, interval, resolution, callback):
         """
         Return temperature each <interval> seconds
         @param log : log instance
@@ -76,55 +105,44 @@ class ComponentDs18b20:
         @param interval : interval between each data sent
         @param resolution : resolution of data to read
         @param callback : callback to return values
-        @param stop : threading.Event instance
         """
         self._log = log
         self.onewire = onewire
         self.interval = interval
+        if resolution not in RESOLUTIONS:
+            self._log.error("DS18B20 : bad resolution : %s. Setting resolution to 12." % resolution)
+            resolution = "12"
         self.resolution = resolution
+        self._attribute = "temperature" + resolution
         self.callback = callback
-        self.root = self.onewire.get_root()
         self.old_temp = {}
-        self._stop = stop
-        self.start_listening()
 
-    def start_listening(self):
+    def read(self, sensors):
         """ 
-        Start listening for onewire ds18b20
+        Read the ds18b20 found on the bus
+        @param sensors : list of ds18b20 sensors
         """
-        while not self._stop.isSet():
-            for comp in self.root.find(type = "DS18B20"):
-                my_id = comp.id
-                try:
-                    temperature = float(eval("comp.temperature"+self.resolution))
-                except AttributeError:
-                    error = "DS18B20 : bad resolution : %s. Setting resolution to 12 for next iterations." % self.resolution
-                    self._log.error(error)
-                    print(error)
-                    self.resolution = "12"
-
-                else:
-
-                    if my_id in self.old_temp:
-                        if temperature != self.old_temp[my_id]:
-                            my_type = "xpl-trig"
-                        else:
-                            my_type = "xpl-stat"
-                    else:
-                        my_type = "xpl-trig"
-                    self.old_temp[my_id] = temperature
-                    print("type=%s, id=%s, temp=%s" % (my_type, my_id, temperature))
-                    self.callback(my_type, {"device" : my_id,
-                                         "type" : "temp",
-                                         "current" : temperature})
-            self._stop.wait(self.interval)
+        for comp in sensors:
+            my_id = comp.id
+            try:
+                temperature = float(getattr(comp, self._attribute))
+            except (AttributeError, ValueError):
+                self._log.error("DS18B20 : error while reading value of %s" % my_id)
+            else:
+                my_type = get_msg_type(self.old_temp, my_id, temperature)
+                self.callback(my_type, {"device" : my_id,
+                                     "type" : "temp",
+                                     "current" : temperature})
 
 class ComponentDs18s20:
     """
     DS18S20 support
     """
+    families = ("DS18S20",)
+    conversion = True
+    presence = False
 
-    def __init__(self, log, onewire, interval, callback, stop):
+    def __init__(self, log, onewire, interval, callback):
         """
         Return temperature each <interval> seconds
         @param log : log instance
@@ -136,51 +154,36 @@ class ComponentDs18s20:
         self.onewire = onewire
         self.interval = interval
         self.callback = callback
-        self.root = self.onewire.get_root()
         self.old_temp = {}
-        self.resolution = 12
-        self._stop = stop
-        self.start_listening()
 
-    def start_listening(self):
+    def read(self, sensors):
         """ 
-        Start listening for onewire ds18s20
+        Read the ds18s20 found on the bus
+        @param sensors : list of ds18s20 sensors
         """
-        while not self._stop.isSet():
-            for comp in self.root.find(type = "DS18S20"):
-                my_id = comp.id
-                try:
-                    temperature = float(comp.temperature)
-                except AttributeError:
-                    error = "DS18S20 : error while reading value"
-                    self._log.error(error)
-                    print(error)
-                    self.resolution = "12"
-
-                else:
-
-                    if my_id in self.old_temp:
-                        if temperature != self.old_temp[my_id]:
-                            my_type = "xpl-trig"
-                        else:
-                            my_type = "xpl-stat"
-                    else:
-                        my_type = "xpl-trig"
-                    self.old_temp[my_id] = temperature
-                    print("type=%s, id=%s, temp=%s" % (my_type, my_id, temperature))
-                    if temperature != 85: # Temp = 85 when read error occurs - Can safely be ignored
-                        self.callback(my_type, {"device" : my_id,
-                                         "type" : "temp",
-                                         "current" : temperature})
-            self._stop.wait(self.interval)
+        for comp in sensors:
+            my_id = comp.id
+            try:
+                temperature = float(comp.temperature)
+            except (AttributeError, ValueError):
+                self._log.error("DS18S20 : error while reading value of %s" % my_id)
+            else:
+                my_type = get_msg_type(self.old_temp, my_id, temperature)
+                if temperature != 85: # Temp = 85 when read error occurs - Can safely be ignored
+                    self.callback(my_type, {"device" : my_id,
+                                     "type" : "temp",
+                                     "current" : temperature})
 
 
 class ComponentDs2401:
     """
     DS2401 support
     """
+    families = ("DS2401",)
+    conversion = False
+    presence = True
 
-    def __init__(self, log, onewire, interval, callback, stop):
+    def __init__(self, log, onewire, interval, callback):
         """
         Check component presence each <interval> seconds
         @param log : log instance
@@ -192,53 +195,42 @@ class ComponentDs2401:
         self.onewire = onewire
         self.interval = interval
         self.callback = callback
-        self.root = self.onewire.get_root()
         self.all_ds2401 = {}
-        self._stop = stop
-        self.start_listening()
 
-    def start_listening(self):
+    def read(self, sensors):
         """ 
-        Start listening for onewire ds2401
+        Check the ds2401 presence
+        @param sensors : list of ds2401 sensors found on the bus
         """
-        while not self._stop.isSet():
-            actual_ds2401 = {}
-            for comp in self.root.find(type = "DS2401"):
-                my_id = comp.id
-      
-                if my_id in self.all_ds2401:
-                    actual_ds2401[my_id] = "high"
-                    if self.all_ds2401[my_id] != "high":
-                        print("id=%s, status=high" % my_id)
-                        self.all_ds2401[my_id] = "high"
-                        self.callback("xpl-trig", {"device" : my_id,
-                                             "type" : "input",
-                                             "current" : "high"})
-                else:
-                    print("id=%s, status=high" % my_id)
-                    self.all_ds2401[my_id] = "high"
-                    actual_ds2401[my_id] = "high"
-                    self.callback("xpl-trig", {"device" : my_id,
-                                         "type" : "input",
-                                         "current" : "high"})
-
-            for comp_id in self.all_ds2401:
-                if comp_id not in actual_ds2401 and self.all_ds2401[comp_id] == "high":
-                    print("id=%s, status=low component disappeared)" % (comp_id))
-                    self.all_ds2401[my_id] = "low"
-                    self.callback("xpl-trig", {"device" : comp_id,
-                                         "type" : "input",
-                                         "current" : "low"})
-                    
-            self._stop.wait(self.interval)
+        actual_ds2401 = {}
+        for comp in sensors:
+            my_id = comp.id
+            actual_ds2401[my_id] = "high"
+            if self.all_ds2401.get(my_id) != "high":
+                self._log.debug("id=%s, status=high" % my_id)
+                self.all_ds2401[my_id] = "high"
+                self.callback("xpl-trig", {"device" : my_id,
+                                     "type" : "input",
+                                     "current" : "high"})
+
+        for comp_id in self.all_ds2401:
+            if comp_id not in actual_ds2401 and self.all_ds2401[comp_id] == "high":
+                self._log.debug("id=%s, status=low component disappeared)" % (comp_id))
+                self.all_ds2401[comp_id] = "low"
+                self.callback("xpl-trig", {"device" : comp_id,
+                                     "type" : "input",
+                                     "current" : "low"})
  
     
 class ComponentDs2438:
     """
     DS2438 support
     """
+    families = ("DS2438",)
+    conversion = False
+    presence = False
 
-    def __init__(self, log, onewire, interval, callback, stop):
+    def __init__(self, log, onewire, interval, callback):
         """
         Return temperature each <interval> seconds
         @param log : log instance
@@ -250,69 +242,46 @@ class ComponentDs2438:
         self.onewire = onewire
         self.interval = interval
         self.callback = callback
-        self.root = self.onewire.get_root()
         self.old_temp = {}
         self.old_humidity = {}
-        self._stop = stop
-        self.start_listening()
 
-    def start_listening(self):
+    def read(self, sensors):
         """ 
-        Start listening for onewire ds2438
+        Read the ds2438 found on the bus
+        @param sensors : list of ds2438 sensors
         """
-        while not self._stop.isSet():
-            for comp in self.root.find(type = "DS2438"):
-                my_id = comp.id
-                try:
-                    temperature = float(comp.temperature)
-                    humidity = float(comp.humidity)
-                    print("T=%s" % temperature)
-                    print("H=%s" % humidity)
-                except AttributeError:
-                    error = "DS2438 : error while reading value"
-                    self._log.error(error)
-                    print(error)
-
-                else:
+        for comp in sensors:
+            my_id = comp.id
+            try:
+                temperature = float(comp.temperature)
+                humidity = float(comp.humidity)
+            except (AttributeError, ValueError):
+                self._log.error("DS2438 : error while reading value of %s" % my_id)
+            else:
+                # temperature
+                my_type = get_msg_type(self.old_temp, my_id, temperature)
+                self.callback(my_type, {"device" : my_id,
+                                     "type" : "temp",
+                                     "current" : temperature})
 
-                    # temperature
-                    if my_id in self.old_temp:
-                        if temperature != self.old_temp[my_id]:
-                            my_type = "xpl-trig"
-                        else:
-                            my_type = "xpl-stat"
-                    else:
-                        my_type = "xpl-trig"
-                    self.old_temp[my_id] = temperature
-                    print("type=%s, id=%s, temp=%s" % (my_type, my_id, temperature))
-                    self.callback(my_type, {"device" : my_id,
-                                         "type" : "temp",
-                                         "current" : temperature})
-
-                    # humidity
-                    if my_id in self.old_humidity:
-                        if humidity != self.old_humidity[my_id]:
-                            my_type = "xpl-trig"
-                        else:
-                            my_type = "xpl-stat"
-                    else:
-                        my_type = "xpl-trig"
-                    self.old_humidity[my_id] = humidity
-                    print("type=%s, id=%s, humidity=%s" % (my_type, my_id, humidity))
-                    self.callback(my_type, {"device" : my_id,
-                                         "type" : "humidity",
-                                         "current" : humidity})
-            self._stop.wait(self.interval)
+                # humidity
+                my_type = get_msg_type(self.old_humidity, my_id, humidity)
+                self.callback(my_type, {"device" : my_id,
+                                     "type" : "humidity",
+                                     "current" : humidity})
 
 
 
 
 class ComponentDs2408:
     """
-    DS2408 support
+    DS2408 support (and DS2406, DS2405, DS2413)
     """
+    families = ("DS2408", "DS2406", "DS2405", "DS2413")
+    conversion = False
+    presence = False
 
-    def __init__(self, log, onewire, interval, callback, stop):
+    def __init__(self, log, onewire, interval, callback):
         """
         Return PIO state each <interval> seconds
         @param log : log instance
@@ -324,60 +293,31 @@ class ComponentDs2408:
         self.onewire = onewire
         self.interval = interval
         self.callback = callback
-        self.root = self.onewire.get_root()
         self.old_PIO_ALL = {}
-        self._stop = stop
-        self.start_listening()
-    
-    def chain(self,*iterables):
-        for it in iterables:
-            for element in it:
-                yield element
 
-    def start_listening(self):
+    def read(self, sensors):
         """
-        Start listening for onewire ds2408
+        Read the PIO of the ds2408 (and similar) found on the bus
+        @param sensors : list of sensors
         """
-        while not self._stop.isSet():
-            for comp in self.chain(self.root.find(type = "DS2408"),self.root.find(type = "DS2406"),self.root.find(type = "DS2405"),self.root.find(type = "DS2413")):
-                my_id = comp.family+"."+comp.id
-                try:
-                    if comp.family == "05":
-                        PIO_ALL = comp.PIO
-                    else:
-                        PIO_ALL = comp.PIO_ALL
-                    print("PIO.ALL=%s" % PIO_ALL)
-
-                except AttributeError:
-                    error = "DS2408 : error while reading value"
-                    self._log.error(error)
-                    print(error)
-
+        for comp in sensors:
+            my_id = comp.family+"."+comp.id
+            try:
+                if comp.family == "05":
+                    PIO_ALL = comp.PIO
                 else:
-
-                    # ALL switchs status
-                    if my_id in self.old_PIO_ALL:
-                        if PIO_ALL != self.old_PIO_ALL[my_id]:
-                            my_type = "xpl-trig"
-                        else:
-                            my_type = "xpl-stat"
-                    else:
-                        my_type = "xpl-trig"
-                    self.old_PIO_ALL[my_id] = PIO_ALL
-                    print("type=%s, id=%s, PIO_ALL=%s" % (my_type, my_id, PIO_ALL))
-                    self.callback(my_type, {"device" : my_id,
-                                         "type" : "PIO_ALL",
-                                         "data0" : getattr(comp,self.onewire.pio_map(my_id,0)),
-                                         "data1" : getattr(comp,self.onewire.pio_map(my_id,1)),
-                                         "data2" : getattr(comp,self.onewire.pio_map(my_id,2)),
-                                         "data3" : getattr(comp,self.onewire.pio_map(my_id,3)),
-                                         "data4" : getattr(comp,self.onewire.pio_map(my_id,4)),
-                                         "data5" : getattr(comp,self.onewire.pio_map(my_id,5)),
-                                         "data6" : getattr(comp,self.onewire.pio_map(my_id,6)),
-                                         "data7" : getattr(comp,self.onewire.pio_map(my_id,7)),
-                                         "current" : PIO_ALL})
-
-            self._stop.wait(self.interval)
+                    PIO_ALL = comp.PIO_ALL
+            except AttributeError:
+                self._log.error("DS2408 : error while reading value of %s" % my_id)
+            else:
+                # ALL switchs status
+                my_type = get_msg_type(self.old_PIO_ALL, my_id, PIO_ALL)
+                data = {"device" : my_id,
+                        "type" : "PIO_ALL",
+                        "current" : PIO_ALL}
+                for gpio in range(8):
+                    data["data%s" % gpio] = getattr(comp, self.onewire.pio_map(my_id, gpio))
+                self.callback(my_type, data)
 
 class OneWireNetwork:
     """
@@ -391,6 +331,13 @@ class OneWireNetwork:
         default 'u' for USB
         """
         self._log = log
+        # polled components and time of their next read
+        self._components = []
+        self._next_read = {}
+        # sensors found on the bus, by type
+        self._inventory = {}
+        self._next_discovery = 0
+        self._simultaneous = True
         self._log.info("OWFS version : %s" % ow.__version__)
         try:
             ow.init(dev)
@@ -408,6 +355,85 @@ class OneWireNetwork:
         """
         return self._root 
         
+    def add_component(self, component):
+        """
+        Add a component family to the polling
+        @param component : Component* instance
+        """
+        self._components.append(component)
+        self._next_read[component] = 0
+
+    def discover(self):
+        """
+        Enumerate the bus once and group the sensors by type
+        """
+        inventory = {}
+        for sensor in self._root.sensors():
+            inventory.setdefault(sensor.type, []).append(sensor)
+        self._inventory = inventory
+        self._next_discovery = time.time() + DISCOVERY_INTERVAL
+        self._log.debug("Sensors found on the bus : %s" % 
+                        dict((key, len(value)) for key, value in inventory.iteritems()))
+
+    def get_sensors(self, families):
+        """
+        Return the sensors of the last enumeration which are of one of the families
+        @param families : list of sensor types
+        """
+        sensors = []
+        for family in families:
+            sensors.extend(self._inventory.get(family, []))
+        return sensors
+
+    def convert_temperatures(self, stop):
+        """
+        Start the conversion of all the temperature sensors at once, and
+        wait for its end. If the simultaneous conversion is not available,
+        each sensor will do its own conversion when it is read.
+        @param stop : Event to stop waiting
+        """
+        if not self._simultaneous:
+            return
+        try:
+            ow._put(SIMULTANEOUS_TEMPERATURE, "1")
+        except:
+            self._log.warning("Simultaneous conversion not available, sensors will be converted one by one : %s" % traceback.format_exc())
+            self._simultaneous = False
+            return
+        stop.wait(CONVERSION_TIME)
+
+    def poll(self, stop):
+        """
+        Read the components at their interval until stop is set.
+        The bus is enumerated each DISCOVERY_INTERVAL seconds (or before each
+        read of a component which detects presence) and all the components
+        due at the same time are read after one temperature conversion.
+        @param stop : Event to stop the polling
+        """
+        while not stop.isSet():
+            now = time.time()
+            due = [comp for comp in self._components if self._next_read[comp] <= now]
+            if due:
+                try:
+                    if now >= self._next_discovery or [comp for comp in due if comp.presence]:
+                        self.discover()
+                    if [comp for comp in due if comp.conversion]:
+                        self.convert_temperatures(stop)
+                except:
+                    self._log.error("Error while scanning the bus : %s" % traceback.format_exc())
+                for comp in due:
+                    try:
+                        comp.read(self.get_sensors(comp.families))
+                    except:
+                        self._log.error("Error while reading %s : %s" % (comp.families, traceback.format_exc()))
+                        # the bus may have changed : enumerate it again
+                        self._next_discovery = 0
+                    self._next_read[comp] = now + comp.interval
+            if not self._components:
+                stop.wait(DISCOVERY_INTERVAL)
+            else:
+                stop.wait(max(min(self._next_read.values()) - time.time(), 0.1))
+
     def pio_map(self,device,gpio):
         
         map = ["A","B","A","B","A","B","A","B"]    # Used to map PIO_0/1 to  PIO_A/B for other devices 
@@ -42,6 +42,7 @@ from libopenzwave import PyManager
 from ozwvalue import ZWaveValueNode
 from ozwnode import ZWaveNode
 from ozwctrl import ZWaveController
+from ozwxmlfiles import Manufacturers
 from wsuiserver import BroadcastServer 
 from ozwdefs import *
 from datetime import timedelta
@@ -94,6 +95,7 @@ class OZWavemanager(threading.Thread):
         self._pyOzwlibVersion =  'Unknown'
         self._configPath = configPath
         self._userPath = userPath
+        self._manufacturers = None
         self._ready = False
         self._initFully = False
         self._ctrlActProgress = None
@@ -226,6 +228,13 @@ class OZWavemanager(threading.Thread):
         retval["error"] = ""
         return retval
         
+    def getManufacturers(self):
+        """Retourne la liste des fabricants et produits d'openzwave, lue à la première utilisation.
+            Son cache est écrit dans le répertoire user du plugin, le répertoire config d'openzwave appartient à root."""
+        if self._manufacturers is None :
+            self._manufacturers = Manufacturers(self._configPath, self._userPath, self._log)
+        return self._manufacturers
+
     def _getPyOZWLibVersion(self):
         """Renvoi les versions des librairies py-openzwave ainsi que la version d'openzwave."""
         try :
@@ -38,7 +38,11 @@ from ozwdefs import *
 import libopenzwave
 from libopenzwave import PyManager
 from xml.dom import minidom
+from xml.etree import cElementTree as ElementTree
+import cPickle
 import json
+import os
+import re
 
 
 class OZwaveConfigException(OZwaveException):
@@ -48,83 +52,161 @@ class OZwaveConfigException(OZwaveException):
         OZwaveException.__init__(self, value)
         self.msg = "OZwave XML files exception:"
 
+# Version of the manufacturers cache format
+CACHE_VERSION = 1
+CACHE_FILE = "manufacturer_specific.cache"
+# Default directory of the cache : the open-zwave config directory is owned by root
+CACHE_DIR = "/var/cache/domogik/ozwave"
+
+def _localName(tag):
+    """Return the tag of an element without its namespace"""
+    return tag.rsplit('}', 1)[-1]
+
+def _tokens(name):
+    """Return the lower case words of a name"""
+    return set(re.findall(r"[a-z0-9]+", name.lower()))
+
 class Manufacturers():
-    """Read and handle list of manufacturers and products recognized by open-zwave"""
+    """Read and handle list of manufacturers and products recognized by open-zwave.
+        The list is indexed by manufacturer id and name, by product (type, id) and by
+        the words of the product names. The indexes are saved in a cache file, rebuilt
+        when manufacturer_specific.xml changes."""
     
-    def __init__(self,  path):
-        """Read XML file manufacturer_specific.xml of open-zwave C++ lib"""
+    def __init__(self,  path, cacheDir = CACHE_DIR,  log = None):
+        """Read XML file manufacturer_specific.xml of open-zwave C++ lib, or its cache.
+            @param path : directory of the open-zwave config files
+            @param cacheDir : writable directory of the cache file, default CACHE_DIR
+            @param log : logger of the plugin, errors are printed if None"""
+        self._log = log
         self.xml_file = path + "/manufacturer_specific.xml"
-        self.xml_content = minidom.parse(self.xml_file)
-        # read xml file
-        self.manufacturers = [];
-        self.xmlns = self.xml_content.getElementsByTagName("ManufacturerSpecificData")[0].attributes.get("xmlns").value.strip()
-        print self.xmlns
-        for m in self.xml_content.getElementsByTagName("Manufacturer"):
-            item = {'id' : hex(int(m.attributes.get("id").value.strip(), 16)),  'name' : m.attributes.get("name").value.strip()}
-            products = []
-            try:
-                for p in m.getElementsByTagName("Product"):
-                    product = {"type" :  hex(int(p.attributes.get("type").value.strip(), 16)), 
-                                       "id" : hex(int(p.attributes.get("id").value.strip(), 16)), 
-                                       "name" :p.attributes.get("name").value.strip()}
-                    try:
-                        product["config"] = p.attributes.get("config").value.strip()
-                    except:
-                        pass
+        self.cache_file = os.path.join(cacheDir, CACHE_FILE)
+        stat = os.stat(self.xml_file)
+        self._xmlStamp = (stat.st_mtime, stat.st_size)
+        if not self._loadCache() :
+            self._parse()
+            self._buildIndexes()
+            self._saveCache()
+
+    def _loadCache(self):
+        """Load the manufacturers and the indexes from the cache, if it is up to date."""
+        try:
+            with open(self.cache_file, 'rb') as f:
+                data = cPickle.load(f)
+            if data['version'] != CACHE_VERSION or data['stamp'] != self._xmlStamp : return False
+            self.xmlns = data['xmlns']
+            self.manufacturers = data['manufacturers']
+            self._byId, self._byName = data['byId'], data['byName']
+            self._byType, self._byToken = data['byType'], data['byToken']
+            return True
+        except Exception:
+            return False
+
+    def _saveCache(self):
+        """Save the manufacturers and the indexes in the cache file (written atomically)."""
+        data = {'version': CACHE_VERSION, 'stamp': self._xmlStamp, 'xmlns': self.xmlns,
+                    'manufacturers': self.manufacturers, 'byId': self._byId, 'byName': self._byName,
+                    'byType': self._byType, 'byToken': self._byToken}
+        try:
+            cacheDir = os.path.dirname(self.cache_file)
+            if not os.path.isdir(cacheDir) : os.makedirs(cacheDir)
+            tmpFile = self.cache_file + ".tmp"
+            with open(tmpFile, 'wb') as f:
+                cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmpFile, self.cache_file)
+        except Exception as e:
+            # No cache, the XML file will be parsed again on next start
+            msg = "Can't write manufacturers cache %s : %s" % (self.cache_file, e)
+            if self._log : self._log.warning(msg)
+            else : print msg
+
+    def _parse(self):
+        """Read the XML file with a streaming parser."""
+        self.manufacturers = []
+        self.xmlns = ""
+        item = None
+        for event, elem in ElementTree.iterparse(self.xml_file, events=("start", "end")):
+            tag = _localName(elem.tag)
+            if event == "start" :
+                if tag == "ManufacturerSpecificData" and elem.tag.startswith("{") :
+                    self.xmlns = elem.tag[1:].split('}', 1)[0]
+                elif tag == "Manufacturer" :
+                    item = {'id' : hex(int(elem.get("id").strip(), 16)),  'name' : elem.get("name").strip()}
+                    products = []
+            elif tag == "Product" and item is not None:
+                try:
+                    product = {"type" :  hex(int(elem.get("type").strip(), 16)), 
+                                       "id" : hex(int(elem.get("id").strip(), 16)), 
+                                       "name" : elem.get("name").strip()}
+                    if elem.get("config") is not None :
+                        product["config"] = elem.get("config").strip()
                     products.append(product)
-           #         print "  -",  product
-            except:
-                pass
-            if products != [] :
-                item["products"] = products
-            self.manufacturers.append(item)
-     #  print self.manufacturers 
-        
+                except (AttributeError, ValueError):
+                    pass
+            elif tag == "Manufacturer" and item is not None:
+                if products != [] :
+                    item["products"] = products
+                self.manufacturers.append(item)
+                item = None
+                elem.clear()
+
+    def _buildIndexes(self):
+        """Build the dict indexes, products are referenced by (manufacturer index, product index)."""
+        self._byId = {}
+        self._byName = {}
+        self._byType = {}
+        self._byToken = {}
+        for mIdx, m in enumerate(self.manufacturers):
+            self._byId.setdefault(int(m['id'], 16), mIdx)
+            self._byName.setdefault(m['name'], mIdx)
+            for pIdx, p in enumerate(m.get('products', [])):
+                ref = (mIdx, pIdx)
+                self._byType.setdefault((int(p['type'], 16), int(p['id'], 16)), []).append(ref)
+                self._byType.setdefault((int(p['type'], 16), None), []).append(ref)
+                for token in _tokens(p['name']):
+                    self._byToken.setdefault(token, []).append(ref)
+
+    def _group(self, refs):
+        """Return the products of refs grouped by manufacturer, in file order."""
+        retval = []
+        last = None
+        for mIdx, pIdx in sorted(set(refs)):
+            if mIdx != last :
+                m = self.manufacturers[mIdx]
+                mf = {'id': m['id'],  'name': m['name'],  'products': []}
+                retval.append(mf)
+                last = mIdx
+            mf['products'].append(self.manufacturers[mIdx]['products'][pIdx])
+        return retval
+
     def getManufacturer(self, manufacturer):
         """Return Manufacturer and products if is recognized by name or id."""
-        retval = None
         try :
-            int(manufacturer,  16)
-            ref= 'id'
+            mIdx = self._byId.get(int(manufacturer,  16))
         except:
-            ref = 'name'
-        for m in self.manufacturers :
-            if m[ref] == manufacturer : 
-                retval = m
-                break
-        return retval
+            mIdx = self._byName.get(manufacturer)
+        if mIdx is None : return None
+        return self.manufacturers[mIdx]
     
     def searchProduct(self,  product):
-        """Return Product and Manufacturer if product is find."""
-        retval = []
-        for m in self.manufacturers:
-            mf = None
-            try:
-                for p in m['products']:
-                    if product in p['name'] :
-                        if not mf : mf = {'id': m['id'],  'name': m['name'],  'products': []}
-                        mf['products'].append(p)
-            except:
-                pass
-            if mf : retval.append(mf)
-        return retval
+        """Return Product and Manufacturer if product is find (product is a part of the product name)."""
+        words = re.findall(r"[a-z0-9]+", product.lower())
+        if words :
+            # The longest word of product is a part of a word of the product names
+            word = max(words, key = len)
+            refs = []
+            for token, tokenRefs in self._byToken.iteritems():
+                if word in token : refs.extend(tokenRefs)
+        else :
+            refs = [(mIdx, pIdx) for mIdx, m in enumerate(self.manufacturers) for pIdx in range(len(m.get('products', [])))]
+        refs = [(mIdx, pIdx) for mIdx, pIdx in refs if product in self.manufacturers[mIdx]['products'][pIdx]['name']]
+        return self._group(refs)
         
     def searchProductType(self,  type,  id = None):
         """Return Product and Manufacturer if product is find."""
-        retval = []
         type = int(type, 16)
         if id : id = int(id, 16)
-        for m in self.manufacturers:
-            mf = None
-            try:
-                for p in m['products']:
-                    if type == int(p['type'], 16) and (not id or (id == int(p['id'],  16))) :
-                        if not mf : mf = {'id': m['id'],  'name': m['name'],  'products': []}
-                        mf['products'].append(p)
-            except:
-                pass
-            if mf : retval.append(mf)
-        return retval
+        else : id = None
+        return self._group(self._byType.get((type, id), []))
         
 class networkFileConfig():
     """Read and manage open-zwave xml zwave Network composing"""
@@ -169,7 +251,7 @@ class networkFileConfig():
 
 
 if __name__ == "__main__":
-    listManufacturers = Manufacturers("/home/admdomo/python-openzwave/open-zwave/config")
+    listManufacturers = Manufacturers("/home/admdomo/python-openzwave/open-zwave/config",  "/tmp")
     print listManufacturers.getManufacturer('0x86')
     print listManufacturers.searchProduct('Thermostat')
     print '*************** searchProductType'
@@ -50,41 +50,49 @@ Implements
 
 
 import binascii
+import logging
 import serial
 import traceback
 import threading
 import time
-from Queue import Queue, Empty, Full
+from collections import deque
 
+# Transmit : delay before resending a NACKed packet
 WAIT_BETWEEN_TRIES = 1
+# max number of packets sent and waiting for their ACK/NACK
+WRITE_WINDOW = 4
+# max time to wait for the ACK/NACK of a packet, in seconds
+ACK_TIMEOUT = 5
+# max number of transmissions of a packet
+MAX_TRIES = 3
+# commands which are not replaced by a newer command for the same device
+RELATIVE_COMMANDS = ("dim", "bright", "chime")
 
 HUMIDITY_STATUS = {
-  "0x00" : "dry",
-  "0x01" : "comfort",
-  "0x02" : "normal",
-  "0x03" : "wet",
+  0x00 : "dry",
+  0x01 : "comfort",
+  0x02 : "normal",
+  0x03 : "wet",
 }
 
 FORECAST = {
-  "0x00" : "unknown",
-  "0x01" : "sunny",
-  "0x02" : "partly cloudy",
-  "0x03" : "cloudy",
-  "0x04" : "rain",
+  0x00 : "unknown",
+  0x01 : "sunny",
+  0x02 : "partly cloudy",
+  0x03 : "cloudy",
+  0x04 : "rain",
 }
 
-# TODO : add a "0" after the x ?
 THERMOSTAT_MODE = {
-  "0x0" : "heating",
-  "0x1" : "cooling",
+  0x0 : "heating",
+  0x1 : "cooling",
 }
 
-# TODO : add a "0" after the x ?
 THERMOSTAT_STATUS = {
-  "0x0" : "no status available",
-  "0x1" : "demand",
-  "0x2" : "no demand",
-  "0x3" : "initializing",
+  0x0 : "no status available",
+  0x1 : "demand",
+  0x2 : "no demand",
+  0x3 : "initializing",
 }
 
 # TODO : add a "0" after the x ?
@@ -305,6 +313,46 @@ class RfxcomException(Exception):
         return repr(self.value)
 
 
+class RfxcomFrameReader:
+    """ Split the bytes read from the RFXCOM in frames
+        A frame is a length byte followed by <length> bytes
+    """
+
+    def __init__(self):
+        """ Init object
+        """
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """ Add data read from the RFXCOM and return the complete frames
+            @param data : bytes read (may hold several frames or a part of a frame)
+            @return a list of frames (bytearray, without the length byte)
+        """
+        buf = self._buffer
+        buf.extend(data)
+        size = len(buf)
+        frames = []
+        pos = 0
+        while pos < size:
+            length = buf[pos]
+            if length == 0:
+                pos += 1
+                continue
+            end = pos + 1 + length
+            if end > size:
+                break
+            frames.append(buf[pos + 1:end])
+            pos = end
+        if pos:
+            del buf[:pos]
+        return frames
+
+    def pending(self):
+        """ Return the number of bytes waiting for the end of a frame
+        """
+        return len(self._buffer)
+
+
 class RfxcomUsb:
     """ Rfxcom Usb librairy
     """
@@ -321,12 +369,37 @@ class RfxcomUsb:
         self._cb_send_trig = cb_send_trig
         self._stop = stop
         self._rfxcom = None
-        # TODO : how to get proper value ?
+        self._reader = RfxcomFrameReader()
         self.seqnbr = 0
-
-        # Queue for writing packets to Rfxcom
-        self.write_rfx = Queue()
-        self.rfx_response = Queue()
+        self._seqnbr_lock = threading.Lock()
+
+        # packet type => function which processes it
+        self._handlers = {}
+        for name in dir(self):
+            if name.startswith("_process_") and len(name) == 11:
+                self._handlers[int(name[9:], 16)] = getattr(self, name)
+
+        # Packets to write to Rfxcom
+        # device key => packet not sent yet, and keys in arrival order
+        self._waiting = {}
+        self._waiting_order = deque()
+        # seqnbr => packet sent, waiting for its ACK/NACK
+        self._in_flight = {}
+        # NACKed or timed out packets, waiting to be sent again
+        self._retries = []
+        self._write_cond = threading.Condition()
+        self._write_stopped = False
+        self._packet_id = 0
+        self._metrics = {"sent" : 0,
+                         "acked" : 0,
+                         "nacked" : 0,
+                         "timeouts" : 0,
+                         "retries" : 0,
+                         "dropped" : 0,
+                         "coalesced" : 0,
+                         "max_queue_depth" : 0,
+                         "ack_latency_total" : 0.0,
+                         "ack_latency_max" : 0.0}
 
         # Thread to process queue
         write_process = threading.Thread(None,
@@ -362,34 +435,65 @@ class RfxcomUsb:
         """ close RFXCOM
         """
         self._log.info("Close RFXCOM")
+        self.stop_write()
         try:
             self._rfxcom.close()
         except:
             error = "Error while closing device"
             raise RfxcomException(error)
             
-    def write_packet(self, data, trig_msg):
+    def write_packet(self, data, trig_msg, device = None):
         """ Write command to rfxcom
             @param data : command without length
             @param trig_msg : xpl-trig msg to send if success
+            @param device : key of the commanded device. A packet for the
+                            same device which is not sent yet is replaced
+                            (its xpl-trig msg is not sent)
         """
         length = len(data)/2
-        packet = "%02X%s" % (length, data.upper())
-
-        # Put message in write queue
-        seqnbr = gh(packet, 2)
-        self.write_rfx.put_nowait({"seqnbr" : seqnbr, 
-                                   "packet" : packet,
-                                   "trig_msg" : trig_msg})
+        packet = binascii.unhexlify("%02X%s" % (length, data))
+        entry = {"seqnbr" : int(gh(data, 2), 16),
+                 "packet" : packet,
+                 "trig_msg" : trig_msg,
+                 "tries" : 0,
+                 "sent" : None,
+                 "retry" : None}
+
+        self._write_cond.acquire()
+        try:
+            if device is None:
+                self._packet_id += 1
+                key = self._packet_id
+            else:
+                key = device
+            entry["key"] = key
+            if key in self._waiting:
+                self._metrics["coalesced"] += 1
+                self._log.debug("Packet for %s replaced by %s" % (key, data))
+            else:
+                self._waiting_order.append(key)
+            self._waiting[key] = entry
+            depth = len(self._waiting) + len(self._retries)
+            if depth > self._metrics["max_queue_depth"]:
+                self._metrics["max_queue_depth"] = depth
+            self._write_cond.notify()
+        finally:
+            self._write_cond.release()
+
+    def stop_write(self):
+        """ Stop the write thread
+        """
+        self._write_cond.acquire()
+        try:
+            self._write_stopped = True
+            self._write_cond.notify()
+        finally:
+            self._write_cond.release()
 
     def write_daemon(self):
-        """ Write packets in queue to RFXCOM and manager errors to resend them
-            This function must be launched as a thread in backgroun
+        """ Write packets in queue to RFXCOM and manage errors to resend them
+            This function must be launched as a thread in background
  
-            How it works (actually solution 2) :
-
-            Solution 1 : 
-        
             The sequence number is not used by the transceiver so you can leave it zero if you want. But it can be used in your program to which ACK/NAK message belongs to which transmit message.
             You need to keep the messages in a buffer until they are acknowledged by an ACK. If you got a NAK you have to resend a message.
             For example:
@@ -405,55 +509,159 @@ class RfxcomUsb:
             Transmit message 2
             Received ACK 2
 
-            Solution 2 : 
-    
-            An easier way is to transmit a message and wait for the acknowledge before you transmit the next command:
-            Transmit message 1
-            Receive ACK 1
-            Transmit message 2
-            Receive NAK 2
-            Transmit message 2
-            Receive ACK 2
-            Transmit message 3
-            Receive ACK 3
+            Up to WRITE_WINDOW packets are sent without waiting for their
+            ACK. A packet is sent again WAIT_BETWEEN_TRIES seconds after a
+            NACK, or if there is no answer after ACK_TIMEOUT seconds, until it
+            has been sent MAX_TRIES times. It is not sent again if a newer
+            packet for the same device is waiting.
         """
-        print("Start write_rfx thread")
-        # To test, see RFXCOM email from 17/10/2011 at 20:22 
-        
-        # infinite
-        while not self._stop.isSet():
-
-            # Wait for a packet in the queue
-            data = self.write_rfx.get(block = True)
-            seqnbr = data["seqnbr"]
-            packet = data["packet"]
-            trig_msg = data["trig_msg"]
-            print("Get from Queue : %s > %s" % (seqnbr, packet))
-            self._log.debug("Get from Queue : %s > %s" % (seqnbr, packet))
-            self._rfxcom.write(binascii.unhexlify(packet))
-
-            # TODO : read in queue in which has been stored data readen from rfx
-            loop = True
-            while loop == True:
-                res = self.rfx_response.get(block = True)
-                if res["status"] == "NACK":
-                    self.debug.warning("Failed to write. Retry in %s : %s > %s" % (WAIT_BETWEEN_TRIES, seqnbr, packet))
-                    time.sleep(WAIT_BETWEEN_TRIES)
-                    self._rfxcom.write(binascii.unhexlify(packet))
-                else:
-                    print("Command succesfully sent")
-                    self._log.debug("Command succesfully sent")
-                    self._cb_send_trig(trig_msg)
-                    loop = False
+        self._log.info("Start write_rfx thread")
+        cond = self._write_cond
+        while True:
+            cond.acquire()
+            try:
+                if self._write_stopped or self._stop.isSet():
+                    break
+                now = time.time()
+                self._check_timeouts(now)
+                to_send = self._next_packets(now)
+                if to_send == []:
+                    cond.wait(self._next_deadline(now))
+                    continue
+            finally:
+                cond.release()
+            for entry in to_send:
+                self._log.debug("Write packet %02x : %s" % (entry["seqnbr"], binascii.hexlify(entry["packet"])))
+                try:
+                    self._rfxcom.write(entry["packet"])
+                except:
+                    self._log.error("Error while writing to RFXCOM : %s" % traceback.format_exc())
+        self._log.info("Stop write_rfx thread")
+
+    def _next_packets(self, now):
+        """ Select the packets to send now, and move them to the in flight packets
+            Must be called with self._write_cond acquired
+            @param now : current time
+        """
+        to_send = []
+        free = WRITE_WINDOW - len(self._in_flight)
+        # packets to send again first
+        idx = 0
+        while free > 0 and idx < len(self._retries):
+            entry = self._retries[idx]
+            if entry["retry"] <= now and entry["seqnbr"] not in self._in_flight:
+                del self._retries[idx]
+                self._metrics["retries"] += 1
+                to_send.append(entry)
+                free -= 1
+            else:
+                idx += 1
+        while free > 0 and self._waiting_order:
+            if self._waiting[self._waiting_order[0]]["seqnbr"] in self._in_flight:
+                # seqnbr still used by a sent packet (more than 256 packets queued)
+                break
+            entry = self._waiting.pop(self._waiting_order.popleft())
+            to_send.append(entry)
+            free -= 1
+        for entry in to_send:
+            entry["tries"] += 1
+            entry["sent"] = now
+            self._in_flight[entry["seqnbr"]] = entry
+            self._metrics["sent"] += 1
+        return to_send
+
+    def _next_deadline(self, now):
+        """ Return the time to wait for the next timeout or retry (None : no deadline)
+            Must be called with self._write_cond acquired
+        """
+        deadlines = [entry["sent"] + ACK_TIMEOUT for entry in self._in_flight.itervalues()]
+        if len(self._in_flight) < WRITE_WINDOW:
+            deadlines.extend([entry["retry"] for entry in self._retries])
+        if deadlines == []:
+            return None
+        return max(0, min(deadlines) - now)
+
+    def _check_timeouts(self, now):
+        """ Handle the packets which did not get an answer in time
+            Must be called with self._write_cond acquired
+        """
+        for seqnbr, entry in self._in_flight.items():
+            if entry["sent"] + ACK_TIMEOUT <= now:
+                del self._in_flight[seqnbr]
+                self._metrics["timeouts"] += 1
+                self._log.warning("No answer from RFXCOM for packet %02x" % seqnbr)
+                self._retry(entry, now)
+
+    def _retry(self, entry, when):
+        """ Schedule a packet to be sent again, or drop it
+            Must be called with self._write_cond acquired
+            @param entry : the packet
+            @param when : time to send it again
+        """
+        if entry["key"] in self._waiting:
+            # a newer packet will be sent for this device
+            self._metrics["coalesced"] += 1
+        elif entry["tries"] >= MAX_TRIES:
+            self._metrics["dropped"] += 1
+            self._log.error("Failed to write packet after %s tries : %s" % (entry["tries"], binascii.hexlify(entry["packet"])))
+        else:
+            entry["retry"] = when
+            self._retries.append(entry)
+
+    def _write_response(self, seqnbr, status):
+        """ Handle an ACK/NACK from RFXCOM
+            @param seqnbr : sequence number of the packet
+            @param status : ACK or NACK
+        """
+        now = time.time()
+        self._write_cond.acquire()
+        try:
+            entry = self._in_flight.pop(seqnbr, None)
+            if entry is None:
+                self._log.debug("%s for unknown packet %02x" % (status, seqnbr))
+                return
+            if status == "ACK":
+                self._metrics["acked"] += 1
+                latency = now - entry["sent"]
+                self._metrics["ack_latency_total"] += latency
+                if latency > self._metrics["ack_latency_max"]:
+                    self._metrics["ack_latency_max"] = latency
+            else:
+                self._metrics["nacked"] += 1
+                self._log.warning("Failed to write. Retry in %s : %02x > %s" % (WAIT_BETWEEN_TRIES, seqnbr, binascii.hexlify(entry["packet"])))
+                self._retry(entry, now + WAIT_BETWEEN_TRIES)
+            self._write_cond.notify()
+        finally:
+            self._write_cond.release()
+        if status == "ACK" and entry["trig_msg"] is not None:
+            self._cb_send_trig(entry["trig_msg"])
+
+    def get_metrics(self):
+        """ Return the transmit metrics
+        """
+        self._write_cond.acquire()
+        try:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = len(self._waiting) + len(self._retries)
+            metrics["in_flight"] = len(self._in_flight)
+        finally:
+            self._write_cond.release()
+        if metrics["acked"] > 0:
+            metrics["ack_latency_avg"] = metrics["ack_latency_total"] / metrics["acked"]
+        else:
+            metrics["ack_latency_avg"] = 0.0
+        del metrics["ack_latency_total"]
+        return metrics
             
     def get_seqnbr(self):
         """ Return seqnbr and then increase it
         """
-        ret = self.seqnbr
-        if ret == 255:
-            ret = 0
-        else:
-            self.seqnbr += 1
+        self._seqnbr_lock.acquire()
+        try:
+            ret = self.seqnbr
+            self.seqnbr = (ret + 1) % 256
+        finally:
+            self._seqnbr_lock.release()
         return "%02x" % ret
             
     def xplcmd_control_basic(msg_device, msg_type, msg_current):
@@ -482,53 +690,35 @@ class RfxcomUsb:
                 self.read()
         except serial.SerialException:
             error = "Error while reading rfxcom device (disconnected ?) : %s" % traceback.format_exc()
-            print(error)
             self._log.error(error)
             # TODO : raise for using self.force_leave() in bin ?
             return
 
     def read(self):
         """ Read Rfxcom device once
-            Wait for a byte. It will give message's length
-            Then, read message
+            Wait for data, then read all the bytes waiting in the device
+            and process the complete frames
         """
-        # We wait for a message (and its size)
-        data_len = self._rfxcom.read()
-        hex_data_len = binascii.hexlify(data_len)
-        int_data_len = int(hex_data_len, 16)
-        print("----------------------------")
-        self._log.debug("----------------------------")
-        print("LENGTH = %s" % int_data_len)
-        self._log.debug("LENGTH = %s" % int_data_len)
-
-        if int_data_len != 0:
-            # We read data
-            data = self._rfxcom.read(int_data_len)
-            hex_data = binascii.hexlify(data)
-            print("DATA = %s" % hex_data)
-            self._log.debug("DATA = %s" % hex_data)
-
-            # Process data
-            self._process(hex_data)
+        # block until at least one byte is available
+        data = self._rfxcom.read(self._rfxcom.inWaiting() or 1)
+        for frame in self._reader.feed(data):
+            self._process(frame)
 
 
     def _process(self, data):
         """ Process RFXCOM data
-            @param data : data read
+            @param data : frame read (bytearray, without the length byte)
         """
-        type = data[0] + data[1]
-        print("TYPE = %s" % type)
-        self._log.debug("TYPE = %s" % type)
+        handler = self._handlers.get(data[0])
+        if handler is None:
+            self._log.warning("No function for type '%02x' with data : '%s'" % (data[0], binascii.hexlify(data)))
+            return
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("Process type %02x : %s" % (data[0], binascii.hexlify(data)))
         try:
-            eval("self._process_%s('%s')" % (type, data))
-        except AttributeError:
-            warning = "No function for type '%s' with data : '%s'" % (type, data)
-            self._log.warning(warning)
-            print(warning)
+            handler(data)
         except:
-            error = "Error while processing type %s : %s" % (type, traceback.format_exc())
-            self._log.error(error)
-            print(error)
+            self._log.error("Error while processing type %02x : %s" % (data[0], traceback.format_exc()))
 
         
     def command_00(self, data):
@@ -569,28 +759,25 @@ class RfxcomUsb:
             SDK version : 2.07
             Tested : No
         """
-        subtype = gh(data, 1)
-        if subtype == "00":
-            type = "error"
-            message = "Message not used"
-        elif subtype == "01":
-            type = "response"
-        seqnbr = gh(data, 2)
-        msg = gh(data, 3)
-        if msg == "00":
+        seqnbr = "%02x" % data[2]
+        msg = data[3]
+        if data[1] == 0x00:
+            self._log.error("Error from RFXCOM : message not used (seqnbr %s)" % seqnbr)
+            return
+        if msg == 0x00:
             message = "ACK, transmit OK"
             status = "ACK"
-        elif msg == "01":
+        elif msg == 0x01:
             message = "ACK, but transmit started after 3 seconds delay anyway with RF receive data"
             status = "ACK"
-        elif msg == "02":
+        elif msg == 0x02:
             message = "NAK, transmitter did not lock on the requested transmit frequency"
             status = "NACK"
         else:
-            print("Bad response from RFXCOM : %s" % data)
-        print("%s : %s" % (status, message))
-        self.rfx_response.put_nowait({"seqnbr" : seqnbr, 
-                                      "status" : status})
+            self._log.warning("Bad response from RFXCOM : %s" % binascii.hexlify(data))
+            return
+        self._log.debug("%s : %s" % (status, message))
+        self._write_response(data[2], status)
         
 
 
@@ -634,7 +821,7 @@ class RfxcomUsb:
         cmd += "00"
         
         self._log.debug("Type x10 : write '%s'" % cmd)
-        self.write_packet(cmd, trig_msg)
+        self.write_packet(cmd, trig_msg, device_key(cmd, address, command))
 
 
     def _process_10(self, data):
@@ -645,32 +832,30 @@ class RfxcomUsb:
             Tested : No
         """
         PROTOCOL = {
-          "00" : "x10",
-          "01" : "arc",
-          "02" : "elro",
-          "03" : "waveman",
-          "04" : "chacon",
-          "05" : "impuls",
+          0x00 : "x10",
+          0x01 : "arc",
+          0x02 : "elro",
+          0x03 : "waveman",
+          0x04 : "chacon",
+          0x05 : "impuls",
         }
         CMND = {
-          "00" : "off",
-          "01" : "on",
-          "02" : "dim",
-          "03" : "bright",
-          "05" : "all_lights_off",
-          "06" : "all_lights_on",
-          "07" : "chime",
+          0x00 : "off",
+          0x01 : "on",
+          0x02 : "dim",
+          0x03 : "bright",
+          0x05 : "all_lights_off",
+          0x06 : "all_lights_on",
+          0x07 : "chime",
         }
 
-        subtype = gh(data, 1)
-        protocol = PROTOCOL[subtype]
-        seqnbr = gh(data, 2)
-        housecode = binascii.unhexlify(gh(data, 3))
-        unitcode = int(gh(data, 4), 16)
-        device = housecode + unitcode
-        cmnd = COMMAND[gh(data, 5)]
+        protocol = PROTOCOL[data[1]]
+        housecode = chr(data[3])
+        unitcode = data[4]
+        device = "%s%s" % (housecode, unitcode)
+        cmnd = CMND[data[5]]
         # no battery level
-        rssi = int(gh(data, 7)[1], 16) * 100/16 # percent
+        rssi = get_rssi(data[6])
 
         self._callback("x10.basic",
                    {"device" : device, 
@@ -730,7 +915,7 @@ class RfxcomUsb:
         cmd += "00"
         
         self._log.debug("Type x11 : write '%s'" % cmd)
-        self.write_packet(cmd, trig_msg)
+        self.write_packet(cmd, trig_msg, device_key(cmd, "%s %s" % (address, unit), command))
 
 
     def _process_11(self, data):
@@ -741,49 +926,40 @@ class RfxcomUsb:
             Tested : No
         """
         AC_CMND = {
-          "00" : "off",
-          "01" : "on",
-          "02" : "preset",
-          "03" : "off",
-          "04" : "on",
-          "05" : "Set group level",
+          0x00 : "off",
+          0x01 : "on",
+          0x02 : "preset",
+          0x03 : "off",
+          0x04 : "on",
+          0x05 : "Set group level",
         }
 
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
         # TODO : it is more complexe... see spec !!!!!!!!!!!!!!!!!!
-        id = gh(data, 3,4)
-        address = "0x%s" %(id)
-        unit_code = int(gh(data, 7), 16)
-        cmnd = gh(data, 8)
-        level = int(gh(data, 9), 16)
+        address = "0x%s" % binascii.hexlify(data[3:7])
+        unit_code = data[7]
+        cmnd = AC_CMND[data[8]]
+        level = data[9]
         # no battery : only a filler
-        #battery = int(gh(data, 7)[0], 16) * 10  # percent
-        rssi = int(gh(data, 7)[1], 16) * 100/16 # percent
+        rssi = get_rssi(data[10])
 
-        if AC_CMND[cmnd] == "preset":
+        if cmnd == "preset":
             self._callback("ac.basic",
                        {"address" : address, 
                         "unit" : unit_code,
-                        "command" : AC_CMND[cmnd],
+                        "command" : cmnd,
                         "level" : level})
         else:
             self._callback("ac.basic",
                        {"address" : address, 
                         "unit" : unit_code,
-                        "command" : AC_CMND[cmnd]})
+                        "command" : cmnd})
             # dirty fix to handle domogik 0.2 / 0.3
-            if AC_CMND[cmnd] in  ("on", "off"):
+            if cmnd in  ("on", "off"):
                 self._callback("ac.basic",
                            {"address" : address, 
                             "unit" : unit_code,
-                            "command" : "lighting2_ac_" + AC_CMND[cmnd]})
+                            "command" : "lighting2_ac_" + cmnd})
 
-        # no battery : only a filler
-        #self._callback("sensor.basic",
-        #               {"device" : address, 
-        #                "type" : "battery", 
-        #                "current" : battery})
         self._callback("sensor.basic",
                        {"device" : address, 
                         "type" : "rssi", 
@@ -826,8 +1002,8 @@ class RfxcomUsb:
         # filler + rssi : 0x00
         cmd += "00"
         
-        self._log.debug("Type x10 : write '%s'" % cmd)
-        self.write_packet(cmd, trig_msg)
+        self._log.debug("Type x12 : write '%s'" % cmd)
+        self.write_packet(cmd, trig_msg, device_key(cmd, address, command))
 
 
     def _process_12(self, data):
@@ -838,38 +1014,36 @@ class RfxcomUsb:
             Tested : No
         """
         COMMAND = {
-          "00" : "bright",
-          "08" : "dim",
-          "10" : "on",
-          "1a" : "off",
-          "1c" : "program",
-          "11" : "level1",
-          "12" : "level2",
-          "13" : "level3",
-          "14" : "level4",
-          "15" : "level5",
-          "16" : "level6",
-          "17" : "level7",
-          "18" : "level8",
-          "19" : "level9",
+          0x00 : "bright",
+          0x08 : "dim",
+          0x10 : "on",
+          0x1a : "off",
+          0x1c : "program",
+          0x11 : "level1",
+          0x12 : "level2",
+          0x13 : "level3",
+          0x14 : "level4",
+          0x15 : "level5",
+          0x16 : "level6",
+          0x17 : "level7",
+          0x18 : "level8",
+          0x19 : "level9",
         }
 
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        system = binascii.unhexlify(gh(data, 3))
-        channel = int(gh(data, 4, 2), 16)
+        system = chr(data[3])
+        channel = get_int(data, 4, 2)
         idx = 1
-        while idx < 10 and bin(channel)[-(idx)] != "1":
+        while idx < 10 and not channel & (1 << (idx - 1)):
             idx += 1
 
-        device = housecode + unitcode
-        cmnd = COMMAND[gh(data, 6)]
+        device = "%s%s" % (system, idx)
+        cmnd = COMMAND[data[6]]
         if cmnd[0:5] == "level":
             level = int(cmnd[5])*10
         else:
             level = None
         # no battery level
-        rssi = int(gh(data, 7)[1], 16) * 100/16 # percent
+        rssi = get_rssi(data[7])
 
         if level == None:
             self._callback("x10.basic",
@@ -954,7 +1128,7 @@ class RfxcomUsb:
         cmd += "00"
         
         self._log.debug("Type x18 : write '%s'" % cmd)
-        self.write_packet(cmd, trig_msg)
+        self.write_packet(cmd, trig_msg, device_key(cmd, address, command))
 
 
     def _process_18(self, data):
@@ -965,25 +1139,23 @@ class RfxcomUsb:
             Tested : No
         """
         CMND = {
-          "00" : "on",   # open
-          "01" : "off",  # close
-          "02" : "dim",  # stop
-          "03" : "all_lights_off",   #program
+          0x00 : "on",   # open
+          0x01 : "off",  # close
+          0x02 : "dim",  # stop
+          0x03 : "all_lights_off",   #program
         }
 
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        housecode = binascii.unhexlify(gh(data, 3))
-        unitcode = int(gh(data, 4), 16)
-        device = housecode + unitcode
-        cmnd = COMMAND[gh(data, 5)]
+        housecode = chr(data[3])
+        unitcode = data[4]
+        device = "%s%s" % (housecode, unitcode)
+        cmnd = CMND[data[5]]
         # no battery level
-        rssi = int(gh(data, 7)[1], 16) * 100/16 # percent
+        rssi = get_rssi(data[6])
 
         self._callback("x10.basic",
                    {"device" : device, 
                     "command" : cmnd,
-                    "protocol" : protocol})
+                    "protocol" : "harrison"})
 
         self._callback("sensor.basic",
                        {"device" : device, 
@@ -1044,7 +1216,7 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
         cmd += "00"
         
         self._log.debug("Type x20 : write '%s'" % cmd)
-        self.write_packet(cmd, trig_msg)
+        self.write_packet(cmd, trig_msg, device_key(cmd, address, command))
 
     def _process_20(self, data):
         """ Type 0x20, Security1
@@ -1053,37 +1225,34 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 4.12
             Tested : No
         """
-        COMMAND = {"00" : "normal",
-                   "01" : "normal-delayed",
-                   "02" : "alert",
-                   "03" : "alert-delayed",
-                   "04" : "motion",
-                   "05" : "motion-delayed",
-                   "06" : "panic",
-                   "07" : "end-panic",
-                   "08" : "tamper",
-                   "09" : "arm-away",
-                   "0a" : "arm-away-delayed",
-                   "0b" : "arm-home",
-                   "0c" : "arm-home-delayed",
-                   "0d" : "disarm",
+        COMMAND = {0x00 : "normal",
+                   0x01 : "normal-delayed",
+                   0x02 : "alert",
+                   0x03 : "alert-delayed",
+                   0x04 : "motion",
+                   0x05 : "motion-delayed",
+                   0x06 : "panic",
+                   0x07 : "end-panic",
+                   0x08 : "tamper",
+                   0x09 : "arm-away",
+                   0x0a : "arm-away-delayed",
+                   0x0b : "arm-home",
+                   0x0c : "arm-home-delayed",
+                   0x0d : "disarm",
                    # like for the RFXCOM Lan xPL, the lights-on|off command will only command the light1
-                   "10" : "lights-off",   # light 1
-                   "11" : "lights-on",
-                   "12" : "lights-off",   # light 2
-                   "13" : "lights-on",
-                   "14" : "dark-detected",
-                   "15" : "light-detected",
-                   "16" : "battery-low",
-                   "17" : "pair-kd101",
+                   0x10 : "lights-off",   # light 1
+                   0x11 : "lights-on",
+                   0x12 : "lights-off",   # light 2
+                   0x13 : "lights-on",
+                   0x14 : "dark-detected",
+                   0x15 : "light-detected",
+                   0x16 : "battery-low",
+                   0x17 : "pair-kd101",
                   }
 
         options = {}
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,3)
-        address = "0x%s" %(id)
-        status = COMMAND[gh(data, 6)]
+        address = "0x%s" % binascii.hexlify(data[3:6])
+        status = COMMAND[data[6]]
         if status[-8:] == "-delayed":
             cmnd = status[0:-8]
             options["delay"] = "max"
@@ -1096,8 +1265,7 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             cmnd = "alert"
             options["tamper"] = "true"
   
-        battery = int(gh(data, 7)[0], 16) * 10  # percent
-        rssi = int(gh(data, 7)[1], 16) * 100/16 # percent
+        battery, rssi = get_battery_rssi(data[7])
 
         msg = {"device" : address, 
                "command" : cmnd}
@@ -1150,23 +1318,19 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "digimax 0x%s" %(id)
-        temp = int(gh(data, 5), 16)
-        setpoint = int(gh(data, 6), 16)
-        bin_status_mode = gb(data, 7)
-        mode = THERMOSTAT_MODE[hexa(get_bit(bin_status_mode, 0))]
-        status = THERMOSTAT_STATUS[hexa(get_bit(bin_status_mode, 6, 2))]
+        address = "digimax 0x%s" % binascii.hexlify(data[3:5])
+        temp = data[5]
+        setpoint = data[6]
+        status_mode = data[7]
+        mode = THERMOSTAT_MODE[status_mode >> 7]
+        status = THERMOSTAT_STATUS[status_mode & 0x03]
         if status == "demand":
             demand = "%s_on" % mode
         elif status == "no demand":
             demand = "%s_off" % mode
         else:
             demand = None
-        battery = int(gh(data, 8)[0], 16) * 10  # percent
-        rssi = int(gh(data, 8)[1], 16) * 100/16 # percent
+        battery, rssi = get_battery_rssi(data[8])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1174,7 +1338,7 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
                         "type" : "temp", 
                         "current" : temp, 
                         "units" : "c"})
-        if subtype == "00":
+        if data[1] == 0x00:
             self._callback("sensor.basic",
                        {"device" : address, 
                         "type" : "setpoint", 
@@ -1210,20 +1374,9 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "temp%s 0x%s" %(subtype[1], id)
-        temp_high = gh(data, 5)
-        temp_low = gh(data, 6)
-        # first bit = 1 => sign = "-"
-        if (int(temp_high, 16) & 0b1000000) == 0b10000000:
-            temp = - float((int(temp_low, 16) + 256*(int(bin(temp_high, 16)) & 0b01111111)))/10
-        # first bit = 0 => sign = "+"
-        else:
-            temp = float((int(temp_high, 16) * 256 + int(temp_low, 16)))/10            
-        battery = int(gh(data, 7)[0], 16) * 10  # percent
-        rssi = int(gh(data, 7)[1], 16) * 100/16 # percent
+        address = "temp%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        temp = get_temp(data[5], data[6])
+        battery, rssi = get_battery_rssi(data[7])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1248,15 +1401,10 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 4.8
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "h%s 0x%s" %(subtype[1], id)
-        humidity = int(gh(data, 5), 16) 
-        humidity_status_code = ghexa(data, 6)
-        humidity_status = HUMIDITY_STATUS[humidity_status_code]
-        battery = int(gh(data, 7)[0], 16) * 10  # percent
-        rssi = int(gh(data, 8)[1], 16) * 100/16 # percent
+        address = "h%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        humidity = data[5]
+        humidity_status = HUMIDITY_STATUS[data[6]]
+        battery, rssi = get_battery_rssi(data[7])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1285,25 +1433,11 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "th%s 0x%s" %(subtype[1], id)
-        temp_high = gh(data, 5)
-        temp_low = gh(data, 6)
-        
-        # first bit = 1 => sign = "-"
-        if (int(temp_high, 16) & 0b1000000) == 0b10000000:
-            temp = - float((int(temp_low, 16) + 256*(int(bin(temp_high, 16)) & 0b01111111)))/10
-        # first bit = 0 => sign = "+"
-        else:
-            temp = float((int(temp_high, 16) * 256 + int(temp_low, 16)))/10
-            
-        humidity = int(gh(data, 7), 16) 
-        humidity_status_code = ghexa(data, 8)
-        humidity_status = HUMIDITY_STATUS[humidity_status_code]
-        battery = int(gh(data, 9)[0], 16) * 10  # percent
-        rssi = int(gh(data, 9)[1], 16) * 100/16 # percent
+        address = "th%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        temp = get_temp(data[5], data[6])
+        humidity = data[7]
+        humidity_status = HUMIDITY_STATUS[data[8]]
+        battery, rssi = get_battery_rssi(data[9])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1349,26 +1483,12 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "thb%s 0x%s" %(subtype[1], id)
-        temp_high = gh(data, 5)
-        temp_low = gh(data, 6)
-        # first bit = 1 => sign = "-"
-        if (int(temp_high, 16) & 0b1000000) == 0b10000000:
-            temp = - float((int(temp_low, 16) + 256*(int(bin(temp_high, 16)) & 0b01111111)))/10
-        # first bit = 0 => sign = "+"
-        else:
-            temp = float((int(temp_high, 16) * 256 + int(temp_low, 16)))/10
-        humidity = int(gh(data, 7), 16) 
-        humidity_status_code = ghexa(data, 8)
-        humidity_status = HUMIDITY_STATUS[humidity_status_code]
-        pressure = int(gh(data, 9, 2), 16)
-        forecast_code = ghexa(data, 11)
-        forecast = FORECAST[forecast_code]
-        battery = int(gh(data, 12)[0], 16) * 10  # percent
-        rssi = int(gh(data, 12)[1], 16) * 100/16 # percent
+        address = "thb%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        temp = get_temp(data[5], data[6])
+        humidity = data[7]
+        pressure = get_int(data, 9, 2)
+        forecast = FORECAST[data[11]]
+        battery, rssi = get_battery_rssi(data[12])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1403,16 +1523,12 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "rain%s 0x%s" %(subtype[1], id)
-        rain = int(gh(data, 5, 2), 16)
-        if subtype == "02":
+        address = "rain%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        rain = get_int(data, 5, 2)
+        if data[1] == 0x02:
             rain = 100 * rain
-        rain_total = int(gh(data, 7, 3), 16)
-        battery = int(gh(data, 10)[0], 16) * 10  # percent
-        rssi = int(gh(data, 10)[1], 16) * 100/16 # percent
+        rain_total = get_int(data, 7, 3)
+        battery, rssi = get_battery_rssi(data[10])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1442,15 +1558,11 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "wind%s 0x%s" %(subtype[1], id)
-        direction = int(gh(data, 5, 2), 16)
-        av_speed = float(int(gh(data, 7, 2), 16)) / 10
-        gust = float(int(gh(data, 9, 2), 16)) / 10
-        battery = int(gh(data, 11)[0], 16) * 10  # percent
-        rssi = int(gh(data, 11)[1], 16) * 100/16 # percent
+        address = "wind%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        direction = get_int(data, 5, 2)
+        av_speed = float(get_int(data, 7, 2)) / 10
+        gust = float(get_int(data, 9, 2)) / 10
+        battery, rssi = get_battery_rssi(data[11])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1484,13 +1596,9 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "uv%s 0x%s" %(subtype[1], id)
-        uv = int(gh(data, 5, 1), 16)
-        battery = int(gh(data, 6)[0], 16) * 10  # percent
-        rssi = int(gh(data, 6)[1], 16) * 100/16 # percent
+        address = "uv%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        uv = data[5]
+        battery, rssi = get_battery_rssi(data[6])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1528,16 +1636,12 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "elec1 0x%s" %(id)
-        count = int(gh(data, 5, 1), 16)
-        ch1 = float(int(gh(data, 6, 2), 16)) / 10
-        ch2 = float(int(gh(data, 8, 2), 16)) / 10
-        ch3 = float(int(gh(data, 10, 2), 16)) / 10
-        battery = int(gh(data, 12)[0], 16) * 10  # percent
-        rssi = int(gh(data, 12)[1], 16) * 100/16 # percent
+        address = "elec1 0x%s" % binascii.hexlify(data[3:5])
+        count = data[5]
+        ch1 = float(get_int(data, 6, 2)) / 10
+        ch2 = float(get_int(data, 8, 2)) / 10
+        ch3 = float(get_int(data, 10, 2)) / 10
+        battery, rssi = get_battery_rssi(data[12])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1569,15 +1673,11 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "elec2 0x%s" %(id)
-        count = int(gh(data, 5, 1), 16)
-        instant = float(int(gh(data, 6, 4), 16)) / 1000
-        total = int(gh(data, 10, 6), 16)
-        battery = int(gh(data, 16)[0], 16) * 10  # percent
-        rssi = int(gh(data, 16)[1], 16) * 100/16 # percent
+        address = "elec2 0x%s" % binascii.hexlify(data[3:5])
+        count = data[5]
+        instant = float(get_int(data, 6, 4)) / 1000
+        total = get_int(data, 10, 6)
+        battery, rssi = get_battery_rssi(data[16])
  
         # send xPL
         self._callback("sensor.basic",
@@ -1615,19 +1715,15 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
             SDK version : 2.06
             Tested : No
         """
-        subtype = gh(data, 1)
-        seqnbr = gh(data, 2)
-        id = gh(data, 3,2)
-        address = "weight%s 0x%s" %(subtype[1], id)
-        weight = int(gh(data, 5, 2), 16)
-        battery = int(gh(data, 7)[0], 16) * 10  # percent
-        rssi = int(gh(data, 7)[1], 16) * 100/16 # percent
+        address = "weight%x 0x%s" % (data[1], binascii.hexlify(data[3:5]))
+        weight = get_int(data, 5, 2)
+        battery, rssi = get_battery_rssi(data[7])
  
         # send xPL
         self._callback("sensor.basic",
                        {"device" : address, 
                         "type" : "weight", 
-                        "current" : instant, 
+                        "current" : weight, 
                         "units" : "kg"})
         self._callback("sensor.basic",
                        {"device" : address, 
@@ -1637,7 +1733,7 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
                        {"device" : address, 
                         "type" : "rssi", 
                         "current" : rssi})
-    
+
 
     def _process_70(self, data):
         """ RFXsensor
@@ -1672,33 +1768,45 @@ So to make it simple you can always use subtype=0x00 for an X10 sec command.
 
 
 
+def device_key(cmd, address, command):
+    """ Return the key used to replace a command waiting to be sent by a
+        newer command for the same device, or None if the command must not
+        be replaced (relative commands like dim or bright)
+        @param cmd : packet (type and subtype are used)
+        @param address : device address
+        @param command : command name
+    """
+    if command.lower() in RELATIVE_COMMANDS:
+        return None
+    return "%s %s" % (cmd[0:4], address)
+
 def gh(data, num, len = 1):
     """ Get byte n° <num> from data to byte n° <num + len> in hexadecimal without 0x....
     """
     return data[num*2:(num+(len-1))*2+2]
 
-def ghexa(data, num, len = 1):
-    """ Get byte n° <num> from data to byte n° <num + len> in hexadecimal with 0x...
+def get_int(data, num, len = 1):
+    """ Get the integer stored (big endian) in bytes n° <num> to n° <num + len> of a frame
     """
-    return "0x" + data[num*2:(num+(len-1))*2+2]
+    value = 0
+    for byte in data[num:num + len]:
+        value = (value << 8) | byte
+    return value
 
-def gb(data, num):
-    """ Get byte n° <num> from data to byte n° <num + len> in binary
+def get_temp(high, low):
+    """ Get a temperature (°C) from its 2 bytes (first bit = 1 => sign = "-")
     """
-    return bin(int(data[num*2:(num)*2+2], 16))
+    temp = float(((high & 0x7F) << 8) | low) / 10
+    if high & 0x80:
+        return -temp
+    return temp
 
-def get_bit(bin_data, num, len = 1):
-    """ Get bit n° <num> from bin data to bin n° <num + len>
-        Return result in binary
+def get_battery_rssi(byte):
+    """ Get battery and rssi levels (percent) from the battery/rssi byte
     """
-    num = num + 2 #in order to avoir "0b..."
-    return '0b' + bin_data[num:(num+(len-1))+1]
+    return (byte >> 4) * 10, (byte & 0x0F) * 100/16
 
-def hexa(bin_data):
-    """ Return hexadecimal value for bin data
-        This is a shorcut function
+def get_rssi(byte):
+    """ Get rssi level (percent) from the filler/rssi byte
     """
-    return hex(int(bin_data, 2))
-    
-#def bin(s):
-#    return str(s) if s<=1 else bin(s>>1) + str(s&1)
+    return (byte & 0x0F) * 100/16
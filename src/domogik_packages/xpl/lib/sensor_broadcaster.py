@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+""" This file is part of B{Domogik} project (U{http://www.domogik.org}).
+
+License
+=======
+
+B{Domogik} is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+B{Domogik} is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Domogik. If not, see U{http://www.gnu.org/licenses}.
+
+Plugin purpose
+==============
+Periodic broadcast of the status of the sensors of a plugin (cron jobs,
+earth status) in sensor.basic xpl-stat messages.
+
+Each cycle, the status of all the sensors is read at once through a
+callback. The messages are then sent under a token bucket rate limit :
+one message each delay_stat seconds on average, with bursts of at most
+burst messages. The broadcaster runs in one thread for the plugin.
+
+Implements
+==========
+class TokenBucket
+class SensorBroadcaster
+
+@author: Domogik project
+@copyright: (C) 2007-2012 Domogik project
+@license: GPL(v3)
+@organization: Domogik
+"""
+
+import threading
+import time
+import traceback
+from domogik.xpl.common.xplmessage import XplMessage
+
+#The max number of messages sent without waiting
+BURST = 5
+
+class TokenBucket():
+    """
+    A token bucket rate limiter.
+    """
+    def __init__(self, rate, burst):
+        """
+        Create a full bucket.
+
+        @param rate : the number of tokens added by second
+        @param burst : the size of the bucket
+
+        """
+        self._rate = float(rate)
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+
+    def _refill(self):
+        """
+        Add the tokens since the last call.
+
+        """
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def delay(self):
+        """
+        Return the time to wait before a token is available.
+
+        """
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def take(self, stop):
+        """
+        Wait for a token and take it.
+
+        @param stop : Event to stop waiting
+        @return False if stop is set
+
+        """
+        wait = self.delay()
+        while wait > 0 and not stop.isSet():
+            stop.wait(wait)
+            wait = self.delay()
+        if stop.isSet():
+            return False
+        self._tokens -= 1
+        return True
+
+class SensorBroadcaster():
+    """
+    Send the status of the sensors of a plugin, periodically and at a
+    limited rate.
+    """
+    def __init__(self, log, myxpl, stop, snapshot_cb, delay_sensor, delay_stat, \
+            burst=BURST, name="sensors"):
+        """
+        Init the broadcaster
+
+        @param log : the logger
+        @param myxpl : the xpl sender
+        @param stop : the stop Event of the plugin
+        @param snapshot_cb : callback returning the list of (device, current)
+        to send. It is called once by cycle
+        @param delay_sensor : the delay between two cycles, in seconds
+        @param delay_stat : the average delay between two messages, in seconds
+        @param burst : the max number of messages sent without waiting
+        @param name : the name of the thread
+
+        """
+        self._log = log
+        self._myxpl = myxpl
+        self._stop = stop
+        self._snapshot_cb = snapshot_cb
+        self._delay_sensor = delay_sensor
+        if delay_stat > 0:
+            self._bucket = TokenBucket(1.0 / delay_stat, burst)
+        else:
+            self._bucket = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(None, self._run, "%s-broadcast" % name, (), {})
+        self._thread.setDaemon(True)
+        self.cycles = 0
+        self.sent = 0
+
+    def start(self):
+        """
+        Start the broadcast
+
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the broadcast
+
+        """
+        self._stopped.set()
+
+    def _is_stopped(self):
+        """
+        Return True if the broadcaster or the plugin are stopped
+
+        """
+        return self._stopped.isSet() or self._stop.isSet()
+
+    def _send(self, device, current):
+        """
+        Send a sensor.basic stat message
+
+        """
+        mess = XplMessage()
+        mess.set_type("xpl-stat")
+        mess.set_schema("sensor.basic")
+        mess.add_data({"device" : device})
+        mess.add_data({"current" : current})
+        self._myxpl.send(mess)
+        self.sent += 1
+
+    def broadcast(self):
+        """
+        Send one cycle of messages
+
+        """
+        items = self._snapshot_cb()
+        for device, current in items:
+            if self._bucket != None and not self._bucket.take(self._stopped):
+                break
+            if self._stop.isSet():
+                break
+            self._send(device, current)
+        self.cycles += 1
+        self._log.debug("SensorBroadcaster : %s status sent" % len(items))
+
+    def _run(self):
+        """
+        Send the messages each delay_sensor seconds
+
+        """
+        next_cycle = time.time() + self._delay_sensor
+        while not self._is_stopped():
+            self._stopped.wait(max(next_cycle - time.time(), 0))
+            if self._is_stopped():
+                break
+            next_cycle = time.time() + self._delay_sensor
+            try:
+                self.broadcast()
+            except:
+                self._log.error("SensorBroadcaster : " + traceback.format_exc())
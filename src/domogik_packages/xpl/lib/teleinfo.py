@@ -26,7 +26,8 @@ Téléinfo technology support
 Implements
 ==========
 
-- TeleInfo
+- TeleinfoDecoder
+- Teleinfo
 
 @author: Maxence Dunnewind <maxence@dunnewind.net>
 @copyright: (C) 2007-2012 Domogik project
@@ -38,6 +39,30 @@ import time
 import traceback
 from threading import Event
 
+# modes : "historic" (1200 bauds, groups separated by spaces) or
+# "standard" (9600 bauds, groups separated by tabs, with optional date)
+MODE_HISTORIC = "historic"
+MODE_STANDARD = "standard"
+BAUDRATES = {MODE_HISTORIC : 1200,
+             MODE_STANDARD : 9600}
+# max time to wait for data on the serial device, in seconds
+READ_TIMEOUT = 1
+
+STX = "\x02"   # start of frame
+ETX = "\x03"   # end of frame
+EOT = "\x04"   # frame interrupted
+LF = "\x0a"    # start of group
+CR = "\x0d"    # end of group
+SP = "\x20"    # historic separator
+HT = "\x09"    # standard separator
+# max size of a group (label, date, value, checksum and separators)
+MAX_GROUP_SIZE = 64
+
+# decoder states
+WAIT_FRAME = 0
+WAIT_GROUP = 1
+IN_GROUP = 2
+
 class TeleinfoException(Exception):
     """
     Teleinfo exception
@@ -51,6 +76,96 @@ class TeleinfoException(Exception):
         return repr(self.value)
 
 
+class TeleinfoDecoder:
+    """ Decode the bytes sent by the electric meter in frames
+        The bytes can be given in chunks of any size. A corrupted group is
+        dropped, the other groups of the frame are kept.
+        Both modes (historic and standard) are decoded : the mode of each
+        group is given by its separator.
+    """
+
+    def __init__(self):
+        """ Init object
+        """
+        self._state = WAIT_FRAME
+        self._frame = []
+        self._group = []
+        # sum of the group bytes
+        self._sum = 0
+        # number of dropped groups
+        self.corrupted = 0
+
+    def feed(self, data):
+        """ Decode bytes read from the electric meter
+            @param data : bytes read
+            @return list of complete frames : each frame is a list of dict
+            {name, value, checksum} (and date for dated standard groups)
+        """
+        frames = []
+        state = self._state
+        for char in data:
+            if state == IN_GROUP:
+                if char == CR:
+                    self._end_group()
+                    state = WAIT_GROUP
+                    continue
+                if char >= SP or char == HT:
+                    if len(self._group) < MAX_GROUP_SIZE:
+                        self._group.append(char)
+                        self._sum += ord(char)
+                        continue
+                # control char or group too long : go to the next group
+                self.corrupted += 1
+                state = WAIT_GROUP
+            if char == STX:
+                self._frame = []
+                state = WAIT_GROUP
+            elif state == WAIT_FRAME:
+                continue
+            elif char == LF:
+                self._group = []
+                self._sum = 0
+                state = IN_GROUP
+            elif char == ETX:
+                if self._frame != []:
+                    frames.append(self._frame)
+                self._frame = []
+                state = WAIT_FRAME
+            elif char == EOT:
+                self._frame = []
+                state = WAIT_FRAME
+        self._state = state
+        return frames
+
+    def _end_group(self):
+        """ Check the current group and add it to the frame
+        """
+        group = self._group
+        if len(group) < 4:
+            self.corrupted += 1
+            return
+        checksum = group[-1]
+        separator = group[-2]
+        if separator == HT:
+            # standard : the checksum includes the last separator
+            computed = ((self._sum - ord(checksum)) & 0x3F) + 0x20
+        elif separator == SP:
+            computed = ((self._sum - ord(checksum) - 0x20) & 0x3F) + 0x20
+        else:
+            self.corrupted += 1
+            return
+        if computed != ord(checksum):
+            self.corrupted += 1
+            return
+        fields = "".join(group[:-2]).split(separator)
+        if len(fields) == 2:
+            self._frame.append({"name" : fields[0], "value" : fields[1], "checksum" : checksum})
+        elif len(fields) == 3 and separator == HT:
+            self._frame.append({"name" : fields[0], "date" : fields[1], "value" : fields[2], "checksum" : checksum})
+        else:
+            self.corrupted += 1
+
+
 class Teleinfo:
     """ Fetch teleinformation datas and call user callback
     each time all data are collected
@@ -66,16 +181,20 @@ class Teleinfo:
         self._callback = callback
         self._ser = None
         self._stop = Event()
+        self._decoder = TeleinfoDecoder()
+        self._corrupted = 0
 
 
-    def open(self, device):
+    def open(self, device, mode = MODE_HISTORIC):
         """ open teleinfo modem device
             @param device : teleinfo device path
+            @param mode : historic (1200 bauds) or standard (9600 bauds)
         """
         try:
-            self._log.info("Try to open Teleinfo modem '%s'" % device)
-            self._ser = serial.Serial(device, 1200, bytesize=7, 
-                                      parity = 'E',stopbits=1)
+            self._log.info("Try to open Teleinfo modem '%s' (%s mode)" % (device, mode))
+            self._ser = serial.Serial(device, BAUDRATES[mode], bytesize=7, 
+                                      parity = 'E',stopbits=1,
+                                      timeout = READ_TIMEOUT)
             self._log.info("Teleinfo modem successfully opened")
         except:
             error = "Error opening Teleinfo modem '%s' : %s" %  \
@@ -91,14 +210,20 @@ class Teleinfo:
 
     def listen(self, interval):
         """ Start the main loop
-            @param interval : time between each read
+            The data are read and decoded continuously (so that the frames
+            are always up to date), but the callback is called at most once
+            per interval
+            @param interval : min time between each call of the callback
         """
+        last_call = 0
         try:
             while not self._stop.isSet():
-                frame = self.read()
-                self._log.debug("Frame received : %s" % frame)
-                self._callback(frame)
-                self._stop.wait(interval)
+                for frame in self._read_frames():
+                    now = time.time()
+                    if now - last_call >= interval:
+                        last_call = now
+                        self._log.debug("Frame received : %s" % frame)
+                        self._callback(frame)
         except serial.SerialException as e:
             if self._stop.isSet():
                 pass
@@ -107,76 +232,21 @@ class Teleinfo:
 
     def read(self):
         """ Fetch one full frame for serial port
-        If some part of the frame is corrupted,
-        it waits until th enext one, so if you have corruption issue,
-        this method can take time but it enures that the frame returned is valid
+        The corrupted groups are dropped
         @return frame : list of dict {name, value, checksum}
         """
-        #Get the begin of the frame, marked by \x02
-        resp = self._ser.readline()
-        is_ok = False
-        frame = []
-        while not is_ok:
-            try:
-                while '\x02' not in resp:
-                    resp = self._ser.readline()
-                #\x02 is in the last line of a frame, so go until the next one
-                self._log.debug("* Begin frame")
-                resp = self._ser.readline()
-                #A new frame starts
-                #\x03 is the end of the frame
-                while '\x03' not in resp:
-                    #Don't use strip() here because the checksum can be ' '
-                    if len(resp.replace('\r','').replace('\n','').split()) == 2:
-                        #The checksum char is ' '
-                        name, value = resp.replace('\r','').replace('\n','').split()
-                        checksum = ' '
-                    else:
-                        name, value, checksum = resp.replace('\r','').replace('\n','').split()
-                        self._log.debug("name : %s, value : %s, checksum : %s" % (name, value, checksum))
-                    if self._is_valid(resp, checksum):
-                        frame.append({"name" : name, "value" : value, "checksum" : checksum})
-                    else:
-                        self._log.debug("** FRAME CORRUPTED !")
-                        #This frame is corrupted, we need to wait until the next one
-                        frame = []
-                        while '\x02' not in resp:
-                            resp = self._ser.readline()
-                        self._log.debug("* New frame after corrupted")
-                    resp = self._ser.readline()
-                #\x03 has been detected, that's the last line of the frame
-                if len(resp.replace('\r','').replace('\n','').split()) == 2:
-                    self._log.debug("* End frame")
-                    #The checksum char is ' '
-                    name, value = resp.replace('\r','').replace('\n','').replace('\x02','').replace('\x03','').split()
-                    checksum = ' '
-                else:
-                    name, value, checksum = resp.replace('\r','').replace('\n','').replace('\x02','').replace('\x03','').split()
-                if self._is_valid(resp, checksum):
-                    frame.append({"name" : name, "value" : value, "checksum" : checksum})
-                    self._log.debug("* End frame, is valid : %s" % frame)
-                    is_ok = True
-                else:
-                    self._log.debug("** Last frame invalid")
-                    resp = self._ser.readline()
-            except ValueError:
-                #Badly formatted frame
-                #This frame is corrupted, we need to wait until the next one
-                frame = []
-                while '\x02' not in resp:
-                    resp = self._ser.readline()
-        return frame
-
-    def _is_valid(self, frame, checksum):
-        """ Check if a frame is valid
-        @param frame : the full frame
-        @param checksum : the frame checksum
+        frames = []
+        while frames == []:
+            frames = self._read_frames()
+        return frames[0]
+
+    def _read_frames(self):
+        """ Read the waiting bytes (or wait for data) and decode them
+        @return list of complete frames
         """
-        self._log.debug("Check checksum : f = %s, chk = %s" % (frame, checksum))
-        datas = ' '.join(frame.split()[0:2])
-        my_sum = 0
-        for cks in datas:
-            my_sum = my_sum + ord(cks)
-        computed_checksum = ( my_sum & int("111111", 2) ) + 0x20
-        self._log.debug("computed_checksum = %s" % chr(computed_checksum))
-        return chr(computed_checksum) == checksum
+        data = self._ser.read(self._ser.inWaiting() or 1)
+        frames = self._decoder.feed(data)
+        if self._decoder.corrupted != self._corrupted:
+            self._log.debug("%s corrupted groups dropped" % (self._decoder.corrupted - self._corrupted))
+            self._corrupted = self._decoder.corrupted
+        return frames
@@ -41,8 +41,9 @@ from ctypes.util import find_library
 import platform
 import threading
 from collections import deque
+import heapq
+import time
 import traceback
-from threading import Timer
 from domogik.xpl.common.xplmessage import XplMessage
 from pympler.asizeof import asizeof
 from domogik_packages.xpl.lib.lightplugin import MEMORY_LIGHTING_SCENE
@@ -120,6 +121,7 @@ MEMORY_RTIMER = 6
 MEMORY_STIMER = 7
 MEMORY_ACK = 8
 MEMORY_LAST = 9
+MEMORY_TIMERS = 10
 
 DEVICEEVENTLOCK = threading.Lock()
 SENSOREVENTLOCK = threading.Lock()
@@ -176,6 +178,239 @@ class TelldusException(Exception):
         '''
         return repr(self.value)
 
+class TelldusTimer:
+    '''
+    A timer scheduled by a TimerScheduler.
+    It has the same interface than threading.Timer : start() and cancel().
+    '''
+    __slots__ = ('when', 'seq', 'delay', 'function', 'args', 'active', '_scheduler')
+
+    def __init__(self, scheduler, delay, function, args):
+        '''
+        Init the timer
+        '''
+        self._scheduler = scheduler
+        self.delay = delay
+        self.function = function
+        self.args = args
+        self.when = None
+        self.seq = None
+        self.active = False
+
+    def start(self):
+        '''
+        Schedule the timer
+        '''
+        self._scheduler.start(self)
+
+    def cancel(self):
+        '''
+        Cancel the timer. The timer stays in the heap until its
+        deadline but will not be fired.
+        '''
+        self._scheduler.cancel(self)
+
+class TimerScheduler:
+    '''
+    Run all the timers of the plugin in one thread.
+    The timers are stored in a heap ordered by deadline : start is
+    O(log n), cancel is O(1) (the cancelled timers are dropped when they
+    reach the top of the heap).
+    @param log : a logger
+    '''
+    def __init__(self, log):
+        '''
+        Init the scheduler and start its thread
+        '''
+        self.log = log
+        self._heap = []
+        self._pending = 0
+        self._count = 0
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(None, self._run, "telldus-timers", (), {})
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def timer(self, delay, function, args=None):
+        '''
+        Create a timer. It must be started with start().
+        '''
+        if args is None:
+            args = []
+        return TelldusTimer(self, delay, function, args)
+
+    def schedule(self, delay, function, args=None):
+        '''
+        Create and start a timer.
+        '''
+        timer = self.timer(delay, function, args)
+        self.start(timer)
+        return timer
+
+    def start(self, timer):
+        '''
+        Start (or restart) a timer
+        '''
+        self._cond.acquire()
+        try:
+            if not timer.active:
+                self._pending += 1
+            timer.active = True
+            timer.when = time.time() + timer.delay
+            self._count += 1
+            timer.seq = self._count
+            heapq.heappush(self._heap, (timer.when, timer.seq, timer))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def cancel(self, timer):
+        '''
+        Cancel a timer
+        '''
+        self._cond.acquire()
+        try:
+            if timer.active:
+                timer.active = False
+                self._pending -= 1
+        finally:
+            self._cond.release()
+
+    def pending(self):
+        '''
+        Return the number of active timers
+        '''
+        return self._pending
+
+    def stop(self):
+        '''
+        Stop the scheduler thread. The pending timers are not fired.
+        '''
+        self._cond.acquire()
+        try:
+            self._stop = True
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _next_timer(self):
+        '''
+        Wait for the next timer to expire and return it.
+        Return None when the scheduler is stopped.
+        '''
+        self._cond.acquire()
+        try:
+            while not self._stop:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                when, seq, timer = self._heap[0]
+                if not timer.active or timer.seq != seq:
+                    #Cancelled or restarted timer
+                    heapq.heappop(self._heap)
+                    continue
+                delay = when - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                timer.active = False
+                self._pending -= 1
+                return timer
+            return None
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        '''
+        Fire the timers
+        '''
+        while True:
+            timer = self._next_timer()
+            if timer is None:
+                return
+            try:
+                timer.function(*timer.args)
+            except:
+                self.log.error("Error in timer %s : %s" % (timer.function, traceback.format_exc()))
+
+class CommandSender:
+    '''
+    Send the commands to telldusd in their own thread, in order.
+    The calls to telldusd block until the RF frame is sent : the timers
+    only queue the commands, so a slow tellstick doesn't delay them.
+    @param log : a logger
+    '''
+    def __init__(self, log):
+        '''
+        Init the sender and start its thread
+        '''
+        self.log = log
+        self._queue = deque()
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(None, self._run, "telldus-sender", (), {})
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def send(self, function, args):
+        '''
+        Queue a command
+        '''
+        self._cond.acquire()
+        try:
+            self._queue.append((function, args))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def pending(self):
+        '''
+        Return the number of queued commands
+        '''
+        return len(self._queue)
+
+    def stop(self):
+        '''
+        Stop the sender thread. The queued commands are not sent.
+        '''
+        self._cond.acquire()
+        try:
+            self._stop = True
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _next_command(self):
+        '''
+        Wait for the next command and return it.
+        Return None when the sender is stopped.
+        '''
+        self._cond.acquire()
+        try:
+            while not self._stop:
+                if self._queue:
+                    return self._queue.popleft()
+                self._cond.wait()
+            return None
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        '''
+        Send the commands
+        '''
+        while True:
+            command = self._next_command()
+            if command is None:
+                return
+            function, args = command
+            try:
+                function(*args)
+            except:
+                self.log.error("Error sending command %s : %s" % (function, traceback.format_exc()))
+
 class TelldusAPI:
     '''
     Telldus plugin library
@@ -206,6 +441,10 @@ class TelldusAPI:
         self._buttons = None
         self._deviceeventq = None
         self._sensoreventq = None
+        #The timers of the event queues
+        self._timers = TimerScheduler(self.log)
+        #The thread which sends the commands of the batches
+        self._sender = CommandSender(self.log)
         self.log.debug("telldusAPI.__init__ : Look for telldus-core")
         # Initialize tellDus API
         try:
@@ -237,7 +476,7 @@ class TelldusAPI:
             self.log.error("Error removing the previuos device event queue : %s" % \
                      (traceback.format_exc()))
         try:
-            self._deviceeventq = DeviceEventQueue(self, self._delayrf, self._telldusd)
+            self._deviceeventq = DeviceEventQueue(self, self._delayrf, self._telldusd, self._timers, self._sender)
         except:
             self.log.error("Error creating the device event queue : %s" % \
                      (traceback.format_exc()))
@@ -248,7 +487,7 @@ class TelldusAPI:
         #    self.log.error("Error removing the previuos sensor event queue : %s" % \
         #             (traceback.format_exc()))
         #try:
-        #    self._sensoreventq = SensorEventQueue(self, self._delayrf, self._telldusd)
+        #    self._sensoreventq = SensorEventQueue(self, self._delayrf, self._telldusd, self._timers)
         #except:
         #    self.log.error("Error creating the sensor event queue : %s" % \
         #             (traceback.format_exc()))
@@ -282,6 +521,8 @@ class TelldusAPI:
             self._deviceeventq.unregister()
         if self._sensoreventq != None:
             self._sensoreventq.unregister()
+        self._timers.stop()
+        self._sender.stop()
         self.log.debug("unregister : Done :-)")
 
     def memory_usage(self, which):
@@ -299,6 +540,7 @@ class TelldusAPI:
             data.append("sent timers : %s items, %s bytes" % (self._deviceeventq.memory_usage(MEMORY_STIMER)))
             data.append("ACKs to send : %s items, %s bytes" % (self._deviceeventq.memory_usage(MEMORY_ACK)))
             data.append("last commands sent : %s items, %s bytes" % (self._deviceeventq.memory_usage(MEMORY_LAST)))
+            data.append("pending timers : %s items, %s bytes" % (self.memory_usage(MEMORY_TIMERS)))
             if self._plugin.lightext == True:
                 data.append("scenes : %s items, %s bytes" % (self._plugin.lighting.memory_usage(MEMORY_LIGHTING_SCENE)))
             return data
@@ -321,6 +563,8 @@ class TelldusAPI:
                 return self._deviceeventq.memory_usage(MEMORY_ACK)
             elif which == MEMORY_LAST:
                 return self._deviceeventq.memory_usage(MEMORY_LAST)
+            elif which == MEMORY_TIMERS:
+                return self._timers.pending(), asizeof(self._timers)
             elif which == MEMORY_LIGHTING_SCENE:
                 if self._plugin.lightext == True:
                     return self._plugin.lighting.memory_usage(MEMORY_LIGHTING_SCENE)
@@ -868,15 +1112,20 @@ class DeviceEventQueue:
     @param parent : the library used to sent the xpl message
     @param delay_rf : the delay to filter RF messages
     @param telldusd : the "daemon" used to communicate with the tellstick
+    @param timers : the TimerScheduler which runs the timers
+    @param sender : the CommandSender which sends the batch commands
     '''
-    def __init__(self, parent, delayrf, telldusd):
+    def __init__(self, parent, delayrf, telldusd, timers, sender):
         '''
         Init the class
         '''
         self._delayrf = delayrf
         self._telldusd = telldusd
         self._parent = parent
-        #The timers used to filter the incoming RF commands.
+        self._timers = timers
+        self._sender = sender
+        #The timers used to filter the incoming RF commands,
+        #by (deviceid, method, value).
         self._received_timers = dict()
         self._refused_timers = dict()
         #The timers used to send the batch jobs.
@@ -998,7 +1247,8 @@ class DeviceEventQueue:
 
     def _send_batch_timer(self, deviceid, method, value):
         '''
-        Used by a timer to send a message.
+        Used by a timer to send a message. The command is sent by the
+        sender thread, the timers thread must not block on telldusd.
         @param id : id of device of the ack to send
         @param method : method of device of the ack to send
         @param value : id of device of the ack to send
@@ -1006,7 +1256,7 @@ class DeviceEventQueue:
         print "_send_batch_timer deviceid=%s, method=%s, value=%s" % (deviceid, method, value)
         self._lastsents[deviceid] = {'method': method,
                             'value' : value}
-        self._telldusd.commands[method](deviceid, value)
+        self._sender.send(self._telldusd.commands[method], [deviceid, value])
 
     def add_batch(self, deviceid, method, value, delay):
         '''
@@ -1020,7 +1270,7 @@ class DeviceEventQueue:
         ##### PROBLEME DE PASSAGE DE PARAMETRE POTENTIEL
         try :
             DEVICEEVENTLOCK.acquire()
-            timer = Timer(delay, self._send_batch_timer, [deviceid, method, value])
+            timer = self._timers.timer(delay, self._send_batch_timer, [deviceid, method, value])
             self._sent_timers[deviceid].add(timer)
             self._fifos[deviceid].append({'method': method,
                                 'value' : value})
@@ -1065,6 +1315,7 @@ class DeviceEventQueue:
         '''
         #print "_receive : deviceid=%s, method=%s, value=%s, callbackid=%s" % (deviceid, method, value, callbackid)
         #print "type value=%s" % (type(value))
+        self._received_timers.pop((deviceid, method, value), None)
         try :
             DEVICEEVENTLOCK.acquire()
                 #print "del received_timers"
@@ -1165,51 +1416,27 @@ class DeviceEventQueue:
         '''
         Reset a timer if needed
         '''
-        try :
-            #Try to cancel the timer
-            #If it does not exist, th exception is catch silently
-            if deviceid in self._received_timers and \
-              method in self._received_timers[deviceid] and \
-              value in self._received_timers[deviceid][method] :
-                self._received_timers[deviceid][method][value].cancel()
-                return True
-            #self._received_timers[deviceid].cancel()
-            return False
-        except :
-            #print "exception"
+        timer = self._received_timers.get((deviceid, method, value))
+        if timer is None:
             return False
+        timer.cancel()
+        return True
 
     def _create_receive_timer(self, deviceid, method, value, callbackid):
         '''
         Create a timer
         '''
         #start timer with a delay (adjust the delay to suit your needs)
-        timer = Timer(self._delayrf, self._receive, args=[deviceid, method, value, callbackid])
-        timer.start()
-        self._received_timers[deviceid] = {method : { value : timer}}
-        #print "receive_timer for %s:%s:%s created" % (deviceid, method, value)
-        #self._received_timers[deviceid] = timer
+        self._received_timers[(deviceid, method, value)] = \
+            self._timers.schedule(self._delayrf, self._receive, [deviceid, method, value, callbackid])
 
     def _del_receive_timer(self, deviceid, method, value):
         '''
         Delete a received timer if needed
         '''
-        try :
-            self._reset_receive_timer(deviceid, method, value)
-            del(self._received_timers[deviceid][method][value])
-        except :
-            pass
-        try :
-            if len(self._received_timers[deviceid][method]) == 0:
-                del(self._received_timers[deviceid][method])
-        except :
-            pass
-        try :
-            if len(self._received_timers[deviceid]) == 0:
-                del(self._received_timers[deviceid])
-        except :
-            pass
-        #print "receivetimer for %s:%s:%s deleted" % (deviceid, method, value)
+        timer = self._received_timers.pop((deviceid, method, value), None)
+        if timer is not None:
+            timer.cancel()
 
     def _create_refuse_timer(self, deviceid, method, value, callbackid):
         '''
@@ -1217,11 +1444,8 @@ class DeviceEventQueue:
         any more message
         '''
         #start timer with a delay (adjust the delay to suit your needs)
-        timer = Timer(self._delayrf, self._del_refuse_timer, args=[deviceid, method, value])
-        timer.start()
-        self._refused_timers[deviceid] = {method : { value : timer}}
-        #print "refused timer for %s:%s:%s created" % (deviceid, method, value)
-        #self._received_timers[deviceid] = timer
+        self._refused_timers[(deviceid, method, value)] = \
+            self._timers.schedule(self._delayrf, self._del_refuse_timer, [deviceid, method, value])
 
     def _del_refuse_timer(self, deviceid, method, value):
         '''
@@ -1229,37 +1453,18 @@ class DeviceEventQueue:
         '''
         try :
             DEVICEEVENTLOCK.acquire()
-            if self._reset_receive_timer(deviceid, method, value) :
-                self._del_receive_timer(deviceid, method, value)
-            try :
-                del(self._refused_timers[deviceid][method][value])
-            except :
-                pass
-            try :
-                if len(self._refused_timers[deviceid][method]) == 0:
-                    del(self._refused_timers[deviceid][method])
-            except :
-                pass
-            try :
-                if len(self._refused_timers[deviceid]) == 0:
-                    del(self._refused_timers[deviceid])
-            except :
-                pass
+            self._del_receive_timer(deviceid, method, value)
+            self._refused_timers.pop((deviceid, method, value), None)
             DEVICEEVENTLOCK.release()
         except:
             print traceback.format_exc()
             DEVICEEVENTLOCK.release()
-        #print "refusetimer for %s:%s:%s deleted" % (deviceid, method, value)
 
     def _check_refuse_timer(self, deviceid, method, value):
         '''
         Check if the queue for this (deviceid,method,value) is opened or not
         '''
-        try :
-            timer = self._refused_timers[deviceid][method][value]
-            return False
-        except :
-            return True
+        return (deviceid, method, value) not in self._refused_timers
 
 class SensorEventQueue:
     '''
@@ -1268,15 +1473,18 @@ class SensorEventQueue:
     @param parent : the library used to sent the xpl message
     @param delay_rf : the delay to filter RF messages
     @param telldusd : the "daemon" used to communicate with the tellstick
+    @param timers : the TimerScheduler which runs the timers
     '''
-    def __init__(self, parent, delayrf, telldusd):
+    def __init__(self, parent, delayrf, telldusd, timers):
         '''
         Init the class
         '''
         self._delayrf = delayrf
         self._telldusd = telldusd
         self._parent = parent
-        #The timers used to filter the incoming RF commands.
+        self._timers = timers
+        #The timers used to filter the incoming RF commands,
+        #by (deviceid, method, value).
         self._received_timers = dict()
         self._refused_timers = dict()
         #Register the device event procedure.
@@ -1315,6 +1523,7 @@ class SensorEventQueue:
         '''
         #print "_receive : deviceid=%s, method=%s, value=%s, callbackid=%s" % (deviceid, method, value, callbackid)
         #print "type value=%s" % (type(value))
+        self._received_timers.pop((deviceid, datatype, value), None)
         try :
             #This is a new event.
             #We need to send a cmnd message (for a ligthing controller)
@@ -1350,51 +1559,27 @@ class SensorEventQueue:
         '''
         Reset a timer if needed
         '''
-        try :
-            #Try to cancel the timer
-            #If it does not exist, th exception is catch silently
-            if deviceid in self._received_timers and \
-              datatype in self._received_timers[deviceid] and \
-              value in self._received_timers[deviceid][datatype] :
-                self._received_timers[deviceid][datatype][value].cancel()
-                return True
-            #self._received_timers[deviceid].cancel()
-            return False
-        except :
-            #print "exception"
+        timer = self._received_timers.get((deviceid, datatype, value))
+        if timer is None:
             return False
+        timer.cancel()
+        return True
 
     def _create_receive_timer(self, protocol, model, deviceid, datatype, value, timestamp, callbackid):
         '''
         Create a timer
         '''
         #start timer with a delay (adjust the delay to suit your needs)
-        timer = Timer(self._delayrf, self._receive, args=[protocol, model, deviceid, datatype, value, timestamp, callbackid])
-        timer.start()
-        self._received_timers[deviceid] = {datatype : { value : timer}}
-        #print "receive_timer for %s:%s:%s created" % (deviceid, datatype, value)
-        #self._received_timers[deviceid] = timer
+        self._received_timers[(deviceid, datatype, value)] = \
+            self._timers.schedule(self._delayrf, self._receive, [protocol, model, deviceid, datatype, value, timestamp, callbackid])
 
     def _del_receive_timer(self, deviceid, datatype, value):
         '''
         Delete a received timer if needed
         '''
-        try :
-            self._reset_receive_timer(deviceid, datatype, value)
-            del(self._received_timers[deviceid][datatype][value])
-        except :
-            pass
-        try :
-            if len(self._received_timers[deviceid][datatype]) == 0:
-                del(self._received_timers[deviceid][datatype])
-        except :
-            pass
-        try :
-            if len(self._received_timers[deviceid]) == 0:
-                del(self._received_timers[deviceid])
-        except :
-            pass
-        #print "receivetimer for %s:%s:%s deleted" % (deviceid, datatype, value)
+        timer = self._received_timers.pop((deviceid, datatype, value), None)
+        if timer is not None:
+            timer.cancel()
 
     def _create_refuse_timer(self, protocol, model, deviceid, datatype, value, timestamp, callbackid):
         '''
@@ -1402,11 +1587,8 @@ class SensorEventQueue:
         any more message
         '''
         #start timer with a delay (adjust the delay to suit your needs)
-        timer = Timer(self._delayrf, self._del_refuse_timer, args=[deviceid, datatype, value])
-        timer.start()
-        self._refused_timers[deviceid] = {datatype : { value : timer}}
-        #print "refused timer for %s:%s:%s created" % (deviceid, datatype, value)
-        #self._received_timers[deviceid] = timer
+        self._refused_timers[(deviceid, datatype, value)] = \
+            self._timers.schedule(self._delayrf, self._del_refuse_timer, [deviceid, datatype, value])
 
     def _del_refuse_timer(self, deviceid, datatype, value):
         '''
@@ -1414,37 +1596,18 @@ class SensorEventQueue:
         '''
         try :
             SENSOREVENTLOCK.acquire()
-            if self._reset_receive_timer(deviceid, datatype, value) :
-                self._del_receive_timer(deviceid, datatype, value)
-            try :
-                del(self._refused_timers[deviceid][datatype][value])
-            except :
-                pass
-            try :
-                if len(self._refused_timers[deviceid][datatype]) == 0:
-                    del(self._refused_timers[deviceid][datatype])
-            except :
-                pass
-            try :
-                if len(self._refused_timers[deviceid]) == 0:
-                    del(self._refused_timers[deviceid])
-            except :
-                pass
+            self._del_receive_timer(deviceid, datatype, value)
+            self._refused_timers.pop((deviceid, datatype, value), None)
             SENSOREVENTLOCK.release()
         except:
             print traceback.format_exc()
             SENSOREVENTLOCK.release()
-        #print "refusetimer for %s:%s:%s deleted" % (deviceid, datatype, value)
 
     def _check_refuse_timer(self, deviceid, datatype, value):
         '''
-        Check if the queue for this (deviceid,method,value) is opened or not
+        Check if the queue for this (deviceid,datatype,value) is opened or not
         '''
-        try :
-            timer = self._refused_timers[deviceid][datatype][value]
-            return False
-        except :
-            return True
+        return (deviceid, datatype, value) not in self._refused_timers
 
 class Telldusd:
     """
@@ -3,12 +3,24 @@
 Velbus domogik plugin
 """
 
+import logging
 import serial
 import socket
 import traceback
 import threading
 from Queue import Queue
 
+# frame : start byte, priority, address, rtr/size, data (0 to 8 bytes),
+# checksum, end byte
+START_BYTE = 0x0F
+END_BYTE = 0x04
+PRIORITIES = (0xF8, 0xFB)
+MAX_DATA_SIZE = 8
+# max number of bytes read at once from the bus
+READ_SIZE = 9999
+# max time to wait for data on the serial device, in seconds
+READ_TIMEOUT = 1
+
 MODULE_TYPES = {
   1 : {"id": "VMB8PB", "subtype": "INPUT"},
   2 : {"id": "VMB1RY", "subtype": "RELAY", "channels": 1},
@@ -144,6 +156,59 @@ class VelbusException(Exception):
         return repr(self.value)
 
 
+class VelbusFramer:
+    """ Split the bytes read from the bus in valid velbus frames
+        Garbage and invalid frames are skipped : the framer resynchronises
+        on the next start byte
+    """
+
+    def __init__(self):
+        """ Init object
+        """
+        self._buffer = bytearray()
+        # number of bytes skipped while looking for a valid frame
+        self.skipped = 0
+
+    def feed(self, data):
+        """ Add data read from the bus and return the complete frames
+            @param data : bytes read (may hold several frames or a part of a frame)
+            @return a list of valid frames (str)
+        """
+        buf = self._buffer
+        buf.extend(data)
+        size = len(buf)
+        frames = []
+        pos = 0
+        while pos < size:
+            if buf[pos] != START_BYTE:
+                start = buf.find(chr(START_BYTE), pos)
+                if start == -1:
+                    start = size
+                self.skipped += start - pos
+                pos = start
+                continue
+            if size - pos < 4:
+                break
+            data_size = buf[pos + 3] & 0x0F
+            if buf[pos + 1] not in PRIORITIES or data_size > MAX_DATA_SIZE:
+                pos += 1
+                self.skipped += 1
+                continue
+            end = pos + 6 + data_size
+            if end > size:
+                break
+            if buf[end - 1] != END_BYTE or \
+               (-sum(buf[pos:end - 2])) & 0xFF != buf[end - 2]:
+                pos += 1
+                self.skipped += 1
+                continue
+            frames.append(str(buf[pos:end]))
+            pos = end
+        if pos:
+            del buf[:pos]
+        return frames
+
+
 class VelbusDev:
     """
     Velbus domogik plugin
@@ -162,6 +227,20 @@ class VelbusDev:
         self._dev = None
         self._devtype = 'serial'
         self._nodes = {}
+        self._framer = VelbusFramer()
+
+        # (message type, module type) => function which processes it
+        # module type is None for the general parsers
+        self._handlers = {}
+        for name in dir(self):
+            parts = name.split("_")
+            if name.startswith("_process_") and len(parts) in (3, 4) and \
+               all([part.isdigit() for part in parts[2:]]):
+                if len(parts) == 3:
+                    key = (int(parts[2]), None)
+                else:
+                    key = (int(parts[2]), int(parts[3]))
+                self._handlers[key] = getattr(self, name)
 
         # Queue for writing packets to Rfxcom
         self.write_rfx = Queue()
@@ -187,7 +266,7 @@ class VelbusDev:
                 self._dev = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self._dev.connect( addr )
             else:
-                self._dev = serial.Serial(device, 38400, timeout=0)
+                self._dev = serial.Serial(device, 38400, timeout=READ_TIMEOUT)
             self._log.info("VELBUS opened")
         except:
             error = "Error while opening Velbus : %s. Check if it is the good device or if you have the good permissions on it." % device
@@ -197,6 +276,8 @@ class VelbusDev:
         """ Close the open device
         """
         self._log.info("Close VELBUS")
+        # wake up the write thread
+        self.write_rfx.put_nowait(None)
         try:
             self._dev.close()
         except:
@@ -277,6 +358,8 @@ class VelbusDev:
         self._log.info("write deamon")
         while not self._stop.isSet():
             res = self.write_rfx.get(block = True)
+            if res is None:
+                break
             self._log.debug("start sending packet to {0}".format(hex(int(res["address"]))))
 	    # start (8bit)
             packet = chr(0x0F)
@@ -322,16 +405,18 @@ class VelbusDev:
             return
 
     def read(self):
-        """ Read data from the velbus line
+        """ Read data from the velbus line and process the complete frames
         """
         if self._devtype == 'socket':
-            data = self._dev.recv(9999)
+            data = self._dev.recv(READ_SIZE)
         else:
-            data = self._dev.read(9999)
-        if len(data) >= 6:
-            if ord(data[0]) == 0x0f:
-                size = ord(data[3]) & 0x0F
-                self._parser(data[0:6+size])
+            # wait for the first byte, then read all the waiting bytes
+            data = self._dev.read(1)
+            waiting = self._dev.inWaiting()
+            if waiting:
+                data += self._dev.read(min(waiting, READ_SIZE))
+        for frame in self._framer.feed(data):
+            self._parser(frame)
 
     def _checksum(self, data):
         """
@@ -350,66 +435,40 @@ class VelbusDev:
 
     def _parser(self, data):
         """
-           parse the velbus packet
+           parse a velbus packet (already checked by the framer)
         """
-        assert isinstance(data, str)
-        assert len(data) > 0
-        assert len(data) >= 6
-        assert ord(data[0]) == 0x0f
-        self._log.debug("starting parser: %s" % data.encode('hex'))
-        if len(data) > 14:
-            self._log.warning("Velbus message: maximum %s bytes, this one is %s",
-                str(14, str(len(data))))
-            return
-        if ord(data[-1]) != 0x04:
-            self._log.warning("Velbus message: end byte not correct")
-            return data
-        if ord(data[1]) != 0xfb and ord(data[1]) != 0xf8:
-            self._log.warning("Velbus message: unrecognized priority")
-            return
-        data_size = ord(data[3]) & 0x0F
-        if data_size + 6 != len(data):
-            self._log.warning("length of data size does not match actual length of message")
-            return
-        if not self._checksum(data[:-2]) == data[-2]:
-            self._log.warning("Packet has no valid checksum")
-            return
-        if data_size > 0:
-            if ord(data[4]) in MSG_TYPES:
-                # lookup the module type
-                try:
-                    if ord(data[2]) in self._nodes.keys():
-                        mtype = self._nodes[ord(data[2])]
-                    else:
-                        mtype = None
-                except KeyError:
-                    mtype = None
-                if mtype:
-                    self._log.debug("Received message with type: '%s' address: %s module: %s(%s)" % (MSG_TYPES[ord(data[4])], ord(data[2]), MODULE_TYPES[mtype]['id'], mtype) )
-                else:
-                    self._log.debug("Received message with type: '%s' address: %s module: UNKNOWN" % (MSG_TYPES[ord(data[4])], ord(data[2])) )
-                # first try the module specifick parser
-                parsed = False
-                if mtype:
-                    try:
-                        methodcall = getattr(self, "_process_{0}_{1}".format(ord(data[4]), mtype))
-                        methodcall( data )
-                        parsed = True
-                    except AttributeError:
-                        self._log.debug("Messagetype module specifick parser not implemented")	
-                if not parsed:
-                    try:
-                        methodcall = getattr(self, "_process_{0}".format(ord(data[4])))
-                        methodcall( data )
-                    except AttributeError:
-                        self._log.debug("Messagetype unimplemented {0}".format(ord(data[4])))
-            else:
-                self._log.warning("Received message with unknown type {0}".format(ord(data[4])))
-        else:
+        debug = self._log.isEnabledFor(logging.DEBUG)
+        if debug:
+            self._log.debug("starting parser: %s" % data.encode('hex'))
+        if len(data) == 6:
             if (ord(data[3]) & 0x40 == 0x40):
                 self._log.debug("Received module type request")			
             else:
                 self._log.warning("zero sized message received without rtr set")
+            return
+        msg_type = ord(data[4])
+        if msg_type not in MSG_TYPES:
+            self._log.warning("Received message with unknown type {0}".format(msg_type))
+            return
+        # lookup the module type
+        mtype = self._nodes.get(ord(data[2]))
+        if debug:
+            if mtype:
+                self._log.debug("Received message with type: '%s' address: %s module: %s(%s)" % (MSG_TYPES[msg_type], ord(data[2]), MODULE_TYPES[mtype]['id'], mtype) )
+            else:
+                self._log.debug("Received message with type: '%s' address: %s module: UNKNOWN" % (MSG_TYPES[msg_type], ord(data[2])) )
+        # first try the module specifick parser
+        handler = self._handlers.get((msg_type, mtype))
+        if handler is None:
+            handler = self._handlers.get((msg_type, None))
+        if handler is None:
+            if debug:
+                self._log.debug("Messagetype unimplemented {0}".format(msg_type))
+            return
+        try:
+            handler(data)
+        except:
+            self._log.error("Error while processing message type {0} : {1}".format(msg_type, traceback.format_exc()))
 
 # procee the velbus received messages
 # format will beL